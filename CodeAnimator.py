@@ -1,13 +1,47 @@
+import argparse
+import cProfile
+import gc
+import io
 import json
 import os
 import platform
+import pstats
 import shutil
+import signal
+import socketserver
+import string
+import subprocess
 import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from fractions import Fraction
+from pathlib import Path
 
 from manim import *
-from pygments import lex
-from pygments.lexers import TextLexer, get_lexer_for_filename
-from pygments.token import Token
+from manim.renderer.cairo_renderer import CairoRenderer
+from manim.scene.scene_file_writer import SceneFileWriter
+from manim.utils.file_ops import write_to_movie
+
+from RenderPlan import (
+    FRAME_SIZES,
+    SourceIndex,
+    build_diff_plan,
+    build_render_plan,
+    diff_line_range,
+    parse_line_groups,
+    timeline_segment_keys,
+)
+
+try:
+    import yaml  # Optional, only needed for YAML batch job files
+except ImportError:
+    yaml = None
+
+try:
+    import resource  # Unix only, render limits are skipped without it
+except ImportError:
+    resource = None
 
 # Use platform-appropriate monospace font
 # Menlo is macOS-only, Liberation Mono is available in Linux/Docker
@@ -27,17 +61,507 @@ if _orientation not in ["landscape", "portrait"]:
         pass
 
 # Set frame dimensions based on orientation
+config.frame_width, config.frame_height = FRAME_SIZES[_orientation]
 if _orientation == "portrait":
-    config.frame_width = 9.0
-    config.frame_height = 16.0
     config.pixel_width = 1080
     config.pixel_height = 1920
 else:
-    config.frame_width = 16.0
-    config.frame_height = 9.0
     config.pixel_width = 1920
     config.pixel_height = 1080
 
+# Render mode from environment variable (set by backend)
+# "stream" pipes frames straight into one ffmpeg process instead of writing
+# a partial movie file per play/wait and concatenating them at the end
+_render_mode = os.environ.get("ANIM_RENDER_MODE", "").strip()
+FFMPEG_BIN = shutil.which("ffmpeg")
+
+# Directory of cached timeline segments (set by backend), one file per
+# play/wait so a config tweak only re-renders the segments it changes. Only
+# jobs with "segment_cache" in their config use it, everything else streams
+# into one ffmpeg
+_segment_cache_dir = os.environ.get("ANIM_SEGMENT_CACHE", "").strip()
+# Bump when a change to the renderer changes what a segment looks like
+SEGMENT_CACHE_VERSION = 1
+
+# Where to write phase timings as JSON when the render is done (set by
+# backend, its stdout goes nowhere so DEBUG prints can't be scraped)
+_metrics_path = os.environ.get("ANIM_METRICS_PATH", "").strip()
+# Opt-in profiling (set by backend per job): the render runs under cProfile
+# and the profile plus phase timers are written to this directory
+_profile_dir = os.environ.get("ANIM_PROFILE_DIR", "").strip()
+# Resource limits for the render (set by backend), JSON with memory_mb,
+# cpu_seconds and open_files, see apply_render_limits
+try:
+    _render_limits = json.loads(os.environ.get("ANIM_RENDER_LIMITS") or "{}")
+except json.JSONDecodeError:
+    _render_limits = {}
+# The one stderr line the backend turns into a per-job error when a limit hits
+LIMIT_PREFIX = "RENDER LIMIT: "
+
+# Matches what Manim's own writer produces, used when no profile is passed
+DEFAULT_ENCODER_PROFILE = {
+    "codec": "libx264",
+    "crf": 23,
+    "pix_fmt": "yuv420p",
+    "container": "mp4",
+}
+CONTAINER_EXTENSIONS = {
+    "mp4": ".mp4",
+    "webm": ".webm",
+    "gif": ".gif",
+    "apng": ".png",  # APNG plays anywhere a .png does (READMEs!)
+}
+
+
+class StreamingFileWriter(SceneFileWriter):
+    """File writer that feeds raw frames to a single long-lived ffmpeg process.
+
+    Encoding overlaps with rendering (ffmpeg runs in its own process) and the
+    finished movie is written in one go, so there is no partial-file stage
+    and no concat pass.
+    """
+
+    def __init__(self, renderer, scene_name, **kwargs):
+        self.encoder = None
+        self.stream_file_path = None
+        self.encoder_profile = DEFAULT_ENCODER_PROFILE
+        # Adaptive frame rate state (only used when the profile sets hold_fps)
+        self.nut_container = None
+        self.nut_stream = None
+        self.frame_index = 0
+        self.last_frame = None
+        self.last_pts = -1
+        self.frames_encoded = 0
+        # Segment cache state (only used when segment_dir is set)
+        self.segment_dir = None
+        self.segment_path = None
+        self.segments = []
+        self.segments_reused = 0
+        self.stream_target = None
+        # Time spent feeding and waiting on ffmpeg, for render metrics
+        self.encode_seconds = 0.0
+        super().__init__(renderer, scene_name, **kwargs)
+
+    def _extension(self):
+        return CONTAINER_EXTENSIONS.get(
+            self.encoder_profile.get("container", "mp4"), ".mp4"
+        )
+
+    def supports_segments(self):
+        # Concat with -c copy needs a constant frame rate and a container
+        # that can be joined, palette-based GIF/APNG need the whole video.
+        # Fragmented (live) MP4 has to come out of one ffmpeg as it renders
+        container = self.encoder_profile.get("container", "mp4")
+        return container in ("mp4", "webm") and not (
+            self.encoder_profile.get("hold_fps")
+            or self.encoder_profile.get("fragmented")
+        )
+
+    def start_segment(self, key):
+        """Send the frames that follow to the cached segment `key`.
+
+        Returns True if that segment is cached already, the caller then skips
+        rendering it.
+        """
+        self._close_encoder()
+        self.movie_file_path = self.movie_file_path.with_suffix(self._extension())
+        self.segment_path = Path(self.segment_dir) / f"{key}{self._extension()}"
+        held_path = self._held_segment_path()
+        try:
+            # Cache cleanup can delete the cached file any time, concat reads
+            # the job's own link to it
+            link_or_copy(self.segment_path, held_path)
+        except FileNotFoundError:
+            return False
+        try:
+            self.segment_path.touch()  # Keep it fresh for cache cleanup
+        except OSError:
+            pass
+        self.segments.append(held_path)
+        self.segments_reused += 1
+        return True
+
+    def _held_segment_path(self):
+        # Next to the movie, numbered since a timeline can repeat a segment
+        return self.movie_file_path.with_name(
+            f"{self.movie_file_path.stem}.{len(self.segments):04d}{self._extension()}"
+        )
+
+    def _cache_segment(self, held_path):
+        # link_or_copy goes through a temp name, the cached segment only ever
+        # appears whole
+        try:
+            link_or_copy(held_path, self.segment_path)
+        except OSError as e:
+            print(f"WARNING: Could not cache segment: {e}")
+
+    def _encoder_args(self):
+        profile = self.encoder_profile
+        codec = profile.get("codec", "libx264")
+        container = profile.get("container", "mp4")
+
+        args = ["-c:v", codec]
+        if profile.get("crf") is not None:
+            args += ["-crf", str(profile["crf"])]
+            if codec == "libvpx-vp9":
+                args += ["-b:v", "0", "-row-mt", "1"]  # Constant quality mode
+        if profile.get("preset"):
+            args += ["-preset", profile["preset"]]
+        if profile.get("tune"):
+            args += ["-tune", profile["tune"]]
+        if profile.get("gop"):
+            args += ["-g", str(profile["gop"])]
+        elif profile.get("fragmented"):
+            # A fragment starts at every keyframe, about one per second
+            args += ["-g", str(round(config.frame_rate))]
+
+        # Holds arrive with gaps in their timestamps, either keep them as real
+        # VFR or let ffmpeg's fps filter duplicate frames back to a fixed rate
+        video_filter = profile.get("filter")
+        if profile.get("hold_fps"):
+            if profile.get("normalize"):
+                fps_filter = f"fps={config.frame_rate}"
+                video_filter = (
+                    f"{fps_filter},{video_filter}" if video_filter else fps_filter
+                )
+            else:
+                args += ["-fps_mode", "passthrough"]
+        if video_filter:
+            args += ["-filter_complex", video_filter]
+        if profile.get("pix_fmt"):
+            args += ["-pix_fmt", profile["pix_fmt"]]
+
+        if container == "mp4" and profile.get("fragmented"):
+            # moov up front and a moof+mdat per keyframe, the file is playable
+            # from the first fragment while the rest is still encoding
+            args += ["-movflags", "+frag_keyframe+empty_moov+default_base_moof"]
+            args += ["-flush_packets", "1"]  # Out to disk per fragment, not per 32 KB
+        elif container == "mp4":
+            args += ["-movflags", "+faststart"]
+        elif container in ("gif", "apng"):
+            args += ["-loop" if container == "gif" else "-plays", "0"]
+        return args + ["-f", container]
+
+    def _open_encoder(self, frame):
+        height, width = frame.shape[:2]
+        self.movie_file_path = self.movie_file_path.with_suffix(self._extension())
+        # Write to a temp name next to the movie so nothing looks finished
+        # until ffmpeg exits (segments too, so progress can see them grow)
+        if self.segment_path is not None:
+            self.stream_target = self._held_segment_path()
+            self.stream_file_path = self.movie_file_path.with_name(
+                f"{self.segment_path.stem}.part"
+            )
+        else:
+            self.stream_target = self.movie_file_path
+            self.stream_file_path = self.movie_file_path.with_suffix(".part")
+
+        adaptive = bool(self.encoder_profile.get("hold_fps"))
+        if adaptive:
+            # Raw video has no timestamps, NUT carries them over the pipe
+            input_args = ["-f", "nut"]
+        else:
+            input_args = [
+                "-f",
+                "rawvideo",
+                "-pix_fmt",
+                "rgba",
+                "-s",
+                f"{width}x{height}",
+                "-r",
+                str(config.frame_rate),
+            ]
+
+        command = [
+            FFMPEG_BIN,
+            "-y",
+            "-loglevel",
+            "error",
+            *input_args,
+            "-i",
+            "-",
+            "-an",
+            *self._encoder_args(),
+            str(self.stream_file_path),
+        ]
+        self.encoder = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+        if adaptive:
+            import av  # Manim's own video dependency
+
+            rate = Fraction(config.frame_rate).limit_denominator(1001)
+            self.nut_container = av.open(self.encoder.stdin, "w", format="nut")
+            self.nut_stream = self.nut_container.add_stream("rawvideo", rate=rate)
+            self.nut_stream.width = width
+            self.nut_stream.height = height
+            self.nut_stream.pix_fmt = "rgba"
+
+    def _mux_frame(self, frame, pts):
+        import av
+
+        av_frame = av.VideoFrame.from_ndarray(frame, format="rgba")
+        av_frame.pts = pts
+        av_frame.time_base = 1 / Fraction(config.frame_rate).limit_denominator(1001)
+        for packet in self.nut_stream.encode(av_frame):
+            self.nut_container.mux(packet)
+        self.last_pts = pts
+        self.frames_encoded += 1
+
+    # No partial movie files in stream mode, every frame goes to the same pipe
+    def begin_animation(self, allow_write=False, file_path=None):
+        pass
+
+    def end_animation(self, allow_write=False):
+        pass
+
+    def write_frame(self, frame_or_renderer, num_frames=1):
+        if not write_to_movie():
+            return super().write_frame(frame_or_renderer, num_frames)
+
+        frame = frame_or_renderer
+        if self.encoder is None:
+            self._open_encoder(frame)
+
+        # Static holds (self.wait) arrive as one frame with num_frames > 1
+        started = time.perf_counter()
+        if self.nut_stream is None:
+            frame_bytes = frame.tobytes()
+            for _ in range(num_frames):
+                self.encoder.stdin.write(frame_bytes)
+            self.frames_encoded += num_frames
+        else:
+            # Motion goes out at full rate, holds only every 1/hold_fps seconds
+            hold_step = max(
+                1, round(config.frame_rate / self.encoder_profile["hold_fps"])
+            )
+            step = hold_step if num_frames > 1 else 1
+            for offset in range(0, num_frames, step):
+                self._mux_frame(frame, self.frame_index + offset)
+            self.last_frame = frame
+
+        self.frame_index += num_frames
+        self.encode_seconds += time.perf_counter() - started
+
+    def _close_encoder(self):
+        if self.encoder is None:
+            return
+
+        started = time.perf_counter()
+        if self.nut_container is not None:
+            # Close out the last hold so the video keeps its full length
+            # (two adjacent frames, ffmpeg guesses the last frame's duration
+            # from the gap before it)
+            for pts in (self.frame_index - 2, self.frame_index - 1):
+                if pts > self.last_pts:
+                    self._mux_frame(self.last_frame, pts)
+            for packet in self.nut_stream.encode():
+                self.nut_container.mux(packet)
+            self.nut_container.close()
+            self.nut_container = None
+            self.nut_stream = None
+
+        self.encoder.stdin.close()
+        returncode = self.encoder.wait()
+        self.encoder = None
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg exited with code {returncode}")
+
+        os.replace(self.stream_file_path, self.stream_target)
+        if self.segment_path is not None:
+            self.segments.append(self.stream_target)
+            self._cache_segment(self.stream_target)
+        self.encode_seconds += time.perf_counter() - started
+
+    def _concat_segments(self):
+        # Stream copy, the segments already are the encoded video
+        list_path = self.movie_file_path.with_suffix(".segments.txt")
+        with open(list_path, "w") as f:
+            for segment in self.segments:
+                f.write(f"file '{segment.resolve()}'\n")
+
+        container = self.encoder_profile.get("container", "mp4")
+        part_path = self.movie_file_path.with_suffix(".part")
+        command = [
+            FFMPEG_BIN,
+            "-y",
+            "-loglevel",
+            "error",
+            "-f",
+            "concat",
+            "-safe",
+            "0",
+            "-i",
+            str(list_path),
+            "-c",
+            "copy",
+        ]
+        if container == "mp4":
+            command += ["-movflags", "+faststart"]
+        command += ["-f", container, str(part_path)]
+        started = time.perf_counter()
+        try:
+            result = subprocess.run(command)
+        finally:
+            list_path.unlink()
+            for segment in self.segments:
+                segment.unlink(missing_ok=True)
+            self.encode_seconds += time.perf_counter() - started
+        if result.returncode != 0:
+            raise RuntimeError(f"ffmpeg concat exited with code {result.returncode}")
+        os.replace(part_path, self.movie_file_path)
+
+    def combine_to_movie(self):
+        if self.segment_dir is not None:
+            self._close_encoder()
+            if not self.segments:
+                return
+            print(
+                f"DEBUG: Reused {self.segments_reused} of {len(self.segments)} segments"
+            )
+            self._concat_segments()
+        else:
+            if self.encoder is None:
+                return
+            # Counted after the close, which muxes the frames ending the last hold
+            self._close_encoder()
+            logger.info(f"Encoded {self.frames_encoded} of {self.frame_index} frames")
+        self.print_file_ready_message(self.movie_file_path)
+
+
+class RenderLimitExceeded(Exception):
+    """The render ran into one of the limits set by apply_render_limits."""
+
+
+def _cpu_limit_hit(signum, frame):
+    raise RenderLimitExceeded("Render went over its CPU time limit")
+
+
+def _mapped_bytes():
+    # Address space already mapped (Manim, NumPy, Cairo...), Linux only,
+    # macOS doesn't enforce RLIMIT_AS anyway
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def apply_render_limits(limits):
+    """Set soft rlimits for the render about to start.
+
+    memory_mb and cpu_seconds are on top of what this process already uses,
+    so a warm batch worker or fork-server child gets the same budget as a
+    fresh one. Only soft limits change, the next job can raise them again.
+    """
+    if resource is None or not limits:
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    wanted = {}
+    if limits.get("cpu_seconds"):
+        used = int(usage.ru_utime + usage.ru_stime)
+        wanted[resource.RLIMIT_CPU] = used + int(limits["cpu_seconds"])
+        # SIGXCPU would kill us silently, turn it into a proper error
+        signal.signal(signal.SIGXCPU, _cpu_limit_hit)
+    if limits.get("memory_mb"):
+        headroom = int(limits["memory_mb"]) * 1024 * 1024
+        wanted[resource.RLIMIT_AS] = _mapped_bytes() + headroom
+    if limits.get("open_files"):
+        wanted[resource.RLIMIT_NOFILE] = int(limits["open_files"])
+    for kind, value in wanted.items():
+        _, hard = resource.getrlimit(kind)
+        if hard != resource.RLIM_INFINITY:
+            value = min(value, hard)
+        try:
+            resource.setrlimit(kind, (value, hard))
+        except (ValueError, OSError) as e:
+            print(f"WARNING: Could not set render limit {kind}: {e}")
+
+
+class ShiftBy(Animation):
+    """Move a mobject by a fixed vector, one shift of the whole group per frame.
+
+    `.animate.shift()` / `.animate.move_to()` go through Transform, which
+    copies the group twice and re-interpolates every point of every glyph on
+    every frame. A straight move only needs the delta since the last frame.
+    """
+
+    def __init__(self, mobject, vector, **kwargs):
+        self.vector = np.array(vector, dtype=float)
+        self.applied_alpha = 0.0
+        super().__init__(mobject, **kwargs)
+
+    def create_starting_mobject(self):
+        # Nothing to interpolate from, skip copying every glyph
+        return Mobject()
+
+    def begin(self):
+        self.applied_alpha = 0.0
+        super().begin()
+
+    def interpolate_mobject(self, alpha):
+        alpha = self.rate_func(alpha)
+        self.mobject.shift((alpha - self.applied_alpha) * self.vector)
+        self.applied_alpha = alpha
+
+
+def layout_lines(line_mobjects, y_positions, left_x, available_width, park_offset):
+    """Place every line in one pass over a single stacked points array.
+
+    Each line is left-aligned at `left_x`, centered on its y, and everything
+    is shrunk by one shared scale if the widest line doesn't fit. The lines
+    are then left parked `park_offset` to the left of their slot.
+
+    Returns (final_positions, width_scale, max_line_width), where
+    final_positions is an (n, 3) array of on-screen centers.
+    """
+    num_lines = len(line_mobjects)
+    final_positions = np.zeros((num_lines, 3))
+    final_positions[:, 0] = left_x
+    final_positions[:, 1] = y_positions
+
+    # Families keep each line's points contiguous, so one concat + reduceat
+    # gives every line's bounding box
+    submobjects = []
+    counts = np.zeros(num_lines, dtype=np.intp)
+    for line_idx, line_group in enumerate(line_mobjects):
+        for mob in line_group.family_members_with_points():
+            submobjects.append(mob)
+            counts[line_idx] += len(mob.points)
+    if not submobjects:
+        return final_positions, 1.0, 0.0
+
+    points = np.concatenate([mob.points for mob in submobjects])
+    has_points = counts > 0
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[has_points]
+    mins = np.minimum.reduceat(points, starts, axis=0)
+    maxs = np.maximum.reduceat(points, starts, axis=0)
+
+    widths = maxs[:, 0] - mins[:, 0]
+    max_line_width = float(widths.max())
+    width_scale = 1.0
+    if max_line_width > available_width:
+        width_scale = available_width / max_line_width
+
+    targets = final_positions[has_points]
+    targets[:, 0] += width_scale * widths / 2
+    final_positions[has_points] = targets
+
+    # Scale about each line's own center, then move that center to its slot
+    centers = (mins + maxs) / 2
+    offsets = targets - centers * width_scale
+    offsets[:, 0] -= park_offset
+    if width_scale != 1.0:
+        points *= width_scale
+    points += np.repeat(offsets, counts[has_points], axis=0)
+
+    start = 0
+    for mob in submobjects:
+        end = start + len(mob.points)
+        mob.points = points[start:end]
+        start = end
+
+    return final_positions, width_scale, max_line_width
+
 
 # To Optimize we are creating Lazy Text, like Minecrafts lazy chunk!
 class LazyTextGeneration:
@@ -108,6 +632,152 @@ class LazyTextGeneration:
 
 
 class CodeAnimation(Scene):
+    def __init__(
+        self,
+        anim_config=None,
+        keep_text_dir=False,
+        profile_dir=None,
+        limits=None,
+        **kwargs,
+    ):
+        # Batch renders hand the config over directly and share one SVG
+        # text cache across all the jobs of a worker
+        self.anim_config = anim_config
+        self.keep_text_dir = keep_text_dir
+        self.profile_dir = profile_dir or _profile_dir
+        self.limits = limits or _render_limits
+        # Seconds per stage of the render, see _end_phase
+        self.phase_timings = {}
+        self.phase_events = []  # (phase, start, end) for the profile timeline
+        self.phase_origin = time.perf_counter()
+        self.phase_started = self.phase_origin
+        if _render_mode == "stream" and "renderer" not in kwargs:
+            if FFMPEG_BIN:
+                # Partial movie hashing is pointless without partial movie files
+                config.disable_caching = True
+                kwargs["renderer"] = CairoRenderer(
+                    file_writer_class=StreamingFileWriter
+                )
+            else:
+                print("WARNING: ffmpeg not found, falling back to partial movies")
+        super().__init__(**kwargs)
+
+    def _end_phase(self, name):
+        # Everything since the previous phase ended counts towards `name`
+        now = time.perf_counter()
+        self.phase_timings[name] = self.phase_timings.get(name, 0.0) + (
+            now - self.phase_started
+        )
+        self.phase_events.append(
+            (name, self.phase_started - self.phase_origin, now - self.phase_origin)
+        )
+        self.phase_started = now
+
+    def render(self, preview=False):
+        apply_render_limits(self.limits)
+        profiler = cProfile.Profile() if self.profile_dir else None
+        if profiler is not None:
+            profiler.enable()
+        try:
+            result = super().render(preview)
+            # Closing the encoder / concatenating segments happens after construct
+            self._end_phase("finish")
+        except (MemoryError, RenderLimitExceeded) as e:
+            if isinstance(e, MemoryError):
+                if not self.limits.get("memory_mb"):
+                    raise
+                e = RenderLimitExceeded(
+                    f"Render went over its {self.limits['memory_mb']} MB memory limit"
+                )
+            # One line the backend can pick out of the traceback
+            print(f"{LIMIT_PREFIX}{e}", file=sys.stderr, flush=True)
+            raise e from None
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self._write_profile(profiler)
+        if _metrics_path:
+            try:
+                with open(_metrics_path, "w") as f:
+                    json.dump(self.render_metrics(), f)
+            except OSError as e:
+                print(f"WARNING: Could not write render metrics: {e}")
+        return result
+
+    def _write_profile(self, profiler):
+        # render.pstats for snakeviz/pstats, phases.speedscope.json for
+        # speedscope.app, summary.txt to read without any tools
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            profiler.dump_stats(os.path.join(self.profile_dir, "render.pstats"))
+
+            frames = []
+            events = []
+            for name, start, end in self.phase_events:
+                if name not in frames:
+                    frames.append(name)
+                events.append({"type": "O", "frame": frames.index(name), "at": start})
+                events.append({"type": "C", "frame": frames.index(name), "at": end})
+            speedscope = {
+                "$schema": "https://www.speedscope.app/file-format-schema.json",
+                "exporter": "CodeAnimator",
+                "name": "CodeAnimation phases",
+                "shared": {"frames": [{"name": name} for name in frames]},
+                "profiles": [
+                    {
+                        "type": "evented",
+                        "name": "CodeAnimation phases",
+                        "unit": "seconds",
+                        "startValue": 0,
+                        "endValue": events[-1]["at"] if events else 0,
+                        "events": events,
+                    }
+                ],
+            }
+            with open(
+                os.path.join(self.profile_dir, "phases.speedscope.json"), "w"
+            ) as f:
+                json.dump(speedscope, f)
+
+            summary = io.StringIO()
+            summary.write("Phases:\n")
+            for name, seconds in self.phase_timings.items():
+                summary.write(f"  {name:<10} {seconds:8.3f}s\n")
+            summary.write("\n")
+            stats = pstats.Stats(profiler, stream=summary)
+            stats.sort_stats("cumulative").print_stats(40)
+            with open(os.path.join(self.profile_dir, "summary.txt"), "w") as f:
+                f.write(summary.getvalue())
+        except OSError as e:
+            print(f"WARNING: Could not write profile: {e}")
+
+    def render_metrics(self):
+        """Phase timings plus encoder stats, as reported to the backend."""
+        writer = self.renderer.file_writer
+        metrics = {"phases": dict(self.phase_timings)}
+        if isinstance(writer, StreamingFileWriter):
+            metrics.update(
+                encode_seconds=writer.encode_seconds,
+                frames=writer.frame_index,
+                frames_encoded=writer.frames_encoded,
+                segments=len(writer.segments),
+                segments_reused=writer.segments_reused,
+            )
+        return metrics
+
+    def get_moving_mobjects(self, *animations):
+        # Manim redraws everything added after the first animated mobject on
+        # every frame. Our lines never overlap, so only the animated ones need
+        # redrawing and the rest stay in the static frame cached per play.
+        # That cache is rebuilt on every play, so scrolls and SPLITs refresh it
+        moving_mobjects = []
+        for animation in animations:
+            moving_mobjects.extend(animation.mobject.get_family())
+        for mobject in self.get_mobject_family_members():
+            if mobject.get_family_updaters() and mobject not in moving_mobjects:
+                moving_mobjects.append(mobject)
+        return moving_mobjects
+
     def _load_config(self):
         # Try stdin first (passed by backend via subprocess)
         if not sys.stdin.isatty():
@@ -136,25 +806,7 @@ class CodeAnimation(Scene):
 
     def _parse_line_groups(self, groups_list):
         """Parse line groups from JSON list format."""
-        parsed = []
-        for group in groups_list:
-            if group == "ALL_REMAINING":
-                parsed.append("ALL_REMAINING")
-            elif isinstance(group, str) and group.startswith("SPLIT "):
-                split_line = int(group.split()[1])
-                parsed.append(("SPLIT", split_line))
-            elif isinstance(group, str):
-                # Space-separated line numbers or range like "1-5"
-                parsed.append(self._parse_line_spec(group))
-            elif isinstance(group, list):
-                parsed.append(group)
-        return parsed
-
-    def _parse_line_spec(self, spec):
-        result = []
-        for part in spec.split():
-            result.append(int(part))
-        return result
+        return parse_line_groups(groups_list)
 
     def _parse_legacy_config(self, content):
         lines = content.strip().split("\n")
@@ -224,9 +876,10 @@ class CodeAnimation(Scene):
 
     def construct(self):
         self.renderer.skip_animations = False
+        self.phase_started = time.perf_counter()
 
         # Read config from stdin (backend) or file (manual testing)
-        anim_config = self._load_config()
+        anim_config = self.anim_config or self._load_config()
         if anim_config is None:
             return
 
@@ -237,31 +890,13 @@ class CodeAnimation(Scene):
         custom_colors = anim_config["syntax_colors"]
         orientation = anim_config["orientation"]
         animation_timing = anim_config["animation_timing"]
-        line_groups = anim_config["line_groups"]
-
-        # Apply timing values with defaults
-        default_timing = {
-            "initialDelay": 1.5,
-            "lineSlideIn": 0.4,
-            "pauseBetweenGroups": 0.2,
-            "finalPause": 2.0,
-        }
-        initial_delay = max(
-            0.0, animation_timing.get("initialDelay", default_timing["initialDelay"])
-        )
-        line_slide_in = max(
-            0.05, animation_timing.get("lineSlideIn", default_timing["lineSlideIn"])
-        )
-        pause_between_groups = max(
-            0.0,
-            animation_timing.get(
-                "pauseBetweenGroups", default_timing["pauseBetweenGroups"]
-            ),
-        )
-        final_pause = max(
-            0.0, animation_timing.get("finalPause", default_timing["finalPause"])
-        )
-        scroll_duration = max(line_slide_in, 0.5)
+
+        # Encoder profile only matters to the streaming writer
+        encoder_profile = anim_config.get("encoder_profile")
+        if encoder_profile and isinstance(
+            self.renderer.file_writer, StreamingFileWriter
+        ):
+            self.renderer.file_writer.encoder_profile = encoder_profile
 
         print(f"DEBUG: Custom colors: {custom_colors}")
         print(f"DEBUG: Orientation: {orientation}")
@@ -270,6 +905,9 @@ class CodeAnimation(Scene):
         # making the custom filename for the output, example_1-11.mp4
         base_filename = os.path.splitext(os.path.basename(script_path))[0]
         custom_name = f"{base_filename}_{start_line}-{end_line}"
+        diff_path = anim_config.get("diff_script_path")
+        if diff_path:
+            custom_name += "_diff"
         self.renderer.file_writer.movie_file_extension = ".mp4"
 
         # Output file name yippeee
@@ -282,538 +920,200 @@ class CodeAnimation(Scene):
         print(f"DEBUG: Lines {start_line}-{end_line}")
         print(f"DEBUG: Include comments: {include_comments}")
 
-        # Opening the source file yippeeeeee
-        with open(script_path, "r") as f:
-            source_lines = f.readlines()
-
-        # Filter lines, for rendering purposes
-        filtered_lines = []
-        for i in range(start_line - 1, min(end_line, len(source_lines))):
-            line = source_lines[i].rstrip()
-
-            # Filtering comments if requested
-            if not include_comments:
-                stripped = line.strip()
-                if stripped.startswith("#") or stripped.startswith("//"):
-                    continue
-
-            filtered_lines.append((i + 1, line))  # Store (line_number, content)
+        # Opening the source file yippeeeeee, only the selected range is read
+        with SourceIndex(script_path) as source:
+            source_lines = source.read_lines(start_line, end_line)
 
-        # Getting the correct line indexes from the file
-        line_to_index = {
-            line_num: idx for idx, (line_num, _) in enumerate(filtered_lines)
-        }
-
-        print(f"DEBUG: Filtered {len(filtered_lines)} lines")
-        print(f"DEBUG: Line groups: {line_groups}")
-
-        max_line_num = max(line_num for line_num, _ in filtered_lines)
-        line_num_width = len(str(max_line_num))
-
-        # Create text objects for each line with syntax highlighting
-        line_mobjects = []
-        shown_lines = set()
-
-        num_lines = len(filtered_lines)
         frame_w = config.frame_width
         frame_h = config.frame_height
 
-        print(
-            f"DEBUG: Manim frame dimensions AFTER setting: {frame_w:.2f}w x {frame_h:.2f}h"
-        )
-        print(f"DEBUG: Pixel dimensions: {config.pixel_width}x{config.pixel_height}")
-        print(f"DEBUG: Orientation setting: {orientation}")
-
-        if orientation == "portrait":
-            top_margin = 0.3
-            bottom_margin = 0.3
-            left_margin = 0.05
-            right_margin = 0.05
+        # Filtering, colors, layout and the timeline all come from the plan
+        if diff_path:
+            # Diff mode, the same range of the after version animates in
+            # over this one
+            with SourceIndex(script_path) as source:
+                before_total = source.total_lines()
+            with SourceIndex(diff_path) as source:
+                diff_start, diff_end = diff_line_range(
+                    anim_config, before_total, source.total_lines()
+                )
+                after_lines = source.read_lines(diff_start, diff_end)
+            print(f"DEBUG: Diff against {diff_path} lines {diff_start}-{diff_end}")
+            plan = build_diff_plan(
+                {
+                    **anim_config,
+                    "diff_start_line": diff_start,
+                    "diff_end_line": diff_end,
+                },
+                source_lines,
+                after_lines,
+                frame_w,
+                frame_h,
+                first_line=start_line,
+                diff_first_line=diff_start,
+            )
         else:
-            top_margin = 0.3
-            bottom_margin = 0.3
-            left_margin = 0.3
-            right_margin = 0.3
+            plan = build_render_plan(
+                anim_config, source_lines, frame_w, frame_h, first_line=start_line
+            )
+        layout = plan["layout"]
+        left_margin = layout["left_margin"]
+        line_height = layout["line_height"]
+        base_font_size = layout["font_size"]
+        available_width = layout["available_width"]
+        DEFAULT_COLOR = plan["default_color"]
 
-        available_height = frame_h - top_margin - bottom_margin
-        available_width = frame_w - left_margin - right_margin
+        self._end_phase("plan")
 
+        print(f"DEBUG: Filtered {len(plan['lines'])} lines")
+        print(f"DEBUG: Line groups: {anim_config['line_groups']}")
         print(
-            f"DEBUG: Available space: {available_width:.2f}w x {available_height:.2f}h"
-        )
-        print(
-            f"DEBUG: Margins - Top: {top_margin}, Bottom: {bottom_margin}, Left: {left_margin}, Right: {right_margin}"
+            f"DEBUG: Manim frame dimensions AFTER setting: {frame_w:.2f}w x {frame_h:.2f}h"
         )
-
-        if orientation == "portrait":
-            MIN_FONT_SIZE = 32
-            MAX_FONT_SIZE = 48
-            MIN_LINE_HEIGHT = 0.32
-            MAX_LINE_HEIGHT = 0.45
-        else:
-            MIN_FONT_SIZE = 16
-            MAX_FONT_SIZE = 28
-            MIN_LINE_HEIGHT = 0.35
-            MAX_LINE_HEIGHT = 0.6
-
-        ideal_line_height = available_height / num_lines
-        line_height = max(MIN_LINE_HEIGHT, min(MAX_LINE_HEIGHT, ideal_line_height))
-
-        # Font size scales with line height - use larger multiplier for portrait, normal for landscape
-        font_multiplier = 55 if orientation == "portrait" else 45
-        base_font_size = int(line_height * font_multiplier)
-        base_font_size = max(MIN_FONT_SIZE, min(MAX_FONT_SIZE, base_font_size))
-
-        total_height = num_lines * line_height
-
+        print(f"DEBUG: Pixel dimensions: {config.pixel_width}x{config.pixel_height}")
         print(
-            f"DEBUG: Font sizing params - MIN: {MIN_FONT_SIZE}, MAX: {MAX_FONT_SIZE}, Multiplier: {font_multiplier}"
+            f"DEBUG: Available space: {available_width:.2f}w x {layout['available_height']:.2f}h"
         )
+        print(f"DEBUG: line_height: {line_height:.3f}, font_size: {base_font_size}")
         print(
-            f"DEBUG: Line height params - MIN: {MIN_LINE_HEIGHT}, MAX: {MAX_LINE_HEIGHT}"
+            f"DEBUG: Chunking: {layout['enable_chunking']} (chunk size {layout['chunk_size']})"
         )
-        print(f"DEBUG: Initial line_height: {line_height:.3f}")
-        print(f"DEBUG: Initial font_size: {base_font_size}")
-        print(f"DEBUG: Number of lines: {num_lines}")
-        print(f"DEBUG: Total height needed: {total_height:.3f}")
-        print(f"DEBUG: Available height: {available_height:.3f}")
-
-        # Determine chunking
-        enable_chunking = False
-        chunk_size = 0
-        lines_that_fit = int(available_height / MIN_LINE_HEIGHT)
-        if total_height > available_height:
-            scale_to_fit = available_height / total_height
-            if num_lines > lines_that_fit * 1.5:
-                enable_chunking = True
-                chunk_size = lines_that_fit
-                line_height = MIN_LINE_HEIGHT
-                font_multiplier = 55 if orientation == "portrait" else 45
-                base_font_size = int(line_height * font_multiplier)
-                base_font_size = max(MIN_FONT_SIZE, min(MAX_FONT_SIZE, base_font_size))
-            else:
-                line_height = available_height / num_lines
-                font_multiplier = 55 if orientation == "portrait" else 45
-                base_font_size = int(line_height * font_multiplier)
-                base_font_size = max(MIN_FONT_SIZE, min(MAX_FONT_SIZE, base_font_size))
-
-        # Get colors from custom config or defaults
-        color_keywords = custom_colors.get("keywords", "#9b59b6")
-        color_types = custom_colors.get("types", "#3498db")
-        color_functions = custom_colors.get("functions", "#3498db")
-        color_strings = custom_colors.get("strings", "#2ecc71")
-        color_numbers = custom_colors.get("numbers", "#e67e22")
-        color_comments = custom_colors.get("comments", "#7f8c8d")
-        color_decorators = custom_colors.get("decorators", "#f1c40f")
-        color_default = custom_colors.get("default", "#ffffff")
-
-        TOKEN_COLORS = {
-            Token.Comment.Multiline: color_comments,
-            Token.Comment.Single: color_comments,
-            Token.Comment.Special: color_comments,
-            Token.Comment.Preproc: color_comments,
-            Token.Comment.PreprocFile: color_comments,
-            Token.Comment: color_comments,
-            Token.Keyword.Namespace: color_types,
-            Token.Keyword.Type: color_keywords,
-            Token.Keyword.Constant: color_keywords,
-            Token.Keyword.Declaration: color_keywords,
-            Token.Keyword.Pseudo: color_keywords,
-            Token.Keyword.Reserved: color_keywords,
-            Token.Keyword: color_keywords,
-            Token.Name.Builtin: color_types,
-            Token.Name.Builtin.Pseudo: color_types,
-            Token.Name.Function: color_functions,
-            Token.Name.Function.Magic: color_functions,
-            Token.Name.Class: color_types,
-            Token.Name.Decorator: color_decorators,
-            Token.Name.Variable: color_types,  # For GDScript $node_refs
-            Token.Name.Constant: color_numbers,
-            Token.String.Doc: color_strings,
-            Token.String.Single: color_strings,
-            Token.String.Double: color_strings,
-            Token.String.Escape: color_decorators,
-            Token.String.Interpol: color_decorators,
-            Token.String.Regex: color_strings,
-            Token.String.Char: color_strings,
-            Token.String: color_strings,
-            Token.Literal.String: color_strings,
-            Token.Literal.String.Doc: color_strings,
-            Token.Number.Integer: color_numbers,
-            Token.Number.Float: color_numbers,
-            Token.Number.Hex: color_numbers,
-            Token.Number.Oct: color_numbers,
-            Token.Number.Bin: color_numbers,
-            Token.Number: color_numbers,
-            Token.Literal.Number: color_numbers,
-            Token.Operator.Word: color_keywords,
-            Token.Comment.Preproc: color_keywords,
-        }
-
-        DEFAULT_COLOR = color_default
-
-        # Pre-build inheritance lookup as tuple for faster iteration
-        # Order matters: more specific types first (longer tuples checked first)
-        _token_parents = tuple(sorted(TOKEN_COLORS.items(), key=lambda x: -len(x[0])))
-        _token_color_cache = {}
-
-        def get_token_color(token_type):
-            """Get color for token type with caching for inheritance lookup"""
-            if token_type in _token_color_cache:
-                return _token_color_cache[token_type]
-
-            # Direct lookup first (O(1) dict access)
-            if token_type in TOKEN_COLORS:
-                _token_color_cache[token_type] = TOKEN_COLORS[token_type]
-                return TOKEN_COLORS[token_type]
-
-            # Check inheritance using pre-sorted tuple (most specific first)
-            for ttype, tcolor in _token_parents:
-                if token_type in ttype:
-                    _token_color_cache[token_type] = tcolor
-                    return tcolor
-
-            _token_color_cache[token_type] = DEFAULT_COLOR
-            return DEFAULT_COLOR
 
-        # Cache lexer to avoid repeated file detection
-        try:
-            lexer = get_lexer_for_filename(script_path)
-        except Exception:
-            lexer = TextLexer()
-
-        full_code_text = "\n".join(content for _, content in filtered_lines)
-        full_tokens = list(lex(full_code_text, lexer))
-
-        # GDScript-specific token fixes for Godot 4 syntax
-        if script_path.endswith(".gd"):
-            fixed_tokens = []
-            i = 0
-            num_tokens = len(full_tokens)
-            while i < num_tokens:
-                token_type, token_value = full_tokens[i]
-
-                # Fix @annotations: Token.Error('@') + Token.Keyword -> Token.Name.Decorator
-                if (
-                    token_type == Token.Error
-                    and token_value == "@"
-                    and i + 1 < num_tokens
-                ):
-                    next_type, next_value = full_tokens[i + 1]
-                    if next_type in Token.Keyword:
-                        fixed_tokens.append((Token.Name.Decorator, "@" + next_value))
-                        i += 2
-                        continue
-
-                # Fix $node_refs: Token.Operator('$') + Token.Name (+ '/' + Token.Name)* -> Token.Name.Variable
-                if (
-                    token_type == Token.Operator
-                    and token_value == "$"
-                    and i + 1 < num_tokens
-                ):
-                    next_type, next_value = full_tokens[i + 1]
-                    if next_type == Token.Name:
-                        node_path = "$" + next_value
-                        j = i + 2
-                        # Continue consuming /Name pairs
-                        while j + 1 < num_tokens:
-                            slash_type, slash_value = full_tokens[j]
-                            if slash_type == Token.Operator and slash_value == "/":
-                                name_type, name_value = full_tokens[j + 1]
-                                if name_type == Token.Name:
-                                    node_path += "/" + name_value
-                                    j += 2
-                                    continue
-                            break
-                        fixed_tokens.append((Token.Name.Variable, node_path))
-                        i = j
-                        continue
-
-                fixed_tokens.append((token_type, token_value))
-                i += 1
-
-            full_tokens = fixed_tokens
-
-        # Build color map using list of lists for O(1) access (vs dict hashing)
-        # Pre-allocate each line's color array based on line length for O(1) assignment
-        num_filtered = len(filtered_lines)
-        color_map = [[DEFAULT_COLOR] * len(content) for _, content in filtered_lines]
-        current_line = 0
-        current_char = 0
-
-        for token_type, token_value in full_tokens:
-            token_color = get_token_color(token_type)
-
-            # Process token value and map positions to colors
-            for char in token_value:
-                if char == "\n":
-                    current_line += 1
-                    current_char = 0
-                else:
-                    # Direct assignment - array already pre-allocated
-                    if current_line < num_filtered:
-                        line_colors = color_map[current_line]
-                        if current_char < len(line_colors):
-                            line_colors[current_char] = token_color
-                    current_char += 1
-
-        # Measure max line width for scaling - create text objects once
-        # Only store (line_num, content, line_group) - content_display not needed after Text creation
-        temp_lines = []
-        max_line_width = 0
-        for line_num, content in filtered_lines:
-            full_line = (
-                f"{line_num:>{line_num_width}}  {content.replace(chr(9), '    ')}"
-            )
-            # Create and cache Text object in one pass to avoid recreating later
+        # Create text objects once, layout happens in bulk below
+        line_mobjects = []
+        for line in plan["lines"]:
             line_group = Text(
-                full_line,
+                line["text"],
                 font=MONOSPACE_FONT,
                 font_size=base_font_size,
                 color=DEFAULT_COLOR,
                 disable_ligatures=True,
             )
-            temp_lines.append((line_num, content, line_group))
-            if line_group.width > max_line_width:
-                max_line_width = line_group.width
-
-        width_scale = 1.0
-        if max_line_width > available_width:
-            width_scale = available_width / max_line_width
+            # Color runs (consecutive chars with same color) for batch application
+            for start_idx, end_idx, color in line["runs"]:
+                try:
+                    for char in line_group[start_idx:end_idx]:
+                        char.set_color(color)
+                except IndexError:
+                    break
+            line_mobjects.append(line_group)
+        self._end_phase("text")
+
+        y_positions = layout["y_start"] - np.arange(len(line_mobjects)) * line_height
+        # Parked off screen, only added to the scene when they slide in
+        final_positions, width_scale, max_line_width = layout_lines(
+            line_mobjects,
+            y_positions,
+            -frame_w / 2 + left_margin,
+            available_width,
+            frame_w + 2,
+        )
 
         print(
             f"DEBUG: Max line width: {max_line_width:.3f}, Available width: {available_width:.2f}"
         )
         print(f"DEBUG: Width scale: {width_scale:.3f}")
+        self._end_phase("layout")
+
+        # Segment cache: every timeline event is its own segment, cached ones
+        # are still played but with rendering skipped, so the scene state is
+        # where the next segment expects it. Opt-in, an ffmpeg per segment
+        # plus the concat costs more than one stream when nothing is cached
+        writer = self.renderer.file_writer
+        original_skipping = self.renderer._original_skipping_status
+        segment_keys = [None] * len(plan["timeline"])
+        if (
+            _segment_cache_dir
+            and anim_config.get("segment_cache")
+            and isinstance(writer, StreamingFileWriter)
+            and write_to_movie()
+            and writer.supports_segments()
+        ):
+            os.makedirs(_segment_cache_dir, exist_ok=True)
+            writer.segment_dir = _segment_cache_dir
+            segment_keys = timeline_segment_keys(
+                plan,
+                {
+                    "version": SEGMENT_CACHE_VERSION,
+                    "font": MONOSPACE_FONT,
+                    "pixels": [config.pixel_width, config.pixel_height],
+                    "frame": [frame_w, frame_h],
+                    "frame_rate": config.frame_rate,
+                    "encoder_profile": writer.encoder_profile,
+                },
+            )
 
-        y_start = (num_lines * line_height / 2) - (line_height / 2)
-
-        for line_idx, (line_num, content, line_group) in enumerate(temp_lines):
-            display_char_idx = line_num_width + 2
-            original_char_idx = 0
-            line_colors = color_map[line_idx] if line_idx < len(color_map) else []
-
-            # Build color runs (consecutive chars with same color) for batch application
-            # This reduces set_color calls significantly
-            color_runs = []  # [(start_idx, end_idx, color), ...]
-            current_run_start = display_char_idx
-            current_run_color = None
-
-            for orig_char in content:
-                # Get color from pre-computed list (O(1) vs dict hash)
-                color = (
-                    line_colors[original_char_idx]
-                    if original_char_idx < len(line_colors)
-                    else DEFAULT_COLOR
+        # Play the timeline, chunking lets me render faster yipeeee
+        enable_chunking = layout["enable_chunking"]
+        for event, segment_key in zip(plan["timeline"], segment_keys):
+            if segment_key is not None:
+                # play() resets skip_animations from this before every animation
+                cached = writer.start_segment(segment_key)
+                self.renderer._original_skipping_status = original_skipping or cached
+
+            if event["type"] == "wait":
+                self.wait(event["duration"])
+
+            elif event["type"] == "slide_in":
+                animations = []
+                for idx, y in zip(event["lines"], event["y"]):
+                    line_obj = line_mobjects[idx]
+                    if enable_chunking:
+                        # First, move to the slot's Y while staying off-screen left
+                        line_obj.move_to([-(frame_w + 2), y, 0])
+                    self.add(line_obj)
+                    target = np.array([final_positions[idx][0], y, 0])
+                    animations.append(
+                        ShiftBy(line_obj, target - line_obj.get_center())
+                    )
+                self.play(*animations, run_time=event["duration"])
+
+            elif event["type"] == "scroll":
+                # One shift of the parent group per frame, no per-glyph interpolation
+                scrolled = [line_mobjects[idx] for idx in event["lines"]]
+                visible_group = VGroup(*scrolled)
+                self.play(
+                    ShiftBy(visible_group, UP * event["distance"]),
+                    run_time=event["duration"],
+                )
+                # Off screen for good, stop drawing them into every static frame
+                self.remove(visible_group, *scrolled)
+
+            elif event["type"] == "fade_out":
+                # Diff mode: lines removed or changed in the after version
+                self.play(
+                    *[FadeOut(line_mobjects[idx]) for idx in event["lines"]],
+                    run_time=event["duration"],
                 )
 
-                char_count = 4 if orig_char == "\t" else 1
-
-                if color != current_run_color:
-                    # Save previous run if exists
-                    if (
-                        current_run_color is not None
-                        and current_run_color != DEFAULT_COLOR
-                    ):
-                        color_runs.append(
-                            (current_run_start, display_char_idx, current_run_color)
+            elif event["type"] == "move":
+                # Unchanged lines keep their mobject and only change rows,
+                # nothing gets rasterized again
+                self.play(
+                    *[
+                        ShiftBy(
+                            line_mobjects[idx],
+                            UP * (y - line_mobjects[idx].get_center()[1]),
                         )
-                    current_run_start = display_char_idx
-                    current_run_color = color
-
-                display_char_idx += char_count
-                original_char_idx += 1
-
-            # Don't forget the last run
-            if current_run_color is not None and current_run_color != DEFAULT_COLOR:
-                color_runs.append(
-                    (current_run_start, display_char_idx, current_run_color)
+                        for idx, y in zip(event["lines"], event["y"])
+                    ],
+                    run_time=event["duration"],
                 )
 
-            for start_idx, end_idx, color in color_runs:
-                try:
-                    for char in line_group[start_idx:end_idx]:
-                        char.set_color(color)
-                except IndexError:
-                    break
+            elif event["type"] == "fade_in":
+                animations = []
+                for idx, y in zip(event["lines"], event["y"]):
+                    line_obj = line_mobjects[idx]
+                    line_obj.move_to([final_positions[idx][0], y, 0])
+                    animations.append(FadeIn(line_obj))
+                self.play(*animations, run_time=event["duration"])
 
-            y_pos = y_start - (line_idx * line_height)
-            line_group.move_to([0, y_pos, 0])
-            line_group.to_edge(LEFT, buff=left_margin)
-            if width_scale < 1.0:
-                line_group.scale(width_scale)
-                line_group.move_to([0, y_pos, 0])
-                line_group.to_edge(LEFT, buff=left_margin)
-            final_pos = line_group.get_center().copy()
-            line_group.shift(LEFT * (frame_w + 2))
-            self.add(line_group)
-            line_mobjects.append((line_group, final_pos))
-
-        self.wait(initial_delay)
-
-        # Animate line groups with chunking support, chunking lets me render faster yipeeee
-        if enable_chunking:
-            # Chunked display mode - show lines in chunks, scrolling up between chunks
-            currently_visible = []  # Track which line objects are currently visible on screen
-            current_visible_count = 0  # Track how many lines are currently visible
-
-            # Helper function to calculate position for a line within the current visible chunk
-            def get_chunk_position(slot_index):
-                # Y positioning, we needed
-                chunk_height = chunk_size * line_height
-                y_start_chunk = (chunk_height / 2) - (line_height / 2)
-                return y_start_chunk - (slot_index * line_height)
-
-            for group in line_groups:
-                if group == "ALL_REMAINING":
-                    remaining_indices = [
-                        (idx, line_num)
-                        for idx, (line_num, _) in enumerate(filtered_lines)
-                        if line_num not in shown_lines and idx < len(line_mobjects)
-                    ]
-
-                    while remaining_indices:
-                        available_slots = chunk_size - current_visible_count
-
-                        if available_slots <= 0:
-                            # Use VGroup for more efficient scroll animation
-                            visible_group = VGroup(*currently_visible)
-                            self.play(
-                                visible_group.animate.shift(
-                                    UP * (available_height + 1)
-                                ),
-                                run_time=scroll_duration,
-                            )
-                            currently_visible.clear()
-                            current_visible_count = 0
-                            available_slots = chunk_size
-
-                        chunk = remaining_indices[:available_slots]
-                        remaining_indices = remaining_indices[available_slots:]
-
-                        animations = []
-                        for idx, line_num in chunk:
-                            line_obj, original_final_pos = line_mobjects[idx]
-                            slot_y = get_chunk_position(current_visible_count)
-                            target_pos = [original_final_pos[0], slot_y, 0]
-                            line_obj.move_to([-(frame_w + 2), slot_y, 0])
-                            animations.append(line_obj.animate.move_to(target_pos))
-                            shown_lines.add(line_num)
-                            currently_visible.append(line_obj)
-                            current_visible_count += 1
-
-                        if animations:
-                            self.play(*animations, run_time=line_slide_in)
-                            self.wait(pause_between_groups)
-
-                elif isinstance(group, tuple) and group[0] == "SPLIT":
-                    # SPLIT command: scroll current content off, then show from the split line
-                    split_line_num = group[1]
-
-                    # Scroll all currently visible lines off screen using VGroup
-                    if currently_visible:
-                        visible_group = VGroup(*currently_visible)
-                        self.play(
-                            visible_group.animate.shift(UP * (available_height + 1)),
-                            run_time=scroll_duration,
-                        )
-                        currently_visible.clear()
-                        current_visible_count = 0
-
-                    # Now show the split line (if not already shown)
-                    if (
-                        split_line_num in line_to_index
-                        and split_line_num not in shown_lines
-                    ):
-                        idx = line_to_index[split_line_num]
-                        if idx < len(line_mobjects):
-                            line_obj, original_final_pos = line_mobjects[idx]
-                            slot_y = get_chunk_position(current_visible_count)
-                            target_pos = [original_final_pos[0], slot_y, 0]
-                            # First, move to correct Y position while staying off-screen left
-                            line_obj.move_to([-(frame_w + 2), slot_y, 0])
-                            # Then animate sliding in from left
-                            self.play(
-                                line_obj.animate.move_to(target_pos),
-                                run_time=line_slide_in,
-                            )
-                            shown_lines.add(split_line_num)
-                            currently_visible.append(line_obj)
-                            current_visible_count += 1
-                            self.wait(pause_between_groups)
-
-                else:
-                    lines_to_show = [
-                        (line_to_index[line_num], line_num)
-                        for line_num in group
-                        if line_num in line_to_index
-                        and line_num not in shown_lines
-                        and line_to_index[line_num] < len(line_mobjects)
-                    ]
-
-                    if lines_to_show:
-                        lines_needed = len(lines_to_show)
-                        available_slots = chunk_size - current_visible_count
-
-                        if lines_needed > available_slots:
-                            # Use VGroup for more efficient scroll animation
-                            visible_group = VGroup(*currently_visible)
-                            self.play(
-                                visible_group.animate.shift(
-                                    UP * (available_height + 1)
-                                ),
-                                run_time=scroll_duration,
-                            )
-                            currently_visible.clear()
-                            current_visible_count = 0
-
-                        animations = []
-                        for idx, line_num in lines_to_show:
-                            line_obj, original_final_pos = line_mobjects[idx]
-                            slot_y = get_chunk_position(current_visible_count)
-                            target_pos = [original_final_pos[0], slot_y, 0]
-                            line_obj.move_to([-(frame_w + 2), slot_y, 0])
-                            animations.append(line_obj.animate.move_to(target_pos))
-                            shown_lines.add(line_num)
-                            currently_visible.append(line_obj)
-                            current_visible_count += 1
-
-                        self.play(*animations, run_time=line_slide_in)
-                        self.wait(pause_between_groups)
-        else:
-            for group in line_groups:
-                if group == "ALL_REMAINING":
-                    lines_to_show = [
-                        (idx, line_num)
-                        for idx, (line_num, _) in enumerate(filtered_lines)
-                        if line_num not in shown_lines and idx < len(line_mobjects)
-                    ]
-                else:
-                    lines_to_show = [
-                        (line_to_index[line_num], line_num)
-                        for line_num in group
-                        if line_num in line_to_index
-                        and line_num not in shown_lines
-                        and line_to_index[line_num] < len(line_mobjects)
-                    ]
-
-                if lines_to_show:
-                    animations = [
-                        line_mobjects[idx][0].animate.move_to(line_mobjects[idx][1])
-                        for idx, _ in lines_to_show
-                    ]
-                    for idx, line_num in lines_to_show:
-                        shown_lines.add(line_num)
-
-                    self.play(*animations, run_time=line_slide_in)
-                    self.wait(pause_between_groups)
-
-        # Final pause
-        self.wait(final_pause)
+        self.renderer._original_skipping_status = original_skipping
+        self._end_phase("animate")
 
         # Clean up SVG cache files after rendering
         cache_dir = config.text_dir
-        if os.path.exists(cache_dir):
+        if os.path.exists(cache_dir) and not self.keep_text_dir:
             print(f"INFO: Cleaning up SVG cache at {cache_dir}")
             try:
                 shutil.rmtree(cache_dir)
@@ -830,9 +1130,8 @@ def get_input():
 
     # Validate file exists
     try:
-        with open(script_path, "r") as f:
-            lines = f.readlines()
-        total_lines = len(lines)
+        with SourceIndex(script_path) as source:
+            total_lines = source.total_lines()
         print(f"✓ File found: {total_lines} lines total")
     except FileNotFoundError:
         print(f"✗ Error: File '{script_path}' not found")
@@ -927,7 +1226,341 @@ def get_input():
     print(f"\nGenerating animation...")
 
 
+# Same resolutions the backend asks Manim for (-ql/-qm/-qh)
+BATCH_RESOLUTIONS = {
+    "fast": {"landscape": (854, 480), "portrait": (540, 960)},
+    "standard": {"landscape": (1280, 720), "portrait": (720, 1280)},
+    "high": {"landscape": (1920, 1080), "portrait": (1080, 1920)},
+}
+JOB_FILE_SUFFIXES = (".json", ".yaml", ".yml")
+# --manifest results are printed as "MANIFEST {json}", one line per job
+MANIFEST_PREFIX = "MANIFEST "
+
+
+def load_batch_jobs(paths):
+    """Jobs from JSON/YAML job files, or directories of them.
+
+    A file holds one job, a list of jobs, or {"defaults": {...}, "jobs": [...]}.
+    Jobs use the same keys as the config the backend passes on stdin, plus
+    optional "quality", "output_name", "profile_dir" and "limits" (see
+    apply_render_limits). script_path (and diff_script_path, which turns on diff
+    mode) is relative to the job file.
+    """
+    jobs = []
+    for path in paths:
+        if os.path.isdir(path):
+            job_files = sorted(
+                os.path.join(path, name)
+                for name in os.listdir(path)
+                if name.endswith(JOB_FILE_SUFFIXES)
+            )
+        else:
+            job_files = [path]
+
+        for job_file in job_files:
+            with open(job_file, "r") as f:
+                if job_file.endswith((".yaml", ".yml")):
+                    if yaml is None:
+                        raise SystemExit(
+                            f"ERROR: {job_file} needs PyYAML (pip install pyyaml)"
+                        )
+                    data = yaml.safe_load(f)
+                else:
+                    data = json.load(f)
+
+            defaults = {}
+            if isinstance(data, dict) and "jobs" in data:
+                defaults = data.get("defaults") or {}
+                data = data["jobs"]
+            if isinstance(data, dict):
+                data = [data]
+
+            base_dir = os.path.dirname(os.path.abspath(job_file))
+            for job in data:
+                job = {**defaults, **job}
+                if "script_path" not in job:
+                    raise SystemExit(f"ERROR: A job in {job_file} has no script_path")
+                job["script_path"] = os.path.join(base_dir, job["script_path"])
+                if job.get("diff_script_path"):
+                    job["diff_script_path"] = os.path.join(
+                        base_dir, job["diff_script_path"]
+                    )
+                jobs.append(job)
+    return jobs
+
+
+def render_batch_job(index, job, quality, output_dir, work_dir):
+    """Render one job inside this process, Manim is only imported once."""
+    started = time.perf_counter()
+    script_path = job["script_path"]
+    start_line = int(job.get("start_line", 1))
+    end_line = job.get("end_line")
+    base_filename = os.path.splitext(os.path.basename(script_path))[0]
+    result = {"index": index, "name": job.get("output_name") or base_filename}
+
+    media_dir = tempfile.mkdtemp(prefix="job-", dir=work_dir)
+    try:
+        if end_line is None:
+            with SourceIndex(script_path) as source:
+                end_line = source.total_lines()
+        end_line = int(end_line)
+        output_name = (
+            job.get("output_name") or f"{base_filename}_{start_line}-{end_line}"
+        )
+        result["name"] = output_name
+
+        orientation = job.get("orientation", "landscape")
+        if orientation not in FRAME_SIZES:
+            orientation = "landscape"
+        anim_config = {
+            "script_path": script_path,
+            "start_line": start_line,
+            "end_line": end_line,
+            "include_comments": job.get("include_comments", True),
+            "syntax_colors": job.get("syntax_colors") or {},
+            "orientation": orientation,
+            "animation_timing": job.get("animation_timing") or {},
+            "line_groups": parse_line_groups(job.get("line_groups", [])),
+            "encoder_profile": job.get("encoder_profile"),
+            "segment_cache": bool(job.get("segment_cache")),
+        }
+        if job.get("diff_script_path"):
+            # Diff mode, see build_diff_plan
+            anim_config["diff_script_path"] = job["diff_script_path"]
+            anim_config["diff_start_line"] = job.get("diff_start_line")
+            anim_config["diff_end_line"] = job.get("diff_end_line")
+
+        quality = job.get("quality", quality)
+        pixel_width, pixel_height = BATCH_RESOLUTIONS[quality][orientation]
+        frame_width, frame_height = FRAME_SIZES[orientation]
+        frame_rate = (anim_config["encoder_profile"] or {}).get("fps", 60)
+
+        scene_kwargs = {}
+        if FFMPEG_BIN:
+            scene_kwargs["renderer"] = CairoRenderer(
+                file_writer_class=StreamingFileWriter
+            )
+        with tempconfig(
+            {
+                "frame_width": frame_width,
+                "frame_height": frame_height,
+                "pixel_width": pixel_width,
+                "pixel_height": pixel_height,
+                "frame_rate": frame_rate,
+                "media_dir": media_dir,
+                # One SVG cache per worker process, shared by all its jobs
+                "text_dir": os.path.join(work_dir, f"texts-{os.getpid()}"),
+                "output_file": output_name,
+                "disable_caching": True,
+                "write_to_movie": True,
+                "save_last_frame": False,
+                "preview": False,
+            }
+        ):
+            scene = CodeAnimation(
+                anim_config=anim_config,
+                keep_text_dir=True,
+                profile_dir=job.get("profile_dir"),
+                limits=job.get("limits"),
+                **scene_kwargs,
+            )
+            scene.render()
+            movie_path = scene.renderer.file_writer.movie_file_path
+            result["metrics"] = scene.render_metrics()
+
+        output_path = os.path.join(output_dir, os.path.basename(movie_path))
+        shutil.move(movie_path, output_path)
+        result.update(status="ok", output=output_path)
+    except RenderLimitExceeded as e:
+        result.update(status="limit", error=str(e))
+    except Exception as e:
+        result.update(status="error", error=str(e))
+    finally:
+        shutil.rmtree(media_dir, ignore_errors=True)
+
+    result["seconds"] = time.perf_counter() - started
+    return result
+
+
+def run_batch(argv):
+    parser = argparse.ArgumentParser(
+        prog="CodeAnimator.py --batch",
+        description="Render every job in the given job files without prompts.",
+    )
+    parser.add_argument(
+        "jobs", nargs="+", help="JSON/YAML job files or directories of them"
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="Worker processes, each keeps Manim and its text cache warm",
+    )
+    parser.add_argument(
+        "-q",
+        "--quality",
+        choices=sorted(BATCH_RESOLUTIONS),
+        default="standard",
+        help="Default quality for jobs that don't set one",
+    )
+    parser.add_argument(
+        "-o", "--output", default="batch_output", help="Where videos end up"
+    )
+    parser.add_argument(
+        "--manifest",
+        action="store_true",
+        help="Also print a machine-readable result line as each job finishes",
+    )
+    args = parser.parse_args(argv)
+
+    def report(result):
+        results.append(result)
+        print(f"✓ {result['name']} ({result['status']})")
+        if args.manifest:
+            print(f"{MANIFEST_PREFIX}{json.dumps(result)}", flush=True)
+
+    jobs = load_batch_jobs(args.jobs)
+    if not jobs:
+        print("No jobs found")
+        return 1
+
+    os.makedirs(args.output, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix=".work-", dir=args.output)
+    print(f"Rendering {len(jobs)} jobs with {max(args.workers, 1)} worker(s)")
+
+    started = time.perf_counter()
+    results = []
+    try:
+        if args.workers <= 1:
+            for index, job in enumerate(jobs):
+                report(
+                    render_batch_job(index, job, args.quality, args.output, work_dir)
+                )
+        else:
+            with ProcessPoolExecutor(max_workers=args.workers) as pool:
+                futures = [
+                    pool.submit(
+                        render_batch_job,
+                        index,
+                        job,
+                        args.quality,
+                        args.output,
+                        work_dir,
+                    )
+                    for index, job in enumerate(jobs)
+                ]
+                for future in as_completed(futures):
+                    report(future.result())
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    wall_time = time.perf_counter() - started
+
+    print("\n=== Batch Summary ===")
+    for result in sorted(results, key=lambda r: r["seconds"], reverse=True):
+        detail = result.get("output") or result.get("error")
+        print(
+            f"{result['seconds']:8.2f}s  {result['status']:<5}  {result['name']}  {detail}"
+        )
+    failed = sum(1 for result in results if result["status"] != "ok")
+    render_time = sum(result["seconds"] for result in results)
+    print(
+        f"\n{len(results)} jobs, {failed} failed, "
+        f"{render_time:.2f}s render time, {wall_time:.2f}s wall time"
+    )
+    return 1 if failed else 0
+
+
+class RenderForkServer(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    """Forks one child per render from a parent that already has Manim warm.
+
+    Children share the parent's Manim, NumPy, Cairo/Pango and font pages
+    copy-on-write and exit when their job is done, so nothing leaks from
+    one render into the next and a crash only takes out its own job.
+    """
+
+
+class RenderRequestHandler(socketserver.StreamRequestHandler):
+    # Runs in the forked child. Protocol is one JSON line each way: the
+    # request, then {"pid"} right away (so the client can kill a render that
+    # runs over), then the render_batch_job result
+    def handle(self):
+        # Own process group, killing it takes the child's ffmpeg down too
+        os.setsid()
+        request = json.loads(self.rfile.readline())
+        self.wfile.write(f"{json.dumps({'pid': os.getpid()})}\n".encode())
+        self.wfile.flush()
+
+        work_dir = request["work_dir"]
+        result = render_batch_job(
+            request.get("index", 0),
+            request["job"],
+            request.get("quality", "standard"),
+            request["output_dir"],
+            work_dir,
+        )
+        # The per-pid text cache dies with this child anyway
+        shutil.rmtree(os.path.join(work_dir, f"texts-{os.getpid()}"), True)
+        self.wfile.write(f"{json.dumps(result)}\n".encode())
+
+
+def warm_render_state(work_dir):
+    """Pay for fontconfig, Pango and the first Text once, before any fork."""
+    with tempconfig({"text_dir": work_dir}):
+        Text(
+            string.printable.strip(),
+            font=MONOSPACE_FONT,
+            disable_ligatures=True,
+        )
+
+
+def run_fork_server(argv):
+    parser = argparse.ArgumentParser(
+        prog="CodeAnimator.py --serve",
+        description="Render jobs sent over a Unix socket in forked children.",
+    )
+    parser.add_argument("socket", help="Unix socket path to listen on")
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Renders running at once, more connections wait their turn",
+    )
+    args = parser.parse_args(argv)
+
+    warm_dir = tempfile.mkdtemp(prefix="codeanimator-warm-")
+    try:
+        warm_render_state(warm_dir)
+    finally:
+        shutil.rmtree(warm_dir, ignore_errors=True)
+    # Everything alive now is shared with the children, keep the GC from
+    # touching (and so copying) those pages in every one of them
+    gc.collect()
+    gc.freeze()
+
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)  # Stale socket from a server that died
+    with RenderForkServer(args.socket, RenderRequestHandler) as server:
+        server.max_children = max(args.workers, 1)
+        print(f"Fork server listening on {args.socket}", flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(args.socket)
+    return 0
+
+
 if __name__ == "__main__":
+    # Non-interactive batch renders, see run_batch
+    if len(sys.argv) > 1 and sys.argv[1] == "--batch":
+        sys.exit(run_batch(sys.argv[2:]))
+    # Warm render server for the backend, see run_fork_server
+    if len(sys.argv) > 1 and sys.argv[1] == "--serve":
+        sys.exit(run_fork_server(sys.argv[2:]))
+
     # Check if running in interactive mode
     if len(sys.argv) == 1 or sys.argv[1] != "--render":
         get_input()
@@ -0,0 +1,1065 @@
+"""Everything CodeAnimation decides before Manim draws a single frame.
+
+Filtering lines, syntax colors, layout and the timeline of slide-ins, scrolls
+and waits only need Pygments, so the backend can import this module without
+paying for a Manim import (timeline export, cache keys, ...).
+"""
+
+import bisect
+import codecs
+import difflib
+import hashlib
+import json
+import mmap
+import os
+import shutil
+from collections import OrderedDict
+from xml.sax.saxutils import escape
+
+from pygments import lex
+from pygments.lexers import TextLexer, get_lexer_for_filename
+from pygments.token import Token
+
+# Manim frame size (scene units) for each orientation
+FRAME_SIZES = {
+    "landscape": (16.0, 9.0),
+    "portrait": (9.0, 16.0),
+}
+
+DEFAULT_TIMING = {
+    "initialDelay": 1.5,
+    "lineSlideIn": 0.4,
+    "pauseBetweenGroups": 0.2,
+    "finalPause": 2.0,
+}
+
+DEFAULT_SYNTAX_COLORS = {
+    "keywords": "#9b59b6",
+    "types": "#3498db",
+    "functions": "#3498db",
+    "strings": "#2ecc71",
+    "numbers": "#e67e22",
+    "comments": "#7f8c8d",
+    "decorators": "#f1c40f",
+    "default": "#ffffff",
+}
+
+BACKGROUND_COLOR = "#000000"  # Manim's default background
+
+# Text metrics for drawing without Pango: Manim renders Text at
+# font_size / 4.8 pt and scales it by 0.05, monospace advance is ~0.6 em
+TEXT_EM_PER_FONT_SIZE = 0.05 / 4.8
+MONOSPACE_ADVANCE = 0.6
+
+# Rough render costs for estimate_render_cost, on the high side on purpose:
+# a glyph is a VMobject with its own point arrays, every frame redraws the
+# glyphs on screen and Cairo touches every pixel
+GLYPH_MEMORY_KB = 24
+FRAME_BUFFERS = 4  # Camera pixel array, its background and encoder copies
+CPU_SECONDS_PER_MEGAPIXEL_FRAME = 0.004
+CPU_SECONDS_PER_GLYPH_FRAME = 0.00002
+
+
+def parse_line_groups(groups_list):
+    """Parse line groups from JSON list format."""
+    parsed = []
+    for group in groups_list:
+        if group == "ALL_REMAINING":
+            parsed.append("ALL_REMAINING")
+        elif isinstance(group, str) and group.startswith("SPLIT "):
+            split_line = int(group.split()[1])
+            parsed.append(("SPLIT", split_line))
+        elif isinstance(group, str):
+            # Space-separated line numbers
+            parsed.append([int(part) for part in group.split()])
+        elif isinstance(group, list):
+            parsed.append(group)
+    return parsed
+
+
+def resolve_timing(animation_timing):
+    # Apply timing values with defaults, clamped to what still looks sane
+    initial_delay = max(
+        0.0, animation_timing.get("initialDelay", DEFAULT_TIMING["initialDelay"])
+    )
+    line_slide_in = max(
+        0.05, animation_timing.get("lineSlideIn", DEFAULT_TIMING["lineSlideIn"])
+    )
+    pause_between_groups = max(
+        0.0,
+        animation_timing.get(
+            "pauseBetweenGroups", DEFAULT_TIMING["pauseBetweenGroups"]
+        ),
+    )
+    final_pause = max(
+        0.0, animation_timing.get("finalPause", DEFAULT_TIMING["finalPause"])
+    )
+    return {
+        "initial_delay": initial_delay,
+        "line_slide_in": line_slide_in,
+        "pause_between_groups": pause_between_groups,
+        "final_pause": final_pause,
+        "scroll_duration": max(line_slide_in, 0.5),
+    }
+
+
+# Byte-order marks, longest first (UTF-32 LE starts with the UTF-16 LE one)
+SOURCE_BOMS = (
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+ENCODING_SNIFF_BYTES = 64 * 1024
+SOURCE_SCAN_CHUNK = 1 << 20
+# Files whose line checkpoints are kept, a long-lived worker sees many uploads
+SOURCE_CHECKPOINT_FILES = 64
+
+
+def detect_encoding(head):
+    """(encoding, BOM length) from the first bytes of a file.
+
+    A BOM wins; otherwise the head has to decode as UTF-8 (a sequence cut off
+    at the end of the sample is fine), else it's treated as cp1252.
+    """
+    for bom, encoding in SOURCE_BOMS:
+        if head.startswith(bom):
+            return encoding, len(bom)
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+    except UnicodeDecodeError:
+        return "cp1252", 0
+    return "utf-8", 0
+
+
+class SourceIndex:
+    """Line-addressable view of a source file, read through mmap.
+
+    Only the bytes up to the requested range are scanned. Each scan leaves a
+    checkpoint per chunk (newlines seen so far, byte offset), memoized for
+    the SOURCE_CHECKPOINT_FILES most recently opened files, so asking for
+    lines 50,000-50,060 of a huge file is a handful of `count` calls plus
+    decoding the range itself.
+    """
+
+    _checkpoint_cache = OrderedDict()  # Least recently opened first
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        stat = os.fstat(self._file.fileno())
+        if stat.st_size:
+            self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._data = b""
+        self.encoding, bom_length = detect_encoding(
+            self._data[:ENCODING_SNIFF_BYTES]
+        )
+        self._start = bom_length
+
+        # UTF-16/32 newlines aren't a single b"\n", decode those whole
+        self._wide_lines = None
+        if self.encoding in ("utf-16", "utf-32"):
+            text = self._data[:].decode(self.encoding, errors="replace")
+            self._wide_lines = _split_lines(text)
+
+        key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        cache = SourceIndex._checkpoint_cache
+        self._checkpoints = cache.pop(key, None) or [(0, bom_length)]
+        cache[key] = self._checkpoints
+        while len(cache) > SOURCE_CHECKPOINT_FILES:
+            cache.popitem(last=False)
+        self._total_lines = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+    def _line_offset(self, line_number):
+        """Byte offset where a 1-based line starts, or None past the end."""
+        if line_number == 1:
+            return self._start
+        newlines_needed = line_number - 1
+        # Latest checkpoint strictly before the newline we're looking for
+        idx = bisect.bisect_left(self._checkpoints, (newlines_needed,)) - 1
+        seen, pos = self._checkpoints[max(idx, 0)]
+
+        data = self._data
+        while True:
+            chunk_end = min(pos + SOURCE_SCAN_CHUNK, len(data))
+            if chunk_end == pos:
+                return None
+            in_chunk = data[pos:chunk_end].count(b"\n")
+            if seen + in_chunk < newlines_needed:
+                seen += in_chunk
+                pos = chunk_end
+                if pos > self._checkpoints[-1][1]:
+                    self._checkpoints.append((seen, pos))
+                continue
+            while seen < newlines_needed:
+                pos = data.find(b"\n", pos) + 1
+                seen += 1
+            return pos if pos < len(data) else None
+
+    def read_lines(self, start_line, end_line):
+        """Lines start_line..end_line (1-based, inclusive), without newlines.
+
+        Stops early at the end of the file.
+        """
+        if self._wide_lines is not None:
+            return self._wide_lines[start_line - 1 : end_line]
+        start = self._line_offset(start_line)
+        if start is None:
+            return []
+        end = self._line_offset(end_line + 1)
+        if end is None:
+            end = len(self._data)
+        text = self._data[start:end].decode(self.encoding, errors="replace")
+        return _split_lines(text)
+
+    def total_lines(self):
+        """Number of lines, the same as len(f.readlines())."""
+        if self._wide_lines is not None:
+            return len(self._wide_lines)
+        if self._total_lines is None:
+            data = self._data
+            seen, pos = self._checkpoints[-1]
+            seen += data[pos:].count(b"\n")
+            trailing = len(data) > self._start and data[-1:] != b"\n"
+            self._total_lines = seen + int(trailing)
+        return self._total_lines
+
+
+def _split_lines(text):
+    # Only "\n" ends a line, matching the byte index; "\r" is left to rstrip
+    lines = text.split("\n")
+    if lines[-1] == "":
+        lines.pop()
+    return lines
+
+
+def filter_source_lines(
+    source_lines, start_line, end_line, include_comments, first_line=1
+):
+    # Filter lines, for rendering purposes. source_lines may be the whole file
+    # or just a slice of it starting at first_line.
+    filtered_lines = []
+    last_line = min(end_line, first_line - 1 + len(source_lines))
+    for i in range(start_line - 1, last_line):
+        line = source_lines[i - (first_line - 1)].rstrip()
+
+        # Filtering comments if requested
+        if not include_comments:
+            stripped = line.strip()
+            if stripped.startswith("#") or stripped.startswith("//"):
+                continue
+
+        filtered_lines.append((i + 1, line))  # Store (line_number, content)
+    return filtered_lines
+
+
+def compute_layout(num_lines, orientation, frame_w, frame_h):
+    # Margins, font size, line height and whether we need to scroll in chunks
+    if orientation == "portrait":
+        top_margin = 0.3
+        bottom_margin = 0.3
+        left_margin = 0.05
+        right_margin = 0.05
+    else:
+        top_margin = 0.3
+        bottom_margin = 0.3
+        left_margin = 0.3
+        right_margin = 0.3
+
+    available_height = frame_h - top_margin - bottom_margin
+    available_width = frame_w - left_margin - right_margin
+
+    if orientation == "portrait":
+        MIN_FONT_SIZE = 32
+        MAX_FONT_SIZE = 48
+        MIN_LINE_HEIGHT = 0.32
+        MAX_LINE_HEIGHT = 0.45
+    else:
+        MIN_FONT_SIZE = 16
+        MAX_FONT_SIZE = 28
+        MIN_LINE_HEIGHT = 0.35
+        MAX_LINE_HEIGHT = 0.6
+
+    ideal_line_height = available_height / num_lines
+    line_height = max(MIN_LINE_HEIGHT, min(MAX_LINE_HEIGHT, ideal_line_height))
+
+    # Font size scales with line height - use larger multiplier for portrait, normal for landscape
+    font_multiplier = 55 if orientation == "portrait" else 45
+    base_font_size = int(line_height * font_multiplier)
+    base_font_size = max(MIN_FONT_SIZE, min(MAX_FONT_SIZE, base_font_size))
+
+    total_height = num_lines * line_height
+
+    # Determine chunking
+    enable_chunking = False
+    chunk_size = 0
+    lines_that_fit = int(available_height / MIN_LINE_HEIGHT)
+    if total_height > available_height:
+        if num_lines > lines_that_fit * 1.5:
+            enable_chunking = True
+            chunk_size = lines_that_fit
+            line_height = MIN_LINE_HEIGHT
+        else:
+            line_height = available_height / num_lines
+        base_font_size = int(line_height * font_multiplier)
+        base_font_size = max(MIN_FONT_SIZE, min(MAX_FONT_SIZE, base_font_size))
+
+    return {
+        "frame_width": frame_w,
+        "frame_height": frame_h,
+        "top_margin": top_margin,
+        "bottom_margin": bottom_margin,
+        "left_margin": left_margin,
+        "right_margin": right_margin,
+        "available_width": available_width,
+        "available_height": available_height,
+        "line_height": line_height,
+        "font_size": base_font_size,
+        "total_height": total_height,
+        "enable_chunking": enable_chunking,
+        "chunk_size": chunk_size,
+        # Center of the first line, the rest stack down from here
+        "y_start": (num_lines * line_height / 2) - (line_height / 2),
+    }
+
+
+def build_token_colors(custom_colors):
+    # Get colors from custom config or defaults
+    color_keywords = custom_colors.get("keywords", DEFAULT_SYNTAX_COLORS["keywords"])
+    color_types = custom_colors.get("types", DEFAULT_SYNTAX_COLORS["types"])
+    color_functions = custom_colors.get(
+        "functions", DEFAULT_SYNTAX_COLORS["functions"]
+    )
+    color_strings = custom_colors.get("strings", DEFAULT_SYNTAX_COLORS["strings"])
+    color_numbers = custom_colors.get("numbers", DEFAULT_SYNTAX_COLORS["numbers"])
+    color_comments = custom_colors.get("comments", DEFAULT_SYNTAX_COLORS["comments"])
+    color_decorators = custom_colors.get(
+        "decorators", DEFAULT_SYNTAX_COLORS["decorators"]
+    )
+    color_default = custom_colors.get("default", DEFAULT_SYNTAX_COLORS["default"])
+
+    token_colors = {
+        Token.Comment.Multiline: color_comments,
+        Token.Comment.Single: color_comments,
+        Token.Comment.Special: color_comments,
+        Token.Comment.Preproc: color_comments,
+        Token.Comment.PreprocFile: color_comments,
+        Token.Comment: color_comments,
+        Token.Keyword.Namespace: color_types,
+        Token.Keyword.Type: color_keywords,
+        Token.Keyword.Constant: color_keywords,
+        Token.Keyword.Declaration: color_keywords,
+        Token.Keyword.Pseudo: color_keywords,
+        Token.Keyword.Reserved: color_keywords,
+        Token.Keyword: color_keywords,
+        Token.Name.Builtin: color_types,
+        Token.Name.Builtin.Pseudo: color_types,
+        Token.Name.Function: color_functions,
+        Token.Name.Function.Magic: color_functions,
+        Token.Name.Class: color_types,
+        Token.Name.Decorator: color_decorators,
+        Token.Name.Variable: color_types,  # For GDScript $node_refs
+        Token.Name.Constant: color_numbers,
+        Token.String.Doc: color_strings,
+        Token.String.Single: color_strings,
+        Token.String.Double: color_strings,
+        Token.String.Escape: color_decorators,
+        Token.String.Interpol: color_decorators,
+        Token.String.Regex: color_strings,
+        Token.String.Char: color_strings,
+        Token.String: color_strings,
+        Token.Literal.String: color_strings,
+        Token.Literal.String.Doc: color_strings,
+        Token.Number.Integer: color_numbers,
+        Token.Number.Float: color_numbers,
+        Token.Number.Hex: color_numbers,
+        Token.Number.Oct: color_numbers,
+        Token.Number.Bin: color_numbers,
+        Token.Number: color_numbers,
+        Token.Literal.Number: color_numbers,
+        Token.Operator.Word: color_keywords,
+        Token.Comment.Preproc: color_keywords,
+    }
+    return token_colors, color_default
+
+
+def fix_gdscript_tokens(full_tokens):
+    # GDScript-specific token fixes for Godot 4 syntax
+    fixed_tokens = []
+    i = 0
+    num_tokens = len(full_tokens)
+    while i < num_tokens:
+        token_type, token_value = full_tokens[i]
+
+        # Fix @annotations: Token.Error('@') + Token.Keyword -> Token.Name.Decorator
+        if token_type == Token.Error and token_value == "@" and i + 1 < num_tokens:
+            next_type, next_value = full_tokens[i + 1]
+            if next_type in Token.Keyword:
+                fixed_tokens.append((Token.Name.Decorator, "@" + next_value))
+                i += 2
+                continue
+
+        # Fix $node_refs: Token.Operator('$') + Token.Name (+ '/' + Token.Name)* -> Token.Name.Variable
+        if token_type == Token.Operator and token_value == "$" and i + 1 < num_tokens:
+            next_type, next_value = full_tokens[i + 1]
+            if next_type == Token.Name:
+                node_path = "$" + next_value
+                j = i + 2
+                # Continue consuming /Name pairs
+                while j + 1 < num_tokens:
+                    slash_type, slash_value = full_tokens[j]
+                    if slash_type == Token.Operator and slash_value == "/":
+                        name_type, name_value = full_tokens[j + 1]
+                        if name_type == Token.Name:
+                            node_path += "/" + name_value
+                            j += 2
+                            continue
+                    break
+                fixed_tokens.append((Token.Name.Variable, node_path))
+                i = j
+                continue
+
+        fixed_tokens.append((token_type, token_value))
+        i += 1
+
+    return fixed_tokens
+
+
+def build_color_map(filtered_lines, script_path, custom_colors):
+    """Per-character colors for every filtered line (list of lists)."""
+    token_colors, default_color = build_token_colors(custom_colors)
+
+    # Pre-build inheritance lookup as tuple for faster iteration
+    # Order matters: more specific types first (longer tuples checked first)
+    _token_parents = tuple(sorted(token_colors.items(), key=lambda x: -len(x[0])))
+    _token_color_cache = {}
+
+    def get_token_color(token_type):
+        """Get color for token type with caching for inheritance lookup"""
+        if token_type in _token_color_cache:
+            return _token_color_cache[token_type]
+
+        # Direct lookup first (O(1) dict access)
+        if token_type in token_colors:
+            _token_color_cache[token_type] = token_colors[token_type]
+            return token_colors[token_type]
+
+        # Check inheritance using pre-sorted tuple (most specific first)
+        for ttype, tcolor in _token_parents:
+            if token_type in ttype:
+                _token_color_cache[token_type] = tcolor
+                return tcolor
+
+        _token_color_cache[token_type] = default_color
+        return default_color
+
+    # Cache lexer to avoid repeated file detection
+    try:
+        lexer = get_lexer_for_filename(script_path)
+    except Exception:
+        lexer = TextLexer()
+
+    full_code_text = "\n".join(content for _, content in filtered_lines)
+    full_tokens = list(lex(full_code_text, lexer))
+
+    if script_path.endswith(".gd"):
+        full_tokens = fix_gdscript_tokens(full_tokens)
+
+    # Build color map using list of lists for O(1) access (vs dict hashing)
+    # Pre-allocate each line's color array based on line length for O(1) assignment
+    num_filtered = len(filtered_lines)
+    color_map = [[default_color] * len(content) for _, content in filtered_lines]
+    current_line = 0
+    current_char = 0
+
+    for token_type, token_value in full_tokens:
+        token_color = get_token_color(token_type)
+
+        # Process token value and map positions to colors
+        for char in token_value:
+            if char == "\n":
+                current_line += 1
+                current_char = 0
+            else:
+                # Direct assignment - array already pre-allocated
+                if current_line < num_filtered:
+                    line_colors = color_map[current_line]
+                    if current_char < len(line_colors):
+                        line_colors[current_char] = token_color
+                current_char += 1
+
+    return color_map, default_color
+
+
+def build_color_runs(content, line_colors, display_char_idx, default_color):
+    """Runs of consecutive same-colored display chars, skipping default color.
+
+    Returns [(start_idx, end_idx, color), ...] indexed into the displayed line
+    (line number gutter included, tabs expanded to 4 spaces).
+    """
+    original_char_idx = 0
+    color_runs = []
+    current_run_start = display_char_idx
+    current_run_color = None
+
+    for orig_char in content:
+        # Get color from pre-computed list (O(1) vs dict hash)
+        color = (
+            line_colors[original_char_idx]
+            if original_char_idx < len(line_colors)
+            else default_color
+        )
+
+        char_count = 4 if orig_char == "\t" else 1
+
+        if color != current_run_color:
+            # Save previous run if exists
+            if current_run_color is not None and current_run_color != default_color:
+                color_runs.append(
+                    (current_run_start, display_char_idx, current_run_color)
+                )
+            current_run_start = display_char_idx
+            current_run_color = color
+
+        display_char_idx += char_count
+        original_char_idx += 1
+
+    # Don't forget the last run
+    if current_run_color is not None and current_run_color != default_color:
+        color_runs.append((current_run_start, display_char_idx, current_run_color))
+
+    return color_runs
+
+
+def build_timeline(filtered_lines, line_groups, layout, timing):
+    """Turn line groups into the list of waits, slide-ins and scrolls to play.
+
+    Slide-ins carry the line indexes and the y each line lands on, scrolls
+    carry the indexes of the lines that move up and off screen.
+    """
+    line_to_index = {line_num: idx for idx, (line_num, _) in enumerate(filtered_lines)}
+    line_height = layout["line_height"]
+    shown_lines = set()
+    timeline = [{"type": "wait", "duration": timing["initial_delay"]}]
+
+    def lines_in_group(group):
+        lines_to_show = []
+        for line_num in group:
+            if line_num in line_to_index and line_num not in shown_lines:
+                shown_lines.add(line_num)
+                lines_to_show.append(line_to_index[line_num])
+        return lines_to_show
+
+    def remaining_lines():
+        lines_to_show = [
+            idx
+            for idx, (line_num, _) in enumerate(filtered_lines)
+            if line_num not in shown_lines
+        ]
+        shown_lines.update(filtered_lines[idx][0] for idx in lines_to_show)
+        return lines_to_show
+
+    def slide_in(lines, y_positions):
+        timeline.append(
+            {
+                "type": "slide_in",
+                "lines": lines,
+                "y": y_positions,
+                "duration": timing["line_slide_in"],
+            }
+        )
+        timeline.append({"type": "wait", "duration": timing["pause_between_groups"]})
+
+    if not layout["enable_chunking"]:
+        for group in line_groups:
+            if group == "ALL_REMAINING":
+                lines_to_show = remaining_lines()
+            else:
+                # SPLIT only scrolls in chunked mode, here it is just its line
+                lines_to_show = lines_in_group(group)
+
+            if lines_to_show:
+                slide_in(
+                    lines_to_show,
+                    [layout["y_start"] - idx * line_height for idx in lines_to_show],
+                )
+    else:
+        # Chunked display mode - show lines in chunks, scrolling up between chunks
+        chunk_size = layout["chunk_size"]
+        currently_visible = []  # Track which lines are currently visible on screen
+
+        # Y position for a line within the current visible chunk
+        chunk_height = chunk_size * line_height
+        y_start_chunk = (chunk_height / 2) - (line_height / 2)
+
+        def scroll():
+            timeline.append(
+                {
+                    "type": "scroll",
+                    "lines": list(currently_visible),
+                    "distance": layout["available_height"] + 1,
+                    "duration": timing["scroll_duration"],
+                }
+            )
+            currently_visible.clear()
+
+        def slide_into_slots(lines):
+            first_slot = len(currently_visible)
+            slide_in(
+                lines,
+                [
+                    y_start_chunk - (first_slot + i) * line_height
+                    for i in range(len(lines))
+                ],
+            )
+            currently_visible.extend(lines)
+
+        for group in line_groups:
+            if group == "ALL_REMAINING":
+                remaining = remaining_lines()
+                while remaining:
+                    available_slots = chunk_size - len(currently_visible)
+                    if available_slots <= 0:
+                        scroll()
+                        available_slots = chunk_size
+
+                    chunk = remaining[:available_slots]
+                    remaining = remaining[available_slots:]
+                    slide_into_slots(chunk)
+
+            elif isinstance(group, tuple) and group[0] == "SPLIT":
+                # SPLIT command: scroll current content off, then show from the split line
+                if currently_visible:
+                    scroll()
+
+                lines_to_show = lines_in_group([group[1]])
+                if lines_to_show:
+                    slide_into_slots(lines_to_show)
+
+            else:
+                lines_to_show = lines_in_group(group)
+                if lines_to_show:
+                    if len(lines_to_show) > chunk_size - len(currently_visible):
+                        scroll()
+                    slide_into_slots(lines_to_show)
+
+    # Final pause
+    timeline.append({"type": "wait", "duration": timing["final_pause"]})
+    return timeline
+
+
+def build_render_plan(
+    anim_config, source_lines, frame_w=None, frame_h=None, first_line=1
+):
+    """Everything needed to draw the animation, as plain JSON-able data.
+
+    anim_config is the renderer config (snake_case keys, parsed line groups),
+    source_lines the file as a list of strings, either whole or a slice
+    starting at first_line (see SourceIndex.read_lines).
+    """
+    script_path = anim_config["script_path"]
+    orientation = anim_config.get("orientation", "landscape")
+    if frame_w is None or frame_h is None:
+        frame_w, frame_h = FRAME_SIZES.get(orientation, FRAME_SIZES["landscape"])
+
+    filtered_lines = filter_source_lines(
+        source_lines,
+        anim_config["start_line"],
+        anim_config["end_line"],
+        anim_config["include_comments"],
+        first_line,
+    )
+    if not filtered_lines:
+        raise ValueError("No lines to animate in the selected range")
+
+    max_line_num = max(line_num for line_num, _ in filtered_lines)
+    line_num_width = len(str(max_line_num))
+
+    timing = resolve_timing(anim_config.get("animation_timing") or {})
+    layout = compute_layout(len(filtered_lines), orientation, frame_w, frame_h)
+    color_map, default_color = build_color_map(
+        filtered_lines, script_path, anim_config.get("syntax_colors") or {}
+    )
+
+    lines = []
+    for line_idx, (line_num, content) in enumerate(filtered_lines):
+        lines.append(
+            {
+                "number": line_num,
+                "text": f"{line_num:>{line_num_width}}  {content.replace(chr(9), '    ')}",
+                "runs": build_color_runs(
+                    content, color_map[line_idx], line_num_width + 2, default_color
+                ),
+            }
+        )
+
+    return {
+        "script_path": script_path,
+        "orientation": orientation,
+        "line_num_width": line_num_width,
+        "default_color": default_color,
+        "background_color": BACKGROUND_COLOR,
+        "layout": layout,
+        "timing": timing,
+        "lines": lines,
+        "timeline": build_timeline(
+            filtered_lines, anim_config["line_groups"], layout, timing
+        ),
+    }
+
+
+def diff_line_range(anim_config, before_total, after_total):
+    """(start, end) of the after version to put next to start_line..end_line.
+
+    Unless diff_start_line/diff_end_line say otherwise it's the same start
+    and an end shifted by how much the file grew or shrank, so a range
+    picked in the before file covers the same code in the after file.
+    """
+    start = anim_config.get("diff_start_line") or anim_config["start_line"]
+    end = anim_config.get("diff_end_line") or (
+        anim_config["end_line"] + after_total - before_total
+    )
+    return start, max(start, min(end, after_total))
+
+
+def build_diff_plan(
+    anim_config,
+    before_lines,
+    after_lines,
+    frame_w=None,
+    frame_h=None,
+    first_line=1,
+    diff_first_line=1,
+):
+    """Plan for a before -> after animation of two versions of a file.
+
+    Lines that are the same in both versions (text and colors) are a single
+    plan line, created once and moved to their new row (or faded in there if
+    line_groups never showed it). Removed and changed lines fade out,
+    inserted and changed ones fade in. There's no line number
+    gutter: numbers shift with every insert, and every line below would
+    count as changed. The after range is diff_start_line..diff_end_line (see
+    diff_line_range), the before lines build up following line_groups.
+    """
+    script_path = anim_config["script_path"]
+    orientation = anim_config.get("orientation", "landscape")
+    if frame_w is None or frame_h is None:
+        frame_w, frame_h = FRAME_SIZES.get(orientation, FRAME_SIZES["landscape"])
+    include_comments = anim_config["include_comments"]
+
+    before = filter_source_lines(
+        before_lines,
+        anim_config["start_line"],
+        anim_config["end_line"],
+        include_comments,
+        first_line,
+    )
+    after = filter_source_lines(
+        after_lines,
+        anim_config["diff_start_line"],
+        anim_config["diff_end_line"],
+        include_comments,
+        diff_first_line,
+    )
+    if not before or not after:
+        raise ValueError("No lines to animate in the selected range")
+
+    timing = resolve_timing(anim_config.get("animation_timing") or {})
+    # Rows for the longer version, both states share one font size
+    layout = compute_layout(max(len(before), len(after)), orientation, frame_w, frame_h)
+    if layout["enable_chunking"]:
+        raise ValueError(
+            "Diff mode needs both versions to fit on one screen, "
+            "pick a smaller line range"
+        )
+
+    # Both versions are lexed as the same language
+    custom_colors = anim_config.get("syntax_colors") or {}
+    before_colors, default_color = build_color_map(before, script_path, custom_colors)
+    after_colors, _ = build_color_map(after, script_path, custom_colors)
+
+    def plan_lines(filtered_lines, color_map):
+        return [
+            {
+                "number": line_num,
+                "text": content.replace("\t", "    "),
+                "runs": build_color_runs(content, color_map[idx], 0, default_color),
+            }
+            for idx, (line_num, content) in enumerate(filtered_lines)
+        ]
+
+    before_plan = plan_lines(before, before_colors)
+    after_plan = plan_lines(after, after_colors)
+
+    def row_y(row):
+        return layout["y_start"] - row * layout["line_height"]
+
+    # Before builds up like a normal render (ending on its final pause),
+    # then only the differences animate
+    timeline = build_timeline(before, anim_config["line_groups"], layout, timing)
+    # line_groups may leave some before lines unshown, those are never faded
+    # out or moved, and unchanged ones fade in where the after state has them
+    on_screen = {}
+    for event in timeline:
+        _apply_event(on_screen, event)
+
+    # Before lines keep their indexes, inserted ones are appended after them
+    lines = list(before_plan)
+    removed, moved, inserted = [], [], []
+    matcher = difflib.SequenceMatcher(
+        None,
+        [(line["text"], tuple(line["runs"])) for line in before_plan],
+        [(line["text"], tuple(line["runs"])) for line in after_plan],
+        autojunk=False,
+    )
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            for offset in range(i2 - i1):
+                idx, y = i1 + offset, row_y(j1 + offset)
+                if idx not in on_screen:
+                    inserted.append((idx, y))
+                elif on_screen[idx] != y:
+                    moved.append((idx, y))
+            continue
+        removed.extend(idx for idx in range(i1, i2) if idx in on_screen)
+        for j in range(j1, j2):
+            inserted.append((len(lines), row_y(j)))
+            lines.append(after_plan[j])
+
+    if removed:
+        timeline.append(
+            {
+                "type": "fade_out",
+                "lines": removed,
+                "duration": timing["line_slide_in"],
+            }
+        )
+    if moved:
+        timeline.append(
+            {
+                "type": "move",
+                "lines": [idx for idx, _ in moved],
+                "y": [y for _, y in moved],
+                "duration": timing["scroll_duration"],
+            }
+        )
+    if inserted:
+        timeline.append(
+            {
+                "type": "fade_in",
+                "lines": [idx for idx, _ in inserted],
+                "y": [y for _, y in inserted],
+                "duration": timing["line_slide_in"],
+            }
+        )
+    timeline.append({"type": "wait", "duration": timing["final_pause"]})
+
+    return {
+        "script_path": script_path,
+        "orientation": orientation,
+        "line_num_width": 0,
+        "default_color": default_color,
+        "background_color": BACKGROUND_COLOR,
+        "layout": layout,
+        "timing": timing,
+        "lines": lines,
+        "timeline": timeline,
+        "diff_range": [anim_config["diff_start_line"], anim_config["diff_end_line"]],
+    }
+
+
+def _apply_event(on_screen, event):
+    # Track {line index: y} of what's on screen through the timeline
+    if event["type"] in ("slide_in", "move", "fade_in"):
+        on_screen.update(zip(event["lines"], event["y"]))
+    elif event["type"] in ("scroll", "fade_out"):
+        for idx in event["lines"]:
+            on_screen.pop(idx, None)
+
+
+def final_line_positions(plan):
+    """{line index: y} for every line still on screen when the video ends."""
+    positions = {}
+    for event in plan["timeline"]:
+        _apply_event(positions, event)
+    return positions
+
+
+def timeline_segment_keys(plan, render_settings):
+    """One cache key per timeline event, for the segment cache.
+
+    A segment's frames only depend on which lines are on screen when it
+    starts, the event itself and how the video is encoded, so tweaking a
+    later group or the final pause keeps every key before it. All lines go
+    into the key since the width fitting looks at every one of them.
+    """
+    base = json.dumps(
+        [
+            render_settings,
+            plan["layout"],
+            plan["default_color"],
+            plan["background_color"],
+            [[line["text"], line["runs"]] for line in plan["lines"]],
+        ],
+        sort_keys=True,
+    )
+    base_hash = hashlib.sha256(base.encode()).hexdigest()
+
+    on_screen = {}  # line index -> y
+    keys = []
+    for event in plan["timeline"]:
+        state = json.dumps(
+            [base_hash, sorted(on_screen.items()), event], sort_keys=True
+        )
+        keys.append(hashlib.sha256(state.encode()).hexdigest()[:32])
+        _apply_event(on_screen, event)
+    return keys
+
+
+def link_or_copy(source, dest):
+    """Put source's bytes at dest, replacing whatever dest was.
+
+    A hardlink when both are on the same filesystem (the bytes are only on
+    disk once), a copy otherwise. Either way dest stays readable if source is
+    deleted later, and it only ever appears whole, the link or copy goes to a
+    temp name next to it first. Raises FileNotFoundError if source is gone.
+    Shared by the backend's video cache and CodeAnimation's segment cache.
+    """
+    temp = f"{dest}.{os.getpid()}.tmp"
+    try:
+        try:
+            os.link(source, temp)
+        except FileNotFoundError:
+            raise
+        except OSError:  # Other filesystem, or a leftover temp
+            shutil.copy(source, temp)
+        os.replace(temp, dest)
+    except OSError:
+        if os.path.lexists(temp):
+            os.unlink(temp)
+        raise
+
+
+def estimate_render_cost(plan, pixels, fps):
+    """Predicted peak memory (MB) and CPU seconds of rendering plan.
+
+    Memory is mostly the glyphs, so only fewer lines bring it down. CPU goes
+    with frames times pixels, so a lower quality or frame rate helps there.
+    """
+    glyphs = sum(len("".join(line["text"].split())) for line in plan["lines"])
+    layout = plan["layout"]
+    # In chunked mode only a chunk worth of lines gets drawn each frame
+    visible = glyphs
+    if layout["enable_chunking"]:
+        visible = glyphs * min(1.0, layout["chunk_size"] / len(plan["lines"]))
+    frames = int(sum(event.get("duration", 0) for event in plan["timeline"]) * fps)
+
+    memory_mb = (glyphs * GLYPH_MEMORY_KB + pixels * 4 * FRAME_BUFFERS / 1024) / 1024
+    cpu_seconds = frames * (
+        pixels / 1e6 * CPU_SECONDS_PER_MEGAPIXEL_FRAME
+        + visible * CPU_SECONDS_PER_GLYPH_FRAME
+    )
+    return {
+        "glyphs": glyphs,
+        "frames": frames,
+        "memory_mb": round(memory_mb),
+        "cpu_seconds": round(cpu_seconds),
+    }
+
+
+def render_plan_svg(plan):
+    """SVG with one <g id="line-N"> per line, placed as in the final frame.
+
+    Lines that are off screen at the end are hidden, so this is both a still
+    of the final frame and the glyph sheet a client-side player animates.
+    """
+    layout = plan["layout"]
+    frame_w = layout["frame_width"]
+    frame_h = layout["frame_height"]
+    em = layout["font_size"] * TEXT_EM_PER_FONT_SIZE
+
+    # Same width fitting as the renderer, just with estimated glyph widths
+    max_chars = max(len(line["text"]) for line in plan["lines"])
+    text_width = max_chars * MONOSPACE_ADVANCE * em
+    if text_width > layout["available_width"]:
+        em *= layout["available_width"] / text_width
+
+    final_positions = final_line_positions(plan)
+    left_x = -frame_w / 2 + layout["left_margin"]
+
+    def attr(value):
+        # Colors can be anything the client sent as syntaxColors
+        return escape(str(value), {'"': "&quot;"})
+
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" '
+        f'viewBox="{-frame_w / 2:g} {-frame_h / 2:g} {frame_w:g} {frame_h:g}">',
+        f'<rect x="{-frame_w / 2:g}" y="{-frame_h / 2:g}" width="{frame_w:g}" '
+        f'height="{frame_h:g}" fill="{attr(plan["background_color"])}"/>',
+        f'<g font-family="monospace" font-size="{em:.4f}" '
+        f'fill="{attr(plan["default_color"])}" xml:space="preserve">',
+    ]
+    for idx, line in enumerate(plan["lines"]):
+        y = final_positions.get(idx)
+        visibility = "" if y is not None else ' visibility="hidden"'
+        # SVG y grows downwards, Manim's grows upwards
+        parts.append(
+            f'<g id="line-{idx}" transform="translate(0 {-(y or 0.0):.4f})"'
+            f"{visibility}>"
+            f'<text x="{left_x:g}" y="0" dominant-baseline="central">'
+        )
+        text = line["text"]
+        cursor = 0
+        for start_idx, end_idx, color in line["runs"]:
+            if start_idx > cursor:
+                parts.append(escape(text[cursor:start_idx]))
+            parts.append(
+                f'<tspan fill="{attr(color)}">'
+                f"{escape(text[start_idx:end_idx])}</tspan>"
+            )
+            cursor = end_idx
+        parts.append(escape(text[cursor:]))
+        parts.append("</text></g>")
+    parts.append("</g></svg>")
+    return "".join(parts)
+
+
+def export_timeline_bundle(plan):
+    """Client-side playable export: lines, color runs, timeline and SVG."""
+    layout = plan["layout"]
+    return {
+        "version": 1,
+        "frame": {
+            "width": layout["frame_width"],
+            "height": layout["frame_height"],
+            "background": plan["background_color"],
+        },
+        "layout": {
+            "leftMargin": layout["left_margin"],
+            "lineHeight": layout["line_height"],
+            "fontSize": layout["font_size"],
+            "emSize": layout["font_size"] * TEXT_EM_PER_FONT_SIZE,
+            "chunked": layout["enable_chunking"],
+        },
+        "defaultColor": plan["default_color"],
+        "lines": [
+            {"number": line["number"], "text": line["text"], "runs": line["runs"]}
+            for line in plan["lines"]
+        ],
+        # Lines start off screen to the left and slide in to x = leftMargin
+        "timeline": plan["timeline"],
+        "svg": render_plan_svg(plan),
+    }
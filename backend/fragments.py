@@ -0,0 +1,55 @@
+"""Serving a fragmented MP4 while ffmpeg is still writing it.
+
+Live renders write fMP4 (ftyp+moov up front, then a moof+mdat pair per
+fragment) into a .part file. follow_fragments tails that file and only hands
+out whole top-level boxes, so a player never gets half a fragment.
+"""
+
+import asyncio
+
+READ_SIZE = 256 * 1024
+POLL_INTERVAL = 0.2  # Seconds between looks at a .part that stopped growing
+
+
+def complete_boxes_length(data):
+    # How many bytes at the start of data are whole top-level boxes
+    pos = 0
+    while len(data) - pos >= 8:
+        size = int.from_bytes(data[pos : pos + 4], "big")
+        if size == 1:  # 64-bit size right after the type
+            if len(data) - pos < 16:
+                break
+            size = int.from_bytes(data[pos + 8 : pos + 16], "big")
+        if size < 8 or pos + size > len(data):
+            break  # Incomplete, or size 0 (runs to the end, known when done)
+        pos += size
+    return pos
+
+
+async def follow_fragments(f, finished):
+    """Yield the boxes of the MP4 open as f (aiofiles) as they're written.
+
+    finished() says whether the writer is done, the rest of the file is sent
+    then. The file may be renamed or deleted meanwhile, the open handle keeps
+    reading the same file. Closes f when done.
+    """
+    buffer = b""
+    try:
+        while True:
+            chunk = await f.read(READ_SIZE)
+            if chunk:
+                buffer += chunk
+                complete = complete_boxes_length(buffer)
+                if complete:
+                    yield buffer[:complete]
+                    buffer = buffer[complete:]
+                continue
+            if finished():
+                # One more read, it may have written more since the last one
+                buffer += await f.read()
+                if buffer:
+                    yield buffer
+                return
+            await asyncio.sleep(POLL_INTERVAL)
+    finally:
+        await f.close()
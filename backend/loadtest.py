@@ -0,0 +1,330 @@
+"""Load test the backend without rendering anything.
+
+Starts the API with stub_manim.py in place of manim (fixed latency and
+output size, no CPU burnt) and a throwaway data dir, then runs N virtual
+users through what the frontend does: POST /api/animate, poll
+/api/progress, GET /api/stream and /api/download. Prints throughput,
+p50/p99 latency per endpoint and how long the server's event loop was
+blocked (from its /metrics).
+
+    python loadtest.py --users 20 --duration 60 --hit-ratio 0.3 \\
+        --quality-mix fast=0.2,standard=0.6,high=0.2 --stub-latency 3
+
+Pass --url to test a server you started yourself instead. Needs httpx
+(pip install httpx).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+try:
+    import httpx
+except ImportError:
+    sys.exit("loadtest.py needs httpx: pip install httpx")
+
+BACKEND_DIR = Path(__file__).parent
+LAG_METRIC = "codeanimator_event_loop_lag_seconds"
+
+SAMPLE_SOURCE = '''def fibonacci(n):
+    """Return the first n Fibonacci numbers."""
+    numbers = [0, 1]
+    while len(numbers) < n:
+        numbers.append(numbers[-1] + numbers[-2])
+    return numbers[:n]
+
+
+print(fibonacci(10))
+'''
+
+
+def parse_mix(text):
+    # "fast=0.2,standard=0.6,high=0.2" -> {"fast": 0.2, ...}
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def make_config(quality, preview):
+    return {
+        "startLine": 1,
+        "endLine": SAMPLE_SOURCE.count("\n"),
+        "includeComments": True,
+        "lineGroups": ["1 2", "ALL_REMAINING"],
+        "quality": quality,
+        "preview": preview,
+    }
+
+
+def lag_stats(metrics_text):
+    # (count, sum, {le: cumulative count}) of the server's event loop lag
+    count, total, buckets = 0, 0.0, {}
+    for line in metrics_text.splitlines():
+        if line.startswith(f"{LAG_METRIC}_count"):
+            count = int(float(line.split()[-1]))
+        elif line.startswith(f"{LAG_METRIC}_sum"):
+            total = float(line.split()[-1])
+        elif line.startswith(f"{LAG_METRIC}_bucket"):
+            le = line.split('le="', 1)[1].split('"', 1)[0]
+            buckets[le] = int(float(line.split()[-1]))
+    return count, total, buckets
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = {}  # endpoint -> [seconds]
+        self.errors = {}  # endpoint -> count
+        self.jobs = 0
+        self.job_latencies = []
+
+    async def timed(self, endpoint, request):
+        started = time.perf_counter()
+        try:
+            response = await request
+            response.raise_for_status()
+            return response
+        except httpx.HTTPError:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+            return None
+        finally:
+            self.latencies.setdefault(endpoint, []).append(
+                time.perf_counter() - started
+            )
+
+
+async def run_user(client, stats, args, deadline, warm_sources):
+    qualities = list(args.quality_mix)
+    weights = list(args.quality_mix.values())
+    while time.monotonic() < deadline:
+        quality = random.choices(qualities, weights)[0]
+        preview = random.random() < args.preview_ratio
+        if random.random() < args.hit_ratio:
+            source = warm_sources[quality]
+        else:
+            # A comment nobody else sends, so it can't be a cache hit
+            source = f"# {uuid.uuid4().hex}\n{SAMPLE_SOURCE}"
+
+        job_started = time.perf_counter()
+        response = await stats.timed(
+            "animate",
+            client.post(
+                "/api/animate",
+                files={"file": ("sample.py", source.encode())},
+                data={"config": json.dumps(make_config(quality, preview))},
+            ),
+        )
+        if response is None:
+            continue
+        result = response.json()
+        if result.get("previewId"):
+            await stats.timed(
+                "preview", client.get(f"/api/stream/{result['previewId']}")
+            )
+
+        # Same polling the frontend does until the video is ready
+        while "videoId" not in result and time.monotonic() < deadline + 60:
+            await asyncio.sleep(args.poll_interval)
+            progress = await stats.timed(
+                "progress", client.get(f"/api/progress/{result['taskId']}")
+            )
+            if progress is None:
+                continue
+            data = progress.json()
+            if data.get("status") in ("error", "timeout"):
+                stats.errors["job"] = stats.errors.get("job", 0) + 1
+                break
+            if data.get("videoId"):
+                result = data
+        if "videoId" not in result:
+            continue
+
+        await stats.timed("stream", client.get(f"/api/stream/{result['videoId']}"))
+        await stats.timed(
+            "download", client.get(f"/api/download/{result['videoId']}")
+        )
+        stats.jobs += 1
+        stats.job_latencies.append(time.perf_counter() - job_started)
+
+
+async def warm_cache(client, args):
+    # One rendered video per quality, cache hits replay these
+    sources = {}
+    for quality in args.quality_mix:
+        source = f"# warm {quality}\n{SAMPLE_SOURCE}"
+        response = await client.post(
+            "/api/animate",
+            files={"file": ("sample.py", source.encode())},
+            data={"config": json.dumps(make_config(quality, False))},
+        )
+        response.raise_for_status()
+        sources[quality] = source
+    return sources
+
+
+async def run(args, base_url):
+    limits = httpx.Limits(max_connections=args.users * 2)
+    timeout = httpx.Timeout(args.request_timeout)
+    async with httpx.AsyncClient(
+        base_url=base_url, limits=limits, timeout=timeout
+    ) as client:
+        warm_sources = await warm_cache(client, args) if args.hit_ratio > 0 else {}
+        before = lag_stats((await client.get("/metrics")).text)
+
+        stats = Stats()
+        started = time.monotonic()
+        deadline = started + args.duration
+        await asyncio.gather(
+            *(
+                run_user(client, stats, args, deadline, warm_sources)
+                for _ in range(args.users)
+            )
+        )
+        elapsed = time.monotonic() - started
+        after = lag_stats((await client.get("/metrics")).text)
+
+    report(args, stats, elapsed, before, after)
+    return 1 if sum(stats.errors.values()) else 0
+
+
+def report(args, stats, elapsed, before, after):
+    print(
+        f"\n{args.users} users for {elapsed:.1f}s, hit ratio {args.hit_ratio}, "
+        f"poll every {args.poll_interval}s"
+    )
+    print(f"\n{'endpoint':<10} {'count':>7} {'errors':>7} {'p50':>9} {'p99':>9}")
+    rows = dict(stats.latencies)
+    rows["job"] = stats.job_latencies
+    for endpoint, samples in rows.items():
+        print(
+            f"{endpoint:<10} {len(samples):>7} {stats.errors.get(endpoint, 0):>7} "
+            f"{percentile(samples, 50) * 1000:>7.1f}ms "
+            f"{percentile(samples, 99) * 1000:>7.1f}ms"
+        )
+    requests = sum(len(samples) for samples in stats.latencies.values())
+    print(
+        f"\nThroughput: {stats.jobs / elapsed:.2f} jobs/s, "
+        f"{requests / elapsed:.1f} requests/s"
+    )
+
+    probes = after[0] - before[0]
+    stalled = after[1] - before[1]
+    if probes:
+        # p99 from the histogram buckets, as the upper bound of its bucket
+        target = probes * 0.99
+        p99 = "+Inf"
+        for le, cumulative in after[2].items():
+            if cumulative - before[2].get(le, 0) >= target:
+                p99 = le
+                break
+        print(
+            f"Event loop: {stalled:.2f}s stalled over {probes} probes, "
+            f"mean lag {stalled / probes * 1000:.1f}ms, p99 <= {p99}s"
+        )
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args, data_dir):
+    # The real app, only manim and the data dir are swapped out
+    port = free_port()
+    env = os.environ.copy()
+    env.update(
+        {
+            "MANIM_BIN": f"{sys.executable} {BACKEND_DIR / 'stub_manim.py'}",
+            "CODEANIMATOR_DATA_DIR": str(data_dir),
+            "STUB_LATENCY": str(args.stub_latency),
+            "STUB_OUTPUT_BYTES": str(args.stub_output_bytes),
+        }
+    )
+    proc = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "main:app",
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+        ],
+        cwd=BACKEND_DIR,
+        env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        if proc.poll() is not None:
+            raise RuntimeError("Backend exited during startup")
+        try:
+            httpx.get(base_url + "/", timeout=1)
+            return proc, base_url
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError("Backend didn't come up within 10s")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        prog="loadtest.py", description="Load test the API with a stub renderer."
+    )
+    parser.add_argument("--url", help="Test this server instead of starting one")
+    parser.add_argument("-u", "--users", type=int, default=10)
+    parser.add_argument("-d", "--duration", type=float, default=30, help="Seconds")
+    parser.add_argument("--hit-ratio", type=float, default=0.3)
+    parser.add_argument(
+        "--quality-mix",
+        type=parse_mix,
+        default=parse_mix("fast=0.2,standard=0.6,high=0.2"),
+    )
+    parser.add_argument(
+        "--preview-ratio",
+        type=float,
+        default=1.0,
+        help="Share of requests sent with preview: true like the frontend does",
+    )
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    parser.add_argument("--request-timeout", type=float, default=120)
+    parser.add_argument(
+        "--stub-latency", type=float, default=2, help="Seconds per stub render"
+    )
+    parser.add_argument("--stub-output-bytes", type=int, default=2 * 1024 * 1024)
+    args = parser.parse_args(argv)
+
+    if args.url:
+        return asyncio.run(run(args, args.url.rstrip("/")))
+
+    data_dir = Path(tempfile.mkdtemp(prefix="codeanimator-loadtest-"))
+    proc, base_url = start_server(args, data_dir)
+    try:
+        return asyncio.run(run(args, base_url))
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,36 +1,148 @@
+import asyncio
 import hashlib
+import hmac
+import io
 import json
 import os
+import shlex
 import shutil
+import signal
+import socket
 import subprocess
+import sys
+import tempfile
 import threading
 import time
+import uuid
 from datetime import datetime
 from pathlib import Path
 
 import aiofiles
-from fastapi import BackgroundTasks, FastAPI, File, Form, HTTPException, UploadFile
+from fastapi import (
+    BackgroundTasks,
+    FastAPI,
+    File,
+    Form,
+    Header,
+    HTTPException,
+    UploadFile,
+)
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import (
+    FileResponse,
+    JSONResponse,
+    PlainTextResponse,
+    StreamingResponse,
+)
+from fragments import POLL_INTERVAL, follow_fragments
+from metrics import Counter, Gauge, Histogram, render_metrics
+from starlette.concurrency import run_in_threadpool
+
+# RenderPlan.py lives next to CodeAnimator.py, one level up
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from RenderPlan import (
+    ENCODING_SNIFF_BYTES,
+    build_diff_plan,
+    build_render_plan,
+    detect_encoding,
+    diff_line_range,
+    estimate_render_cost,
+    export_timeline_bundle,
+    link_or_copy,
+    parse_line_groups,
+    render_plan_svg,
+)
+
+from output_store import OutputStore  # Needs RenderPlan on the path too
 
 app = FastAPI(title="Code Animator API")
 
 
-def generate_cache_key(file_content: bytes, config_data: dict) -> str:
-    normalized = {
-        "content_hash": hashlib.md5(file_content).hexdigest(),
-        "start_line": config_data.get("startLine"),
-        "end_line": config_data.get("endLine"),
-        "include_comments": config_data.get("includeComments"),
+def read_source_lines(file_content: bytes) -> list:
+    # Lines split on "\n" only, like the renderer's SourceIndex
+    encoding, _ = detect_encoding(file_content[:ENCODING_SNIFF_BYTES])
+    return io.StringIO(
+        file_content.decode(encoding, errors="replace"), newline="\n"
+    ).readlines()
+
+
+def build_request_plan(
+    file_content: bytes, filename: str, config_data: dict, diff_content: bytes = None
+) -> dict:
+    # The plan CodeAnimation will build for this request (raises ValueError
+    # when nothing is left to animate). With diff_content it's a diff mode
+    # plan from the uploaded file to that version of it
+    source_lines = read_source_lines(file_content)
+    anim_config = {
+        "script_path": filename,
+        "start_line": config_data["startLine"],
+        "end_line": config_data["endLine"],
+        "include_comments": config_data["includeComments"],
+        "syntax_colors": config_data.get("syntaxColors", {}),
         "orientation": config_data.get("orientation", "landscape"),
-        "quality": config_data.get("quality", "standard"),
-        "line_groups": json.dumps(sorted(config_data.get("lineGroups", []))),
-        "syntax_colors": json.dumps(
-            config_data.get("syntaxColors", {}), sort_keys=True
-        ),
-        "animation_timing": json.dumps(
-            config_data.get("animationTiming", {}), sort_keys=True
-        ),
+        "animation_timing": config_data.get("animationTiming", {}),
+        "line_groups": parse_line_groups(config_data["lineGroups"]),
+    }
+    if diff_content is None:
+        return build_render_plan(anim_config, source_lines)
+
+    after_lines = read_source_lines(diff_content)
+    anim_config["diff_start_line"] = config_data.get("diffStartLine")
+    anim_config["diff_end_line"] = config_data.get("diffEndLine")
+    diff_start, diff_end = diff_line_range(
+        anim_config, len(source_lines), len(after_lines)
+    )
+    anim_config["diff_start_line"] = diff_start
+    anim_config["diff_end_line"] = diff_end
+    return build_diff_plan(anim_config, source_lines, after_lines)
+
+
+def generate_lookup_key(content_hash: str, filename: str, config_data: dict) -> str:
+    # Everything about a request that goes into its cache key, except the
+    # file itself is only its SHA-256. The extension picks the lexer
+    relevant = {
+        "content": content_hash.lower(),
+        "extension": Path(filename).suffix.lower(),
+        "config": {
+            key: config_data.get(key)
+            for key in (
+                "startLine",
+                "endLine",
+                "includeComments",
+                "orientation",
+                "quality",
+                "lineGroups",
+                "syntaxColors",
+                "animationTiming",
+                "encoderProfile",
+            )
+        },
+    }
+    return hashlib.sha256(json.dumps(relevant, sort_keys=True).encode()).hexdigest()
+
+
+def generate_cache_key(plan: dict, quality: str, encoder_profile: dict) -> str:
+    # Hash what ends up on screen, not how the request spelled it: defaults,
+    # clamped timings and resolved colors all come from the render plan, and
+    # line groups keep their order through the timeline
+    normalized = {
+        "orientation": plan["orientation"],
+        "layout": plan["layout"],
+        "default_color": plan["default_color"].lower(),
+        "background_color": plan["background_color"].lower(),
+        "lines": [
+            [line["text"], [[s, e, color.lower()] for s, e, color in line["runs"]]]
+            for line in plan["lines"]
+        ],
+        "timeline": plan["timeline"],
+        "quality": quality if quality in QUALITY_PRESETS else "standard",
+        # Fragmented (live) MP4 is still a valid MP4 of the same frames, so
+        # live and non-live renders share cache entries and variants
+        "encoder_profile": {
+            key: value
+            for key, value in encoder_profile.items()
+            if key != "fragmented"
+        },
     }
     return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode()).hexdigest()[
         :16
@@ -47,45 +159,436 @@ app.add_middleware(
 )
 
 BASE_DIR = Path(__file__).parent
-UPLOADS_DIR = BASE_DIR / "uploads"
-OUTPUTS_DIR = BASE_DIR / "outputs"
-CACHE_DIR = BASE_DIR / "cache"
+# Everything the server writes lives here, load tests point it somewhere else
+DATA_DIR = Path(os.environ.get("CODEANIMATOR_DATA_DIR") or BASE_DIR)
+UPLOADS_DIR = DATA_DIR / "uploads"
+OUTPUTS_DIR = DATA_DIR / "outputs"
+CACHE_DIR = DATA_DIR / "cache"
+MEDIA_DIR = DATA_DIR / "media"
+# One file per timeline segment, tweaking a config only re-renders the
+# segments it changes (see CodeAnimation's segment cache)
+SEGMENT_CACHE_DIR = CACHE_DIR / "segments"
+# Content hash + config -> cache key of every request we've seen, so clients
+# can ask for a cached video by hash before uploading anything
+LOOKUP_DIR = CACHE_DIR / "lookup"
+# cProfile dumps from jobs that asked for one, only served to admins
+PROFILES_DIR = DATA_DIR / "profiles"
 ANIMATOR_SCRIPT = BASE_DIR.parent / "CodeAnimator.py"
+# Command that renders a scene, loadtest.py swaps in stub_manim.py
+MANIM_CMD = shlex.split(os.environ.get("MANIM_BIN", "manim"))
 
-UPLOADS_DIR.mkdir(exist_ok=True)
+UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
 OUTPUTS_DIR.mkdir(exist_ok=True)
 CACHE_DIR.mkdir(exist_ok=True)
+SEGMENT_CACHE_DIR.mkdir(exist_ok=True)
+LOOKUP_DIR.mkdir(exist_ok=True)
+PROFILES_DIR.mkdir(exist_ok=True)
+
+# Profiles are off unless this is set, nothing to download without it
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
 
 # Cache settings
 MAX_CACHE_AGE = 7 * 24 * 60 * 60  # 7 days in seconds
 MAX_CACHE_SIZE = 5 * 1024 * 1024 * 1024  # 5 GB
+MAX_PROFILE_AGE = 24 * 60 * 60  # 1 day, they're for debugging a slow job now
+
+# Output settings: videos nobody downloads expire on their own, downloaded
+# ones shortly after (PRIVACY), and outputs/ never grows past the budget
+OUTPUT_TTL = int(os.environ.get("OUTPUT_TTL_SECONDS", 60 * 60))  # 1 hour
+MAX_OUTPUTS_SIZE = 2 * 1024 * 1024 * 1024  # 2 GB
+DOWNLOAD_GRACE = 60  # Seconds a downloaded video stays, for retries/seeking
+outputs = OutputStore(OUTPUTS_DIR, OUTPUT_TTL, MAX_OUTPUTS_SIZE)
 
 # Quality presets for different render speeds/quality tradeoffs
+# Frame rate comes from the encoder profile (60 unless the profile says otherwise)
 QUALITY_PRESETS = {
     "fast": {
-        "landscape": ["-ql", "--frame_rate", "60"],  # 480p60
-        "portrait": ["-r", "540,960", "--frame_rate", "60"],
+        "landscape": ["-ql"],  # 480p60
+        "portrait": ["-r", "540,960"],
         "video_dir": "480p60",
+        "pixels": 854 * 480,  # Portrait is close enough for cost estimates
+        "size": {"landscape": (854, 480), "portrait": (540, 960)},
     },
     "standard": {
-        "landscape": ["-qm", "--frame_rate", "60"],  # 720p60
-        "portrait": ["-r", "720,1280", "--frame_rate", "60"],
+        "landscape": ["-qm"],  # 720p60
+        "portrait": ["-r", "720,1280"],
         "video_dir": "720p60",
+        "pixels": 1280 * 720,
+        "size": {"landscape": (1280, 720), "portrait": (720, 1280)},
     },
     "high": {
-        "landscape": ["-qh", "--frame_rate", "60"],  # 1080p60
-        "portrait": ["-r", "1080,1920", "--frame_rate", "60"],
+        "landscape": ["-qh"],  # 1080p60
+        "portrait": ["-r", "1080,1920"],
         "video_dir": "1080p60",
+        "pixels": 1920 * 1080,
+        "size": {"landscape": (1920, 1080), "portrait": (1080, 1920)},
     },
 }
 
+# Encoder profiles for different encode time / file size tradeoffs
+# Code animations are mostly static text so they compress really well
+# Everything except "default" needs ffmpeg (stream render mode)
+ENCODER_PROFILES = {
+    "default": {  # Same as Manim's own writer
+        "codec": "libx264",
+        "crf": 23,
+        "fps": 60,
+        "pix_fmt": "yuv420p",
+        "container": "mp4",
+    },
+    "adaptive": {  # VFR: motion at 60 fps, static holds at 2 fps
+        "codec": "libx264",
+        "crf": 23,
+        "fps": 60,
+        "hold_fps": 2,  # Add "normalize": True to get a constant frame rate back
+        "pix_fmt": "yuv420p",
+        "container": "mp4",
+    },
+    "compact": {  # Smallest MP4, slower encode
+        "codec": "libx264",
+        "crf": 28,
+        "preset": "slow",
+        "tune": "stillimage",
+        "gop": 300,
+        "fps": 30,
+        "pix_fmt": "yuv420p",
+        "container": "mp4",
+    },
+    "fast": {  # Quickest CPU-only encode
+        "codec": "libx264",
+        "crf": 26,
+        "preset": "ultrafast",
+        "tune": "animation",
+        "gop": 120,
+        "fps": 30,
+        "pix_fmt": "yuv420p",
+        "container": "mp4",
+    },
+    "webm": {
+        "codec": "libvpx-vp9",
+        "crf": 36,
+        "gop": 300,
+        "fps": 30,
+        "pix_fmt": "yuv420p",
+        "container": "webm",
+    },
+    "gif": {  # For READMEs, palette built from the video itself
+        "codec": "gif",
+        "fps": 15,
+        "filter": "split[a][b];[a]palettegen=stats_mode=diff[p];[b][p]paletteuse",
+        "container": "gif",
+    },
+    "apng": {
+        "codec": "apng",
+        "fps": 15,
+        "pix_fmt": "rgb24",
+        "container": "apng",
+    },
+}
+
+CONTAINER_EXTENSIONS = {
+    "mp4": ".mp4",
+    "webm": ".webm",
+    "gif": ".gif",
+    "apng": ".png",
+}
+
+MEDIA_TYPES = {
+    ".mp4": "video/mp4",
+    ".webm": "video/webm",
+    ".gif": "image/gif",
+    ".png": "image/png",  # APNGs
+    ".svg": "image/svg+xml",  # Preview stills
+}
+
+# "stream" pipes frames from CodeAnimation straight into one ffmpeg process
+# instead of writing and concatenating partial movie files
+RENDER_MODE = "stream"
+
 TIMEOUT_BY_QUALITY = {
     "fast": 180,
     "standard": 360,
     "high": 600,
 }
 
+# Deriving a lower quality from a cached render is one ffmpeg downscale
+VARIANT_TIMEOUT = 120
+
+# Per-render limits, enforced as rlimits inside the render process (see
+# apply_render_limits in CodeAnimator.py). Memory and CPU are on top of what
+# the process uses once Manim is imported
+RENDER_LIMITS = {
+    "memory_mb": int(os.environ.get("RENDER_MEMORY_MB", 2048)),
+    "cpu_seconds": int(os.environ.get("RENDER_CPU_SECONDS", 600)),
+    "open_files": int(os.environ.get("RENDER_OPEN_FILES", 1024)),
+}
+# Cheapest last, jobs predicted to go over the limits step down this list
+QUALITY_ORDER = ["high", "standard", "fast"]
+DOWNGRADE_FPS = 30
+# Same as CodeAnimator.py, marks the stderr line with a limit error
+LIMIT_PREFIX = "RENDER LIMIT: "
+
+# Batch requests render in one CodeAnimator.py --batch process, its workers
+# keep Manim, fonts and the glyph SVG cache warm across every item
+BATCH_WORKERS = min(4, os.cpu_count() or 1)
+MANIFEST_PREFIX = "MANIFEST "
+
+# Opt-in fork server (ANIM_FORK_SERVER=1): one CodeAnimator.py --serve
+# process imports Manim and warms fonts once, then forks a child per render
+# that shares those pages copy-on-write instead of starting a fresh `manim`
+FORK_SERVER = os.environ.get("ANIM_FORK_SERVER", "") == "1"
+FORK_SERVER_WORKERS = int(os.environ.get("ANIM_FORK_WORKERS", os.cpu_count() or 1))
+# Unix socket paths max out around 100 chars, DATA_DIR can be deeper than that
+FORK_SERVER_SOCKET = Path(tempfile.gettempdir()) / f"codeanimator-{os.getpid()}.sock"
+fork_server_proc = None
+
 progress_tracking = {}
+# task_id -> job of live renders still running, see /api/live
+live_renders = {}
+
+# Render pipeline metrics, scraped from /metrics
+SECONDS_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+REQUESTS = Counter(
+    "codeanimator_requests_total",
+    "Animation requests (batch items count one each)",
+    ["quality", "orientation"],
+)
+CACHE_LOOKUPS = Counter(
+    "codeanimator_cache_lookups_total", "Whole-video cache lookups", ["result"]
+)
+PREFLIGHT_LOOKUPS = Counter(
+    "codeanimator_preflight_lookups_total",
+    "Cache lookups by content hash, before any upload",
+    ["result"],
+)
+QUEUE_WAIT_SECONDS = Histogram(
+    "codeanimator_queue_wait_seconds",
+    "Time from accepting a request to its render starting",
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60),
+)
+RENDER_SECONDS = Histogram(
+    "codeanimator_render_seconds",
+    "Wall time of a full render",
+    ["quality"],
+    buckets=SECONDS_BUCKETS,
+)
+RENDER_PHASE_SECONDS = Histogram(
+    "codeanimator_render_phase_seconds",
+    "Time per CodeAnimation phase (plan, text, layout, animate, finish)",
+    ["phase"],
+    buckets=SECONDS_BUCKETS,
+)
+ENCODE_SECONDS = Histogram(
+    "codeanimator_encode_seconds",
+    "Time the renderer spent feeding and finishing ffmpeg",
+    buckets=SECONDS_BUCKETS,
+)
+FRAMES = Counter(
+    "codeanimator_frames_total",
+    "Video frames rendered, and how many of them went to the encoder",
+    ["stage"],
+)
+SEGMENTS = Counter(
+    "codeanimator_segments_total", "Timeline segments by outcome", ["result"]
+)
+OUTPUT_BYTES = Histogram(
+    "codeanimator_output_bytes",
+    "Size of finished videos",
+    buckets=(1e5, 5e5, 1e6, 5e6, 1e7, 5e7, 1e8, 5e8),
+)
+TIMEOUTS = Counter("codeanimator_render_timeouts_total", "Renders that timed out")
+FAILURES = Counter(
+    "codeanimator_render_failures_total", "Renders that failed", ["stage"]
+)
+ACTIVE_RENDERS = Gauge(
+    "codeanimator_active_renders", "Render processes running right now"
+)
+EVENT_LOOP_LAG = Histogram(
+    "codeanimator_event_loop_lag_seconds",
+    "How late the event loop woke up for a short timer, i.e. time it was blocked",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+LAG_PROBE_INTERVAL = 0.1
+
+
+def count_request(quality: str, orientation: str):
+    # Both labels come from the client, anything unknown is counted as the
+    # value rendering falls back to, so the number of series stays fixed
+    REQUESTS.inc(
+        quality=quality if quality in QUALITY_PRESETS else "standard",
+        orientation="portrait" if orientation == "portrait" else "landscape",
+    )
+
+
+def record_render_metrics(render_metrics: dict):
+    # Phase timings and encoder stats reported by CodeAnimation
+    for phase, seconds in render_metrics.get("phases", {}).items():
+        RENDER_PHASE_SECONDS.observe(seconds, phase=phase)
+    if "encode_seconds" in render_metrics:
+        ENCODE_SECONDS.observe(render_metrics["encode_seconds"])
+    if "frames_encoded" in render_metrics:
+        FRAMES.inc(render_metrics["frames"], stage="rendered")
+        FRAMES.inc(render_metrics["frames_encoded"], stage="encoded")
+    if render_metrics.get("segments"):
+        reused = render_metrics.get("segments_reused", 0)
+        SEGMENTS.inc(reused, result="reused")
+        SEGMENTS.inc(render_metrics["segments"] - reused, result="rendered")
+
+
+def fit_render_limits(plan: dict, quality: str, encoder_profile: dict):
+    # Step quality, then frame rate down until the estimated cost fits
+    # RENDER_LIMITS. Returns (quality, encoder_profile, downgrades), raises
+    # ValueError when even the cheapest settings won't fit
+    downgrades = []
+    while True:
+        fps = encoder_profile.get("fps", 60)
+        cost = estimate_render_cost(plan, QUALITY_PRESETS[quality]["pixels"], fps)
+        if cost["memory_mb"] > RENDER_LIMITS["memory_mb"]:
+            # Glyphs, not pixels, a smaller video won't help
+            raise ValueError(
+                f"Too much code for one render: {cost['glyphs']} characters need "
+                f"about {cost['memory_mb']} MB, the limit is "
+                f"{RENDER_LIMITS['memory_mb']} MB. Try a smaller line range"
+            )
+        if cost["cpu_seconds"] <= RENDER_LIMITS["cpu_seconds"]:
+            return quality, encoder_profile, downgrades
+        if quality != QUALITY_ORDER[-1]:
+            lower = QUALITY_ORDER[QUALITY_ORDER.index(quality) + 1]
+            downgrades.append(f"quality {quality} -> {lower}")
+            quality = lower
+        elif fps > DOWNGRADE_FPS:
+            downgrades.append(f"frame rate {fps} -> {DOWNGRADE_FPS}")
+            encoder_profile = {**encoder_profile, "fps": DOWNGRADE_FPS}
+        else:
+            raise ValueError(
+                f"Too long to render: {cost['frames']} frames need about "
+                f"{cost['cpu_seconds']}s of CPU at the lowest quality, the limit "
+                f"is {RENDER_LIMITS['cpu_seconds']}s. Try shorter timings or "
+                f"fewer lines"
+            )
+
+
+def variant_encoder_args(encoder_profile: dict, size: tuple) -> list:
+    # Same encoder settings as StreamingFileWriter._encoder_args, with the
+    # downscale in front of the profile's own filter
+    codec = encoder_profile.get("codec", "libx264")
+    container = encoder_profile.get("container", "mp4")
+    args = ["-c:v", codec]
+    if encoder_profile.get("crf") is not None:
+        args += ["-crf", str(encoder_profile["crf"])]
+        if codec == "libvpx-vp9":
+            args += ["-b:v", "0", "-row-mt", "1"]
+    for key, flag in (("preset", "-preset"), ("tune", "-tune"), ("gop", "-g")):
+        if encoder_profile.get(key):
+            args += [flag, str(encoder_profile[key])]
+    if encoder_profile.get("hold_fps") and not encoder_profile.get("normalize"):
+        args += ["-fps_mode", "passthrough"]  # Keep the VFR holds as they are
+
+    video_filter = f"scale={size[0]}:{size[1]}:flags=lanczos"
+    if encoder_profile.get("filter"):
+        video_filter += f",{encoder_profile['filter']}"
+    args += ["-filter_complex", video_filter]
+    if encoder_profile.get("pix_fmt"):
+        args += ["-pix_fmt", encoder_profile["pix_fmt"]]
+
+    if container == "mp4":
+        # Even for a live request, nothing watches a variant being written
+        args += ["-movflags", "+faststart"]
+    elif container in ("gif", "apng"):
+        args += ["-loop" if container == "gif" else "-plays", "0"]
+    return args + ["-f", container]
+
+
+def derive_cached_variant(
+    plan: dict, quality: str, encoder_profile: dict, cached_video: Path
+) -> bool:
+    # Cache miss for `quality`, but the same plan may be cached at a higher
+    # quality: downscale that with ffmpeg into cached_video, which takes
+    # seconds instead of a whole render. True if cached_video now exists
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg or quality not in QUALITY_ORDER:
+        return False
+    for higher in QUALITY_ORDER[: QUALITY_ORDER.index(quality)]:
+        source = CACHE_DIR / (
+            generate_cache_key(plan, higher, encoder_profile) + cached_video.suffix
+        )
+        if not source.exists():
+            continue
+        size = QUALITY_PRESETS[quality]["size"][plan["orientation"]]
+        # Temp name in the cache dir, nothing sees a half written variant
+        temp_path = cached_video.with_name(
+            f"{cached_video.stem}.{uuid.uuid4().hex[:8]}.part"
+        )
+        command = [ffmpeg, "-y", "-loglevel", "error", "-i", str(source)]
+        command += variant_encoder_args(encoder_profile, size) + [str(temp_path)]
+        try:
+            result = subprocess.run(
+                command, capture_output=True, text=True, timeout=VARIANT_TIMEOUT
+            )
+            if result.returncode != 0:
+                print(f"Warning: Could not derive {quality} variant: {result.stderr}")
+                continue
+            os.replace(temp_path, cached_video)
+            source.touch()  # Still useful, keep it fresh for cache cleanup
+            return True
+        except subprocess.TimeoutExpired:
+            print(f"Warning: Deriving {quality} variant from {higher} timed out")
+        finally:
+            temp_path.unlink(missing_ok=True)
+    return False
+
+
+def remember_lookup(
+    lookup_key: str, cache_key: str, extension: str, downgrades: list
+):
+    # Written on every request, a later pre-flight lookup only hits if the
+    # video it points to has been rendered (and not cleaned up) by then
+    entry = {
+        "cacheKey": cache_key,
+        "extension": extension,
+        "downgraded": downgrades,
+    }
+    temp_path = LOOKUP_DIR / f"{lookup_key}.{uuid.uuid4().hex[:8]}.part"
+    try:
+        temp_path.write_text(json.dumps(entry))
+        os.replace(temp_path, LOOKUP_DIR / f"{lookup_key}.json")
+    except OSError as e:
+        temp_path.unlink(missing_ok=True)
+        print(f"Warning: Could not save cache lookup: {e}")
+
+
+def serve_cached_video(cached_video: Path, video_filename: str, downgrades: list):
+    # Link a cached video into outputs under a fresh id, as a finished task
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    task_id = f"cached-{timestamp}-{uuid.uuid4().hex[:8]}"
+    video_id = outputs.new_id(video_filename)
+    outputs.add(video_id, cached_video, owner=task_id, link=True)
+
+    # Update cache file's mtime to keep it fresh
+    cached_video.touch()
+
+    # Add to progress tracking so frontend polling works
+    progress_tracking[task_id] = {"progress": 100, "status": "complete"}
+
+    return JSONResponse(
+        {
+            "success": True,
+            "message": "Animation retrieved from cache",
+            "videoId": video_id,
+            "filename": video_filename,
+            "taskId": task_id,
+            "cached": True,
+            "downgraded": downgrades,
+        }
+    )
+
+
+def limit_error(stderr: str):
+    # The limit CodeAnimation ran into, if that's why the render failed
+    for line in stderr.splitlines():
+        if line.startswith(LIMIT_PREFIX):
+            return line[len(LIMIT_PREFIX) :]
+    return None
 
 
 def monitor_manim_progress(task_id: str, media_dir: Path, stop_event: threading.Event):
@@ -111,32 +614,37 @@ def monitor_manim_progress(task_id: str, media_dir: Path, stop_event: threading.
 
                 # Count PNG frames more efficiently - consolidate directory checks
                 frame_files = 0
+                stream_bytes = 0
                 video_exists = False
-                # Check all possible quality directories
-                for quality_dir in [
-                    "480p24",
-                    "720p30",
-                    "1080p30",
-                    "1080p60",
-                    "1920p60",
-                    "960p24",
-                    "1280p30",
-                    "1920p30",
-                ]:
-                    partial_dir = (
-                        media_dir
-                        / "videos"
-                        / "CodeAnimator"
-                        / quality_dir
-                        / "partial_movie_files"
-                    )
+                videos_base = media_dir / "videos" / "CodeAnimator"
+                # Check every quality directory Manim created (name varies with preset)
+                quality_dirs = (
+                    [d for d in videos_base.iterdir() if d.is_dir()]
+                    if videos_base.exists()
+                    else []
+                )
+                # Fork-server renders write into a job-* dir one level down
+                quality_dirs += {
+                    part_file.parent
+                    for part_file in media_dir.glob("job-*/videos/**/*.part")
+                }
+                for video_dir in quality_dirs:
+                    partial_dir = video_dir / "partial_movie_files"
                     if partial_dir.exists():
                         # Count files with list comprehension (more efficient than generator with sum)
                         frame_files += len([f for f in partial_dir.glob("*.png")])
-                    video_dir = media_dir / "videos" / "CodeAnimator" / quality_dir
+                    # Stream mode has no partial files, the .part movie grows instead
+                    for part_file in video_dir.glob("*.part"):
+                        try:
+                            stream_bytes += part_file.stat().st_size
+                        except OSError:
+                            pass  # Renamed to .mp4 between glob and stat
                     # Early exit if video found - no need to check further
-                    if not video_exists and video_dir.exists():
+                    if not video_exists:
                         video_exists = any(video_dir.glob("*.mp4"))
+                if stream_bytes > 0:
+                    # Roughly one "frame" per 16 KB of encoded stream
+                    frame_files += stream_bytes // 16384
 
                 total_files = svg_files + frame_files
 
@@ -190,19 +698,21 @@ def cleanup_cache():
     files_by_age = []
 
     # Use os.scandir for more efficient stat batching
-    try:
-        with os.scandir(CACHE_DIR) as entries:
-            for entry in entries:
-                if entry.name.endswith(".mp4"):
-                    try:
-                        stat = entry.stat()
-                        age = now - stat.st_mtime
-                        total_size += stat.st_size
-                        files_by_age.append((age, stat.st_size, Path(entry.path)))
-                    except OSError:
-                        continue
-    except OSError:
-        return
+    # Whole videos and segments share the same age and size budget
+    for cache_dir in (CACHE_DIR, SEGMENT_CACHE_DIR):
+        try:
+            with os.scandir(cache_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith(tuple(MEDIA_TYPES)):
+                        try:
+                            stat = entry.stat()
+                            age = now - stat.st_mtime
+                            total_size += stat.st_size
+                            files_by_age.append((age, stat.st_size, Path(entry.path)))
+                        except OSError:
+                            continue
+        except OSError:
+            continue
 
     # Remove files older than MAX_CACHE_AGE
     for age, size, f in files_by_age:
@@ -224,6 +734,116 @@ def cleanup_cache():
             except OSError:
                 pass
 
+    # Lookup entries are tiny, they just expire like the videos they point to
+    try:
+        with os.scandir(LOOKUP_DIR) as entries:
+            for entry in entries:
+                try:
+                    if now - entry.stat().st_mtime > MAX_CACHE_AGE:
+                        os.unlink(entry.path)
+                except OSError:
+                    continue
+    except OSError:
+        pass
+
+    # Profile dirs don't count towards the cache budget, they just expire
+    try:
+        with os.scandir(PROFILES_DIR) as entries:
+            for entry in entries:
+                try:
+                    if now - entry.stat().st_mtime > MAX_PROFILE_AGE:
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                except OSError:
+                    continue
+    except OSError:
+        pass
+
+
+def require_admin(x_admin_token: str):
+    if not ADMIN_TOKEN or not hmac.compare_digest(
+        (x_admin_token or "").encode(), ADMIN_TOKEN.encode()
+    ):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
+def wants_profile(
+    config_data: dict, x_profile: str = None, x_admin_token: str = None
+) -> bool:
+    # Opt-in per job, either "profile": true in the config or an X-Profile
+    # header. Admins only, profiling slows the render and writes files
+    if not config_data.get("profile") and x_profile not in ("1", "true"):
+        return False
+    require_admin(x_admin_token)
+    return True
+
+
+def profile_path(profile_id: str, name: str = "") -> Path:
+    # Resolve inside PROFILES_DIR only, ids and names come straight from the URL
+    root = PROFILES_DIR.resolve()
+    path = (root / profile_id / name).resolve()
+    if root not in path.parents or not path.exists():
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return path
+
+
+@app.on_event("startup")
+def start_output_sweeper():
+    outputs.start()
+
+
+@app.on_event("startup")
+async def start_lag_probe():
+    # Anything hogging the event loop (sync I/O in a handler, ...) shows up
+    # as a timer firing late
+    async def probe():
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(LAG_PROBE_INTERVAL)
+            late = loop.time() - started - LAG_PROBE_INTERVAL
+            EVENT_LOOP_LAG.observe(max(late, 0.0))
+
+    app.state.lag_probe = asyncio.create_task(probe())
+
+
+@app.on_event("startup")
+def start_fork_server():
+    global fork_server_proc
+    if not FORK_SERVER:
+        return
+    env = os.environ.copy()
+    env["ANIM_RENDER_MODE"] = RENDER_MODE
+    env["ANIM_SEGMENT_CACHE"] = str(SEGMENT_CACHE_DIR)
+    # Children inherit the niceness, same as `nice manim` per request
+    fork_server_proc = subprocess.Popen(
+        [
+            "nice",
+            "-n",
+            "10",
+            sys.executable,
+            str(ANIMATOR_SCRIPT),
+            "--serve",
+            str(FORK_SERVER_SOCKET),
+            "--workers",
+            str(FORK_SERVER_WORKERS),
+        ],
+        cwd=ANIMATOR_SCRIPT.parent,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+@app.on_event("shutdown")
+def stop_fork_server():
+    if fork_server_proc is None:
+        return
+    fork_server_proc.terminate()
+    try:
+        fork_server_proc.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        fork_server_proc.kill()
+    FORK_SERVER_SOCKET.unlink(missing_ok=True)
+
 
 @app.get("/")
 async def root():
@@ -231,6 +851,33 @@ async def root():
     return {"status": "ok", "message": "Code Animator API is running"}
 
 
+@app.get("/metrics")
+async def metrics():
+    # Prometheus scrape endpoint
+    return PlainTextResponse(
+        render_metrics(), media_type="text/plain; version=0.0.4"
+    )
+
+
+@app.get("/api/admin/profiles/{profile_id}")
+async def list_profile(profile_id: str, x_admin_token: str = Header(None)):
+    # Files CodeAnimation wrote for a profiled job (pstats, speedscope, summary)
+    require_admin(x_admin_token)
+    profile_dir = profile_path(profile_id)
+    return {
+        "profileId": profile_id,
+        "files": sorted(f.name for f in profile_dir.iterdir() if f.is_file()),
+    }
+
+
+@app.get("/api/admin/profiles/{profile_id}/{name}")
+async def download_profile(
+    profile_id: str, name: str, x_admin_token: str = Header(None)
+):
+    require_admin(x_admin_token)
+    return FileResponse(profile_path(profile_id, name), filename=name)
+
+
 @app.get("/api/progress/{task_id}")
 async def get_progress(task_id: str):
     # Get progress for a specific rendering task
@@ -240,13 +887,58 @@ async def get_progress(task_id: str):
     return progress_tracking[task_id]
 
 
+@app.post("/api/animate/lookup")
+async def lookup_animation(
+    contentHash: str = Form(...),
+    filename: str = Form(...),
+    config: str = Form(...),
+):
+    # Pre-flight cache check: the client sends the SHA-256 of its file instead
+    # of the file, and only uploads to /api/animate on a miss
+    if len(contentHash) != 64 or any(
+        c not in "0123456789abcdef" for c in contentHash.lower()
+    ):
+        raise HTTPException(status_code=400, detail="contentHash must be a SHA-256")
+    try:
+        config_data = json.loads(config)
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid configuration JSON")
+
+    lookup_key = generate_lookup_key(contentHash, filename, config_data)
+    lookup_path = LOOKUP_DIR / f"{lookup_key}.json"
+    try:
+        entry = json.loads(lookup_path.read_text())
+        cached_video = CACHE_DIR / f"{entry['cacheKey']}{entry['extension']}"
+    except (OSError, ValueError, KeyError):
+        cached_video = None
+    if cached_video is None or not cached_video.exists():
+        PREFLIGHT_LOOKUPS.inc(result="miss")
+        return JSONResponse({"success": True, "cached": False})
+
+    PREFLIGHT_LOOKUPS.inc(result="hit")
+    count_request(
+        config_data.get("quality", "standard"),
+        config_data.get("orientation", "landscape"),
+    )
+    lookup_path.touch()
+    video_filename = (
+        f"{Path(filename).stem}_{config_data.get('startLine')}-"
+        f"{config_data.get('endLine')}{entry['extension']}"
+    )
+    return serve_cached_video(cached_video, video_filename, entry["downgraded"])
+
+
 @app.post("/api/animate")
 async def create_animation(
     background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     config: str = Form(...),
+    afterFile: UploadFile = File(None),
+    x_profile: str = Header(None),
+    x_admin_token: str = Header(None),
 ):
-    # Upload a code file and configuration, then generate animation
+    # Upload a code file and configuration, then generate animation. With
+    # afterFile it animates the changes from file to afterFile instead
 
     try:
         # Parse configuration
@@ -261,42 +953,104 @@ async def create_animation(
             "quality", "standard"
         )  # 'fast', 'standard', or 'high'
         preset = QUALITY_PRESETS.get(quality, QUALITY_PRESETS["standard"])
+        count_request(quality, orientation)
+        profile = wants_profile(config_data, x_profile, x_admin_token)
         line_groups = config_data["lineGroups"]
         syntax_colors = config_data.get("syntaxColors", {})
+        encoder_profile = ENCODER_PROFILES.get(
+            config_data.get("encoderProfile", "default"), ENCODER_PROFILES["default"]
+        )
+        video_extension = CONTAINER_EXTENSIONS[encoder_profile["container"]]
+        if encoder_profile is not ENCODER_PROFILES["default"] and not shutil.which(
+            "ffmpeg"
+        ):
+            raise HTTPException(
+                status_code=400, detail="This encoder profile requires ffmpeg"
+            )
+        # Live renders write fragmented MP4, /api/live serves it while ffmpeg
+        # is still encoding. Needs ffmpeg and MP4, otherwise there's no liveUrl
+        live = (
+            bool(config_data.get("live"))
+            and encoder_profile["container"] == "mp4"
+            and shutil.which("ffmpeg") is not None
+        )
+        if live:
+            encoder_profile = {**encoder_profile, "fragmented": True}
 
         # Read file content for cache key generation
         file_content = await file.read()
         await file.seek(0)  # Reset for later use
+        diff_content = await afterFile.read() if afterFile else None
+
+        try:
+            # Decoding, lexing and layout are CPU work, keep them off the
+            # event loop so a big upload doesn't stall every other request
+            plan = await run_in_threadpool(
+                build_request_plan,
+                file_content,
+                file.filename,
+                config_data,
+                diff_content,
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        if config_data.get("outputFormat") == "timeline":
+            if diff_content is not None:
+                raise HTTPException(
+                    status_code=400,
+                    detail="Diff animations can't be exported as a timeline",
+                )
+            # No Manim render or encode at all, the client plays the timeline
+            return JSONResponse(export_timeline_bundle(plan))
+
+        # Jobs predicted to go over the render limits get a cheaper preset
+        # up front instead of failing halfway through (same timeout though)
+        timeout = TIMEOUT_BY_QUALITY.get(quality, 300)
+        try:
+            fitted_quality, encoder_profile, downgrades = fit_render_limits(
+                plan,
+                quality if quality in QUALITY_PRESETS else "standard",
+                encoder_profile,
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        if downgrades:
+            quality = fitted_quality
+            preset = QUALITY_PRESETS[quality]
 
         # Check video cache
-        cache_key = generate_cache_key(file_content, config_data)
-        cached_video = CACHE_DIR / f"{cache_key}.mp4"
+        cache_key = generate_cache_key(plan, quality, encoder_profile)
+        cached_video = CACHE_DIR / f"{cache_key}{video_extension}"
 
         if cached_video.exists():
-            # Cache hit - copy to outputs and return immediately
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            CACHE_LOOKUPS.inc(result="hit")
+        elif await run_in_threadpool(
+            derive_cached_variant, plan, quality, encoder_profile, cached_video
+        ):
+            CACHE_LOOKUPS.inc(result="derived")
+        else:
+            CACHE_LOOKUPS.inc(result="miss")
+        if diff_content is None:
+            # Next time the same file and config can skip the upload
+            background_tasks.add_task(
+                remember_lookup,
+                generate_lookup_key(
+                    hashlib.sha256(file_content).hexdigest(), file.filename, config_data
+                ),
+                cache_key,
+                video_extension,
+                downgrades,
+            )
+        if cached_video.exists():
+            # Cache hit - link into outputs and return immediately
             original_filename = Path(file.filename).stem
-            video_filename = f"{original_filename}_{start_line}-{end_line}.mp4"
-            output_video_path = OUTPUTS_DIR / f"{timestamp}_{video_filename}"
-            shutil.copy(cached_video, output_video_path)
-
-            # Update cache file's mtime to keep it fresh
-            cached_video.touch()
-
-            # Add to progress tracking so frontend polling works
-            task_id = f"cached-{timestamp}"
-            progress_tracking[task_id] = {"progress": 100, "status": "complete"}
-
-            return JSONResponse(
-                {
-                    "success": True,
-                    "message": "Animation retrieved from cache",
-                    "videoId": f"{timestamp}_{video_filename}",
-                    "filename": video_filename,
-                    "taskId": task_id,
-                    "cached": True,
-                }
+            diff_suffix = "_diff" if diff_content is not None else ""
+            video_filename = (
+                f"{original_filename}_{start_line}-{end_line}{diff_suffix}"
+                f"{video_extension}"
             )
+            return serve_cached_video(cached_video, video_filename, downgrades)
         animation_timing = config_data.get("animationTiming", {})
 
         # Generate unique filename - do this once
@@ -311,153 +1065,121 @@ async def create_animation(
             await f.write(file_content)
 
         # Build config JSON to pass via stdin (eliminates temp file I/O)
-        config_json = json.dumps(
-            {
-                "script_path": str(upload_path),
-                "start_line": start_line,
-                "end_line": end_line,
-                "include_comments": include_comments,
-                "syntax_colors": syntax_colors,
-                "orientation": orientation,
-                "animation_timing": animation_timing,
-                "quality": quality,
-                "line_groups": line_groups,
-            }
-        )
+        render_config = {
+            "script_path": str(upload_path),
+            "start_line": start_line,
+            "end_line": end_line,
+            "include_comments": include_comments,
+            "syntax_colors": syntax_colors,
+            "orientation": orientation,
+            "animation_timing": animation_timing,
+            "quality": quality,
+            "line_groups": line_groups,
+            "encoder_profile": encoder_profile,
+            # Only when asked for, see the segment cache in CodeAnimator.py
+            "segment_cache": bool(config_data.get("segmentCache")),
+        }
+        diff_path = None
+        if diff_content is not None:
+            diff_path = (
+                UPLOADS_DIR / f"{original_filename}_{timestamp}_after{file_extension}"
+            )
+            async with aiofiles.open(diff_path, "wb") as f:
+                await f.write(diff_content)
+            render_config["diff_script_path"] = str(diff_path)
+            render_config["diff_start_line"], render_config["diff_end_line"] = plan[
+                "diff_range"
+            ]
+        config_json = json.dumps(render_config)
 
         # Generate output filename
         output_name = f"{original_filename}_{start_line}-{end_line}"
+        if diff_path:
+            output_name += "_diff"
 
-        # Start progress monitoring in background thread
-        media_dir = BASE_DIR / "media"
-        stop_event = threading.Event()
-        task_id = timestamp
-        progress_thread = threading.Thread(
-            target=monitor_manim_progress, args=(task_id, media_dir, stop_event)
-        )
-        progress_thread.start()
-
-        # Build Manim command based on orientation and quality preset
-        quality_flags = (
-            preset["portrait"] if orientation == "portrait" else preset["landscape"]
-        )
-        video_quality_dir = preset["video_dir"]
-
-        manim_cmd = [
-            "nice",
-            "-n",
-            "10",  # Lower CPU priority so FastAPI stays responsive
-            "manim",
-            *quality_flags,
-            "--flush_cache",
-            "-o",
-            output_name,
-            str(ANIMATOR_SCRIPT),
-            "CodeAnimation",
-        ]
-
-        timeout = TIMEOUT_BY_QUALITY.get(quality, 300)
         # Pass orientation via env var (needed at module load time)
         # Pass full config via stdin (eliminates temp file race conditions)
         env = os.environ.copy()
         env["ANIM_ORIENTATION"] = orientation
+        env["ANIM_RENDER_MODE"] = RENDER_MODE
+        env["ANIM_SEGMENT_CACHE"] = str(SEGMENT_CACHE_DIR)
+        env["ANIM_RENDER_LIMITS"] = json.dumps(RENDER_LIMITS)
+
+        # Unique per request, timestamps alone collide when requests share a second
+        task_id = f"{timestamp}-{uuid.uuid4().hex[:8]}"
+        job = {
+            "upload_path": upload_path,
+            "diff_path": diff_path,
+            "config_json": config_json,
+            "output_name": output_name,
+            "orientation": orientation,
+            # Build Manim command based on orientation and quality preset
+            "quality_flags": (
+                preset["portrait"] if orientation == "portrait" else preset["landscape"]
+            ),
+            "fps": encoder_profile["fps"],
+            "video_extension": video_extension,
+            "cached_video": cached_video,
+            "timeout": timeout,
+            "env": env,
+            # Own media dir per job so concurrent renders don't clean up each other
+            "media_dir": MEDIA_DIR / task_id,
+            "quality": quality if quality in QUALITY_PRESETS else "standard",
+            "queued_at": time.monotonic(),
+        }
+        # Only the full render gets profiled, not the preview frame
+        profile_id = task_id if profile else None
+        if profile_id:
+            job["profile_dir"] = PROFILES_DIR / profile_id
+        progress_tracking[task_id] = {"progress": 0, "status": "starting"}
+
+        if config_data.get("preview") or live:
+            # Full render keeps going in the background, the client polls
+            # /api/progress for the videoId while showing the preview still
+            # (or playing /api/live)
+            if live:
+                live_renders[task_id] = job
+            threading.Thread(
+                target=render_job_in_background, args=(task_id, job), daemon=True
+            ).start()
+            preview_id = None
+            if config_data.get("preview"):
+                preview_id = render_preview(task_id, job, plan)
 
-        # Use Popen with streaming to avoid buffering all output in memory
-        proc = subprocess.Popen(
-            manim_cmd,
-            stdin=subprocess.PIPE,
-            stdout=subprocess.DEVNULL,  # Discard stdout to save memory
-            stderr=subprocess.PIPE,
-            text=True,
-            env=env,
-        )
-        try:
-            _, stderr = proc.communicate(input=config_json, timeout=timeout)
-            returncode = proc.returncode
-        except subprocess.TimeoutExpired:
-            proc.kill()
-            proc.communicate()
-            raise
-
-        # monitoring
-        stop_event.set()
-        progress_thread.join(timeout=2)
-
-        if returncode != 0:
-            print(f"Error running Manim: {stderr}")
-            progress_tracking[task_id] = {"progress": 0, "status": "error"}
-            raise HTTPException(
-                status_code=500, detail=f"Animation generation failed: {stderr}"
-            )
-
-        # Update progress to 95% (video generated, now copying)
-        # Only update if not already at or past 95%
-        current_progress = progress_tracking.get(task_id, {}).get("progress", 0)
-        if current_progress < 95:
-            progress_tracking[task_id] = {"progress": 95, "status": "finalizing"}
-
-        # Find the generated video file
-        # Manim outputs to media/videos/CodeAnimator/{quality_dir}/ but dir name varies
-        video_filename = f"{output_name}.mp4"
-        videos_base = BASE_DIR / "media" / "videos" / "CodeAnimator"
-
-        # Search for the video in any quality subdirectory
-        video_path = None
-        if videos_base.exists():
-            for quality_subdir in videos_base.iterdir():
-                if quality_subdir.is_dir():
-                    candidate = quality_subdir / video_filename
-                    if candidate.exists():
-                        video_path = candidate
-                        break
-
-        if video_path is None or not video_path.exists():
-            raise HTTPException(
-                status_code=500, detail=f"Generated video not found in {videos_base}"
+            return JSONResponse(
+                {
+                    "success": True,
+                    "message": "Preview ready, animation still rendering",
+                    "previewId": preview_id,
+                    "liveUrl": f"/api/live/{task_id}" if live else None,
+                    "filename": f"{output_name}{video_extension}",
+                    "taskId": task_id,
+                    "pending": True,
+                    "profileId": profile_id,
+                    "downgraded": downgrades,
+                }
             )
 
-        # Copy video to outputs directory
-        output_video_path = OUTPUTS_DIR / f"{timestamp}_{video_filename}"
-        shutil.copy(video_path, output_video_path)
-
-        # Save to cache for future identical requests
-        try:
-            shutil.copy(video_path, cached_video)
-            # Run cache cleanup in background (non-blocking)
-            background_tasks.add_task(cleanup_cache)
-        except Exception as e:
-            print(f"Warning: Could not cache video: {e}")
-
-        # Clean up user's uploaded file immediately (PRIVACY)
-        try:
-            if upload_path.exists():
-                upload_path.unlink()
-        except Exception:
-            pass
-
-        # Clean up all generated media files (PRIVACY) - more efficient batch delete
-        media_dir = BASE_DIR / "media"
-        if media_dir.exists():
-            try:
-                shutil.rmtree(media_dir)
-            except Exception:
-                pass
-
-        # Mark as complete
-        progress_tracking[task_id] = {"progress": 100, "status": "complete"}
+        result = await run_in_threadpool(render_job, task_id, job)
+        # Run cache cleanup in background (non-blocking)
+        background_tasks.add_task(cleanup_cache)
 
         return JSONResponse(
             {
                 "success": True,
                 "message": "Animation generated successfully",
-                "videoId": f"{timestamp}_{video_filename}",
-                "filename": video_filename,
+                "videoId": result["videoId"],
+                "filename": result["filename"],
                 "taskId": task_id,
+                "profileId": profile_id,
+                "downgraded": downgrades,
             }
         )
 
     except json.JSONDecodeError:
         raise HTTPException(status_code=400, detail="Invalid configuration JSON")
+    except HTTPException:
+        raise
     except subprocess.TimeoutExpired:
         if "task_id" in locals():
             progress_tracking[task_id] = {"progress": 0, "status": "timeout"}
@@ -468,44 +1190,592 @@ async def create_animation(
             raise HTTPException(status_code=500, detail=str(e))
 
 
+def run_manim(manim_cmd: list, config_json: str, env: dict, timeout: int):
+    # Use Popen with streaming to avoid buffering all output in memory
+    proc = subprocess.Popen(
+        manim_cmd,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,  # Discard stdout to save memory
+        stderr=subprocess.PIPE,
+        text=True,
+        env=env,
+    )
+    try:
+        _, stderr = proc.communicate(input=config_json, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.communicate()
+        raise
+    return proc.returncode, stderr
+
+
+def run_in_fork_server(job: dict, media_dir: Path):
+    # Render in a child forked from the warm server. Returns the child's
+    # render_batch_job result, or None when the server isn't up (still warming
+    # or died) so the caller falls back to a plain manim subprocess
+    if fork_server_proc is None or fork_server_proc.poll() is not None:
+        return None
+    batch_job = {
+        **json.loads(job["config_json"]),
+        "quality": job["quality"],
+        "output_name": job["output_name"],
+        "limits": RENDER_LIMITS,
+    }
+    if job.get("profile_dir"):
+        batch_job["profile_dir"] = str(job["profile_dir"])
+    media_dir.mkdir(parents=True, exist_ok=True)
+    request = {
+        "job": batch_job,
+        "output_dir": str(media_dir),
+        "work_dir": str(media_dir),
+    }
+
+    deadline = time.monotonic() + job["timeout"]
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(str(FORK_SERVER_SOCKET))
+        except (FileNotFoundError, ConnectionRefusedError):
+            return None
+        sock.sendall((json.dumps(request) + "\n").encode())
+        reader = sock.makefile("r")
+        hello = ""
+        try:
+            # Waiting for a free worker counts towards the timeout too
+            sock.settimeout(job["timeout"])
+            hello = reader.readline()
+            sock.settimeout(max(deadline - time.monotonic(), 0.1))
+            line = reader.readline() if hello else ""
+        except socket.timeout:
+            if hello:
+                try:
+                    # Child's own process group, takes its ffmpeg down too
+                    os.killpg(json.loads(hello)["pid"], signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+            raise subprocess.TimeoutExpired("fork server render", job["timeout"])
+    if not line:
+        # The child died mid-render, only this job is lost
+        return {"status": "error", "error": "Render process crashed"}
+    return json.loads(line)
+
+
+def render_job(task_id: str, job: dict) -> dict:
+    # Full-quality render of one job, blocking so run it off the event loop
+    media_dir = job["media_dir"]
+    QUEUE_WAIT_SECONDS.observe(time.monotonic() - job["queued_at"])
+    # CodeAnimation writes its phase timings here when it's done
+    metrics_path = media_dir / "render_metrics.json"
+    env = {**job["env"], "ANIM_METRICS_PATH": str(metrics_path)}
+    if job.get("profile_dir"):
+        env["ANIM_PROFILE_DIR"] = str(job["profile_dir"])
+
+    # Start progress monitoring in background thread
+    stop_event = threading.Event()
+    progress_thread = threading.Thread(
+        target=monitor_manim_progress, args=(task_id, media_dir, stop_event)
+    )
+    progress_thread.start()
+
+    manim_cmd = [
+        "nice",
+        "-n",
+        "10",  # Lower CPU priority so FastAPI stays responsive
+        *MANIM_CMD,
+        *job["quality_flags"],
+        "--frame_rate",
+        str(job["fps"]),
+        "--disable_caching",
+        "--flush_cache",
+        "--media_dir",
+        str(media_dir),
+        "-o",
+        job["output_name"],
+        str(ANIMATOR_SCRIPT),
+        "CodeAnimation",
+    ]
+
+    ACTIVE_RENDERS.inc()
+    started = time.monotonic()
+    try:
+        forked = run_in_fork_server(job, media_dir) if FORK_SERVER else None
+        if forked is None:
+            returncode, stderr = run_manim(
+                manim_cmd, job["config_json"], env, job["timeout"]
+            )
+        else:
+            returncode = 0 if forked["status"] == "ok" else 1
+            stderr = forked.get("error", "")
+            if forked["status"] == "limit":
+                stderr = LIMIT_PREFIX + stderr
+    except subprocess.TimeoutExpired:
+        TIMEOUTS.inc()
+        raise
+    finally:
+        ACTIVE_RENDERS.dec()
+        # monitoring
+        stop_event.set()
+        progress_thread.join(timeout=2)
+    RENDER_SECONDS.observe(time.monotonic() - started, quality=job["quality"])
+
+    if returncode != 0 and limit_error(stderr):
+        # The job's own limit, not a server problem
+        FAILURES.inc(stage="limit")
+        progress_tracking[task_id] = {"progress": 0, "status": "error"}
+        raise HTTPException(status_code=413, detail=limit_error(stderr))
+    if returncode != 0:
+        FAILURES.inc(stage="render")
+        print(f"Error running Manim: {stderr}")
+        progress_tracking[task_id] = {"progress": 0, "status": "error"}
+        if returncode < 0:
+            # Killed before it could say why, most likely the OOM killer
+            stderr = f"Render process was killed by signal {-returncode}\n{stderr}"
+        raise HTTPException(
+            status_code=500, detail=f"Animation generation failed: {stderr}"
+        )
+
+    # Update progress to 95% (video generated, now copying)
+    # Only update if not already at or past 95%
+    current_progress = progress_tracking.get(task_id, {}).get("progress", 0)
+    if current_progress < 95:
+        progress_tracking[task_id] = {"progress": 95, "status": "finalizing"}
+
+    # Find the generated video file
+    # Manim outputs to media/videos/CodeAnimator/{quality_dir}/ but dir name varies
+    video_filename = f"{job['output_name']}{job['video_extension']}"
+    videos_base = media_dir / "videos" / "CodeAnimator"
+
+    # Search for the video in any quality subdirectory
+    video_path = Path(forked["output"]) if forked else None
+    if video_path is None and videos_base.exists():
+        for quality_subdir in videos_base.iterdir():
+            if quality_subdir.is_dir():
+                candidate = quality_subdir / video_filename
+                if candidate.exists():
+                    video_path = candidate
+                    break
+
+    if video_path is None or not video_path.exists():
+        FAILURES.inc(stage="output")
+        raise HTTPException(
+            status_code=500, detail=f"Generated video not found in {videos_base}"
+        )
+
+    # Move video to outputs directory (media/ is wiped below anyway)
+    video_id = outputs.new_id(video_filename)
+    output_video_path = outputs.add(video_id, video_path, owner=task_id)
+    OUTPUT_BYTES.observe(output_video_path.stat().st_size)
+    if forked:
+        record_render_metrics(forked.get("metrics", {}))
+    else:
+        try:
+            with open(metrics_path, "r") as f:
+                record_render_metrics(json.load(f))
+        except (OSError, json.JSONDecodeError):
+            pass  # Older renderer or it couldn't write them, not worth failing
+
+    # Save to cache for future identical requests
+    try:
+        link_or_copy(output_video_path, job["cached_video"])
+    except Exception as e:
+        print(f"Warning: Could not cache video: {e}")
+
+    # Clean up user's uploaded file immediately (PRIVACY)
+    try:
+        if job["upload_path"].exists():
+            job["upload_path"].unlink()
+        if job.get("diff_path") and job["diff_path"].exists():
+            job["diff_path"].unlink()
+    except Exception:
+        pass
+
+    # Clean up all generated media files (PRIVACY) - more efficient batch delete
+    if media_dir.exists():
+        try:
+            shutil.rmtree(media_dir)
+        except Exception:
+            pass
+
+    # Mark as complete, preview clients pick the videoId up from here
+    result = {"videoId": video_id, "filename": video_filename}
+    progress_tracking[task_id] = {"progress": 100, "status": "complete", **result}
+    return result
+
+
+def render_job_in_background(task_id: str, job: dict):
+    # Thread target for preview mode, errors end up in progress_tracking
+    try:
+        render_job(task_id, job)
+        cleanup_cache()
+    except subprocess.TimeoutExpired:
+        progress_tracking[task_id] = {"progress": 0, "status": "timeout"}
+    except HTTPException as e:
+        progress_tracking[task_id] = {
+            "progress": 0,
+            "status": "error",
+            "detail": e.detail,
+        }
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        progress_tracking[task_id] = {
+            "progress": 0,
+            "status": "error",
+            "detail": str(e),
+        }
+    finally:
+        live_renders.pop(task_id, None)
+
+
+def render_preview(task_id: str, job: dict, plan: dict):
+    # The final frame as SVG straight from the render plan, no second Manim
+    # process next to the full render
+    preview_path = UPLOADS_DIR / f"{task_id}_preview.svg"
+    try:
+        preview_path.write_text(render_plan_svg(plan), encoding="utf-8")
+        preview_id = outputs.new_id(f"{job['output_name']}_preview.svg")
+        outputs.add(preview_id, preview_path, owner=task_id)
+        return preview_id
+    except OSError as e:
+        print(f"Warning: Could not save preview: {e}")
+        preview_path.unlink(missing_ok=True)
+        return None
+
+
+async def stream_batch_renders(jobs: list, batch_dir: Path):
+    # Render every job in one CodeAnimator.py --batch process, yielding
+    # manifest entries in the order the renders finish
+    jobs_path = batch_dir / "jobs.json"
+    jobs_path.write_text(json.dumps([job["batch_job"] for job in jobs]))
+    proc = await asyncio.create_subprocess_exec(
+        "nice",
+        "-n",
+        "10",
+        sys.executable,
+        str(ANIMATOR_SCRIPT),
+        "--batch",
+        str(jobs_path),
+        "--workers",
+        str(BATCH_WORKERS),
+        "--output",
+        str(batch_dir / "videos"),
+        "--manifest",
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+        env={**os.environ, "ANIM_SEGMENT_CACHE": str(SEGMENT_CACHE_DIR)},
+        # Own process group, so the batch workers go down with it
+        start_new_session=True,
+    )
+
+    for job in jobs:
+        QUEUE_WAIT_SECONDS.observe(time.monotonic() - job["queued_at"])
+    ACTIVE_RENDERS.inc()
+
+    # Items run in parallel, so the batch gets the sum of their timeouts
+    # spread over the workers
+    timeout = sum(job["timeout"] for job in jobs) / min(BATCH_WORKERS, len(jobs))
+    deadline = time.monotonic() + timeout
+    pending = set(range(len(jobs)))
+    try:
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                line = await asyncio.wait_for(proc.stdout.readline(), remaining)
+            except asyncio.TimeoutError:
+                break
+            if not line:
+                break
+            line = line.decode(errors="replace")
+            if not line.startswith(MANIFEST_PREFIX):
+                continue
+            result = json.loads(line[len(MANIFEST_PREFIX) :])
+            pending.discard(result["index"])
+            yield await run_in_threadpool(
+                finish_batch_item, jobs[result["index"]], result
+            )
+    finally:
+        ACTIVE_RENDERS.dec()
+        if proc.returncode is None:
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        await proc.wait()
+
+    # Whatever never reported back crashed or ran out of time
+    for job_index in sorted(pending):
+        TIMEOUTS.inc()
+        yield {
+            "index": jobs[job_index]["index"],
+            "success": False,
+            "error": "Animation generation timed out or crashed",
+        }
+
+
+def finish_batch_item(job: dict, result: dict) -> dict:
+    # Move one finished batch render into outputs and the cache
+    entry = {"index": job["index"], "seconds": round(result["seconds"], 2)}
+    RENDER_SECONDS.observe(result["seconds"], quality=job["batch_job"]["quality"])
+    if "profile_dir" in job["batch_job"]:
+        entry["profileId"] = Path(job["batch_job"]["profile_dir"]).name
+    if job["downgrades"]:
+        entry["downgraded"] = job["downgrades"]
+    if result["status"] != "ok":
+        FAILURES.inc(stage="limit" if result["status"] == "limit" else "render")
+        return {**entry, "success": False, "error": result.get("error")}
+
+    video_id = outputs.new_id(f"{job['index']}_{job['filename']}")
+    output_path = outputs.add(video_id, result["output"], owner=job["owner"])
+    OUTPUT_BYTES.observe(output_path.stat().st_size)
+    record_render_metrics(result.get("metrics", {}))
+    try:
+        link_or_copy(output_path, job["cached_video"])
+    except Exception as e:
+        print(f"Warning: Could not cache video: {e}")
+    return {
+        **entry,
+        "success": True,
+        "videoId": video_id,
+        "filename": job["filename"],
+        "cached": False,
+    }
+
+
+@app.post("/api/animate/batch")
+async def create_batch_animation(
+    background_tasks: BackgroundTasks,
+    files: list[UploadFile] = File(...),
+    configs: str = Form(...),
+    x_profile: str = Header(None),
+    x_admin_token: str = Header(None),
+):
+    # N files with N configs, or one file with N configs (line ranges).
+    # Streams an NDJSON manifest, one line per item as soon as it's done
+    try:
+        configs_data = json.loads(configs)
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid configuration JSON")
+    if not isinstance(configs_data, list) or not configs_data:
+        raise HTTPException(status_code=400, detail="configs must be a non-empty list")
+    if len(files) not in (1, len(configs_data)):
+        raise HTTPException(
+            status_code=400, detail="Send one file, or one file per config"
+        )
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    batch_id = f"batch-{timestamp}-{uuid.uuid4().hex[:8]}"
+    batch_dir = MEDIA_DIR / batch_id
+    (batch_dir / "uploads").mkdir(parents=True)
+
+    # Every upload is read and saved once, however many configs point at it
+    uploads = []
+    for file_index, file in enumerate(files):
+        content = await file.read()
+        upload_name = f"{file_index}_{Path(file.filename).name}"
+        upload_path = batch_dir / "uploads" / upload_name
+        async with aiofiles.open(upload_path, "wb") as f:
+            await f.write(content)
+        uploads.append((file, content, upload_path))
+
+    # Cache hits and invalid items are answered before anything renders
+    ready_entries = []
+    jobs = []
+    try:
+        for index, config_data in enumerate(configs_data):
+            file, content, upload_path = uploads[index if len(files) > 1 else 0]
+            # Each item is downloaded (and expired) on its own
+            item_owner = f"{batch_id}-{index}"
+            start_line = config_data["startLine"]
+            end_line = config_data["endLine"]
+            quality = config_data.get("quality", "standard")
+            if quality not in QUALITY_PRESETS:
+                quality = "standard"
+            count_request(quality, config_data.get("orientation", "landscape"))
+            encoder_profile = ENCODER_PROFILES.get(
+                config_data.get("encoderProfile", "default"),
+                ENCODER_PROFILES["default"],
+            )
+            video_extension = CONTAINER_EXTENSIONS[encoder_profile["container"]]
+            original_filename = Path(file.filename).stem
+            video_filename = (
+                f"{original_filename}_{start_line}-{end_line}{video_extension}"
+            )
+
+            needs_ffmpeg = encoder_profile is not ENCODER_PROFILES["default"]
+            timeout = TIMEOUT_BY_QUALITY.get(quality, 300)
+            try:
+                plan = await run_in_threadpool(
+                    build_request_plan, content, file.filename, config_data
+                )
+                quality, encoder_profile, downgrades = fit_render_limits(
+                    plan, quality, encoder_profile
+                )
+            except ValueError as e:
+                ready_entries.append(
+                    {"index": index, "success": False, "error": str(e)}
+                )
+                continue
+
+            cache_key = generate_cache_key(plan, quality, encoder_profile)
+            cached_video = CACHE_DIR / f"{cache_key}{video_extension}"
+            CACHE_LOOKUPS.inc(result="hit" if cached_video.exists() else "miss")
+            if cached_video.exists():
+                video_id = outputs.new_id(f"{index}_{video_filename}")
+                outputs.add(video_id, cached_video, owner=item_owner, link=True)
+                cached_video.touch()
+                ready_entries.append(
+                    {
+                        "index": index,
+                        "success": True,
+                        "videoId": video_id,
+                        "filename": video_filename,
+                        "cached": True,
+                    }
+                )
+                continue
+
+            batch_job = {
+                "script_path": str(upload_path),
+                "start_line": start_line,
+                "end_line": end_line,
+                "include_comments": config_data["includeComments"],
+                "syntax_colors": config_data.get("syntaxColors", {}),
+                "orientation": config_data.get("orientation", "landscape"),
+                "animation_timing": config_data.get("animationTiming", {}),
+                "line_groups": config_data["lineGroups"],
+                "encoder_profile": encoder_profile,
+                "segment_cache": bool(config_data.get("segmentCache")),
+                "quality": quality,
+                "output_name": f"{index}_{original_filename}_{start_line}-{end_line}",
+                "limits": RENDER_LIMITS,
+            }
+            if wants_profile(config_data, x_profile, x_admin_token):
+                batch_job["profile_dir"] = str(PROFILES_DIR / item_owner)
+            jobs.append(
+                {
+                    "index": index,
+                    "owner": item_owner,
+                    "filename": video_filename,
+                    "cached_video": cached_video,
+                    "timeout": timeout,
+                    "queued_at": time.monotonic(),
+                    "needs_ffmpeg": needs_ffmpeg,
+                    "downgrades": downgrades,
+                    # What CodeAnimator.py --batch reads from the job file
+                    "batch_job": batch_job,
+                }
+            )
+    except (KeyError, TypeError) as e:
+        shutil.rmtree(batch_dir, ignore_errors=True)
+        raise HTTPException(status_code=400, detail=f"Invalid batch config: {e}")
+    except HTTPException:
+        shutil.rmtree(batch_dir, ignore_errors=True)
+        raise
+
+    needs_ffmpeg = any(job["needs_ffmpeg"] for job in jobs)
+    if needs_ffmpeg and not shutil.which("ffmpeg"):
+        shutil.rmtree(batch_dir, ignore_errors=True)
+        raise HTTPException(
+            status_code=400, detail="This encoder profile requires ffmpeg"
+        )
+
+    async def manifest():
+        failed = 0
+        try:
+            for entry in ready_entries:
+                failed += not entry["success"]
+                yield json.dumps(entry) + "\n"
+            if jobs:
+                async for entry in stream_batch_renders(jobs, batch_dir):
+                    failed += not entry["success"]
+                    yield json.dumps(entry) + "\n"
+        finally:
+            # Uploads and intermediate media go away (PRIVACY)
+            shutil.rmtree(batch_dir, ignore_errors=True)
+        yield json.dumps(
+            {"done": True, "total": len(configs_data), "failed": failed}
+        ) + "\n"
+
+    background_tasks.add_task(cleanup_cache)
+    return StreamingResponse(manifest(), media_type="application/x-ndjson")
+
+
 @app.get("/api/stream/{video_id}")
 async def stream_video(video_id: str):
     # Stream the video for preview (no cleanup - file stays for download)
-    video_path = OUTPUTS_DIR / video_id
+    video_path = outputs.path(video_id)
 
-    if not video_path.exists():
+    if video_path is None or not video_path.exists():
         raise HTTPException(status_code=404, detail="Video not found")
 
     return FileResponse(
         path=video_path,
-        media_type="video/mp4",
+        media_type=MEDIA_TYPES.get(video_path.suffix, "video/mp4"),
     )
 
 
+def live_render_done(task_id: str) -> bool:
+    state = progress_tracking.get(task_id, {})
+    return "videoId" in state or state.get("status") in (None, "error", "timeout")
+
+
+async def open_live_part(job: dict):
+    # The .part movie ffmpeg is writing (fork-server renders are in a job-*
+    # dir one level down), or None if it hasn't started yet
+    name = f"{job['output_name']}.part"
+    media_dir = job["media_dir"]
+    for pattern in (f"videos/*/*/{name}", f"job-*/videos/*/*/{name}"):
+        for part_path in media_dir.glob(pattern):
+            try:
+                return await aiofiles.open(part_path, "rb")
+            except FileNotFoundError:
+                continue  # Renamed to the finished movie since the glob
+    return None
+
+
+@app.get("/api/live/{task_id}")
+async def live_video(task_id: str):
+    # Fragmented MP4 of a render started with "live": true, served while it's
+    # still being encoded so playback can start on the first fragments
+    if task_id not in progress_tracking:
+        raise HTTPException(status_code=404, detail="Render not found")
+
+    part_file = None
+    while task_id in live_renders and part_file is None:
+        part_file = await open_live_part(live_renders[task_id])
+        if part_file is None:
+            await asyncio.sleep(POLL_INTERVAL)  # Manim is still starting up
+    if part_file is not None:
+        return StreamingResponse(
+            follow_fragments(part_file, lambda: live_render_done(task_id)),
+            media_type="video/mp4",
+            headers={"Cache-Control": "no-store"},
+        )
+
+    # Finished before we got to it, that's just the video then
+    video_path = outputs.path(progress_tracking.get(task_id, {}).get("videoId", ""))
+    if video_path is None or not video_path.exists():
+        raise HTTPException(status_code=404, detail="Live render failed or expired")
+    return FileResponse(path=video_path, media_type="video/mp4")
+
+
 @app.get("/api/download/{video_id}")
 async def download_video(video_id: str, background_tasks: BackgroundTasks):
-    # Download the generated animation video and delete it after sending (PRIVACY)
-    video_path = OUTPUTS_DIR / video_id
+    # Download the generated animation video, it's deleted soon after (PRIVACY)
+    video_path = outputs.path(video_id)
 
-    if not video_path.exists():
+    if video_path is None or not video_path.exists():
         raise HTTPException(status_code=404, detail="Video not found")
 
-    # Delete ALL outputs after download completes (PRIVACY)
-    def cleanup_all_outputs():
-        try:
-            # Use glob for more efficient batch operations
-            for file in OUTPUTS_DIR.glob("*"):
-                if file.is_file():
-                    file.unlink()
-        except Exception as e:
-            print(f"Warning during cleanup: {e}")
-
-    background_tasks.add_task(cleanup_all_outputs)
+    # Only this job's video and preview, other users' files are left alone.
+    # The sweeper deletes them once the grace period is over
+    background_tasks.add_task(outputs.expire_owner, video_id, DOWNLOAD_GRACE)
 
     return FileResponse(
         path=video_path,
-        media_type="video/mp4",
-        filename=video_id.split("_", 1)[1],  # Remove timestamp prefix
+        media_type=MEDIA_TYPES.get(video_path.suffix, "video/mp4"),
+        filename=video_id.split("_", 1)[1],  # Remove the random id prefix
         headers={
             "Content-Disposition": f"attachment; filename={video_id.split('_', 1)[1]}"
         },
@@ -517,12 +1787,9 @@ async def delete_video(video_id: str):
     """
     Delete a generated video
     """
-    video_path = OUTPUTS_DIR / video_id
-
-    if not video_path.exists():
+    if not outputs.remove(video_id):
         raise HTTPException(status_code=404, detail="Video not found")
 
-    video_path.unlink()
     return {"success": True, "message": "Video deleted"}
 
 
@@ -0,0 +1,106 @@
+"""Counters, gauges and histograms in the Prometheus text format.
+
+Small enough that pulling in prometheus_client isn't worth it, everything
+lives in this process and is rendered on each /metrics scrape.
+"""
+
+import threading
+from bisect import bisect_left
+
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _labels(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(v)}"' for name, v in pairs) + "}"
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        with self.lock:
+            lines += self._samples()
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def _samples(self):
+        return [
+            f"{self.name}{self._labels(key)} {value}"
+            for key, value in sorted(self.values.items())
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=()):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            # One slot per bucket plus one for everything above the last
+            counts, total = self.values.get(key, (None, 0.0))
+            if counts is None:
+                counts = [0] * (len(self.buckets) + 1)
+            counts[bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + value)
+
+    def _samples(self):
+        lines = []
+        for key, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                bucket_labels = self._labels(key, [("le", bound)])
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            observed = sum(counts)
+            inf_labels = self._labels(key, [("le", "+Inf")])
+            lines.append(f"{self.name}_bucket{inf_labels} {observed}")
+            lines.append(f"{self.name}_sum{self._labels(key)} {total}")
+            lines.append(f"{self.name}_count{self._labels(key)} {observed}")
+        return lines
+
+
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
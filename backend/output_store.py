@@ -0,0 +1,151 @@
+"""Finished videos and previews waiting to be downloaded.
+
+Every file belongs to the job that made it (its owner) and has an expiry.
+Downloading a video only expires its own job's files, files nobody downloads
+expire on their own, and one sweeper thread does all the deleting a bounded
+number of files at a time.
+"""
+
+import heapq
+import os
+import secrets
+import shutil
+import threading
+import time
+from pathlib import Path
+
+from RenderPlan import link_or_copy
+
+
+class OutputStore:
+    def __init__(self, root, ttl, max_bytes, sweep_interval=30, sweep_batch=50):
+        self.root = Path(root)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self.sweep_batch = sweep_batch  # Most files deleted per sweep
+        self.lock = threading.Lock()
+        self.entries = {}  # id -> {"owner", "expires", "size"}
+        self.owners = {}  # owner -> ids
+        self.expiry = []  # (expires, id) heap, outdated items are skipped
+        self.total_bytes = 0
+        self._adopt_existing()
+
+    def _adopt_existing(self):
+        # Files left over from before a restart expire like anything else.
+        # Which job made them is lost, so each is its own owner: downloading
+        # one only expires that one
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                if entry.is_file():
+                    owner = f"adopted-{entry.name}"
+                    self._register(entry.name, owner, stat.st_size, stat.st_mtime)
+
+    def _register(self, artifact_id, owner, size, created):
+        expires = created + self.ttl
+        self.entries[artifact_id] = {"owner": owner, "expires": expires, "size": size}
+        self.owners.setdefault(owner, set()).add(artifact_id)
+        heapq.heappush(self.expiry, (expires, artifact_id))
+        self.total_bytes += size
+
+    def new_id(self, filename):
+        # Unguessable, having the id is all it takes to download the file.
+        # Everything after the first "_" is the download name
+        return f"{secrets.token_hex(8)}_{filename}"
+
+    def add(self, artifact_id, source, owner, link=False):
+        # Move source into the store, or hardlink it when it has to stay
+        # where it is too (cached videos)
+        path = self.root / artifact_id
+        if link:
+            link_or_copy(source, path)
+        else:
+            shutil.move(source, path)
+        size = path.stat().st_size
+        with self.lock:
+            self._register(artifact_id, owner, size, time.time())
+        return path
+
+    def path(self, artifact_id):
+        # Only ids the store handed out, so nothing outside root is reachable
+        with self.lock:
+            entry = self.entries.get(artifact_id)
+            if entry is None or entry["expires"] <= time.time():
+                return None
+        return self.root / artifact_id
+
+    def expire_owner(self, artifact_id, delay=0):
+        # Expire everything from the same job as artifact_id (the video and
+        # its preview still), after delay so a retried download still works
+        expires = time.time() + delay
+        with self.lock:
+            entry = self.entries.get(artifact_id)
+            if entry is None:
+                return
+            for other_id in self.owners.get(entry["owner"], ()):
+                other = self.entries[other_id]
+                if other["expires"] > expires:
+                    other["expires"] = expires
+                    heapq.heappush(self.expiry, (expires, other_id))
+
+    def remove(self, artifact_id):
+        with self.lock:
+            if not self._forget(artifact_id):
+                return False
+        self._unlink(artifact_id)
+        return True
+
+    def _forget(self, artifact_id):
+        entry = self.entries.pop(artifact_id, None)
+        if entry is None:
+            return False
+        owned = self.owners.get(entry["owner"])
+        owned.discard(artifact_id)
+        if not owned:
+            del self.owners[entry["owner"]]
+        self.total_bytes -= entry["size"]
+        return True
+
+    def _unlink(self, artifact_id):
+        try:
+            (self.root / artifact_id).unlink()
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Warning: Could not delete output {artifact_id}: {e}")
+
+    def sweep(self):
+        # Expired files first, then the soonest to expire while over budget.
+        # At most sweep_batch deletes per call so a backlog can't stall disk
+        now = time.time()
+        doomed = []
+        with self.lock:
+            while self.expiry and len(doomed) < self.sweep_batch:
+                expires, artifact_id = self.expiry[0]
+                entry = self.entries.get(artifact_id)
+                if entry is None or entry["expires"] != expires:
+                    heapq.heappop(self.expiry)  # Removed or expiry moved up
+                    continue
+                if expires > now and self.total_bytes <= self.max_bytes:
+                    break
+                heapq.heappop(self.expiry)
+                self._forget(artifact_id)
+                doomed.append(artifact_id)
+        for artifact_id in doomed:
+            self._unlink(artifact_id)
+        return len(doomed)
+
+    def start(self):
+        def run():
+            while True:
+                time.sleep(self.sweep_interval)
+                try:
+                    self.sweep()
+                except Exception as e:
+                    print(f"Warning: Output sweep failed: {e}")
+
+        threading.Thread(target=run, name="output-sweeper", daemon=True).start()
@@ -0,0 +1,63 @@
+"""Stand-in for the `manim` command, for load testing the backend.
+
+Takes the same arguments main.py passes to manim and writes files where
+Manim would, but only sleeps instead of rendering. Tune it with env vars:
+
+    STUB_LATENCY        seconds per full render (default 2)
+    STUB_JITTER         +/- fraction of that, uniformly random (default 0.2)
+    STUB_OUTPUT_BYTES   size of the video it writes (default 2 MB)
+
+Use it with MANIM_BIN="python stub_manim.py", loadtest.py does that for you.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+EXTENSIONS = {"mp4": ".mp4", "webm": ".webm", "gif": ".gif", "apng": ".png"}
+QUALITY_DIRS = {"-ql": "480p60", "-qm": "720p60", "-qh": "1080p60"}
+WRITE_CHUNKS = 20  # The .part grows in steps like a real encode
+
+
+def latency(name, default):
+    base = float(os.environ.get(name, default))
+    jitter = float(os.environ.get("STUB_JITTER", 0.2))
+    return max(0.0, base * random.uniform(1 - jitter, 1 + jitter))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="stub_manim.py")
+    parser.add_argument("-o", dest="output_name", required=True)
+    parser.add_argument("--media_dir", required=True)
+    parser.add_argument("-r", dest="resolution")
+    args, rest = parser.parse_known_args(argv)
+    # CodeAnimation reads its config from stdin, so read it all the same
+    config = json.loads(sys.stdin.read() or "{}")
+
+    quality_dir = next(
+        (QUALITY_DIRS[flag] for flag in rest if flag in QUALITY_DIRS),
+        args.resolution.replace(",", "x") if args.resolution else "720p60",
+    )
+    video_dir = os.path.join(args.media_dir, "videos", "CodeAnimator", quality_dir)
+    os.makedirs(video_dir, exist_ok=True)
+    container = (config.get("encoder_profile") or {}).get("container", "mp4")
+    movie_path = os.path.join(video_dir, args.output_name + EXTENSIONS[container])
+
+    total = int(os.environ.get("STUB_OUTPUT_BYTES", 2 * 1024 * 1024))
+    step = latency("STUB_LATENCY", 2) / WRITE_CHUNKS
+    chunk = os.urandom(max(total // WRITE_CHUNKS, 1))
+    with open(movie_path + ".part", "wb") as f:
+        written = 0
+        for _ in range(WRITE_CHUNKS):
+            time.sleep(step)
+            f.write(chunk[: total - written])
+            written = min(total, written + len(chunk))
+    os.replace(movie_path + ".part", movie_path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
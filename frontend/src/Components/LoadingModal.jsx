@@ -1,6 +1,12 @@
 import { motion, AnimatePresence } from "framer-motion";
 
-function LoadingModal({ isLoading, loadingProgress, loadingStatus }) {
+function LoadingModal({
+  isLoading,
+  loadingProgress,
+  loadingStatus,
+  previewUrl,
+  liveUrl,
+}) {
   return (
     <AnimatePresence>
       {isLoading && (
@@ -22,9 +28,27 @@ function LoadingModal({ isLoading, loadingProgress, loadingStatus }) {
               <span className="loading-title">Code Animator</span>
             </div>
             <div className="loading-body">
-              <div className="loading-icon">
-                <img src="/Movie.png" alt="" className="icon-sprite" />
-              </div>
+              {liveUrl ? (
+                // Plays the fragments that are encoded so far
+                <video
+                  src={liveUrl}
+                  poster={previewUrl || undefined}
+                  className="loading-preview"
+                  autoPlay
+                  muted
+                  playsInline
+                />
+              ) : previewUrl ? (
+                <img
+                  src={previewUrl}
+                  alt="Preview of the final frame"
+                  className="loading-preview"
+                />
+              ) : (
+                <div className="loading-icon">
+                  <img src="/Movie.png" alt="" className="icon-sprite" />
+                </div>
+              )}
               <h3 className="loading-text">Generating Animation...</h3>
               <p className="loading-subtext">
                 Please wait while we render your code animation
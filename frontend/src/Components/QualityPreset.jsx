@@ -1,6 +1,11 @@
 import { motion } from "framer-motion";
 
-function QualityPreset({ quality, onQualityChange }) {
+function QualityPreset({
+  quality,
+  onQualityChange,
+  watchLive,
+  onWatchLiveChange,
+}) {
   return (
     <motion.div
       className="form-section"
@@ -39,6 +44,14 @@ function QualityPreset({ quality, onQualityChange }) {
           <span className="quality-size">1080p @ 60fps</span>
         </button>
       </div>
+      <label className="checkbox-label">
+        <input
+          type="checkbox"
+          checked={watchLive}
+          onChange={(e) => onWatchLiveChange(e.target.checked)}
+        />
+        <span>Watch the video while it renders (renders a little slower)</span>
+      </label>
     </motion.div>
   );
 }
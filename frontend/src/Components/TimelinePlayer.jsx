@@ -0,0 +1,70 @@
+import { useEffect, useRef, useState } from "react";
+import { timelineDuration, timelineStateAt } from "../utils/functions";
+
+// Plays a timeline bundle from /api/animate ("outputFormat": "timeline") in
+// the browser: the bundle's SVG already has every line laid out, each frame
+// only moves and fades its <g id="line-N"> groups. Loops like the video does,
+// a click pauses on the final frame
+function TimelinePlayer({ bundle }) {
+  const containerRef = useRef(null);
+  const [paused, setPaused] = useState(false);
+
+  useEffect(() => {
+    const container = containerRef.current;
+    if (!container || !bundle) return;
+
+    const groups = bundle.lines.map((_, idx) =>
+      container.querySelector(`#line-${idx}`),
+    );
+    const duration = timelineDuration(bundle.timeline);
+    let frameId = null;
+    let startedAt = null;
+
+    const draw = (time) => {
+      const state = timelineStateAt(bundle, time);
+      groups.forEach((group, idx) => {
+        if (!group) return;
+        const line = state.get(idx);
+        if (!line) {
+          group.setAttribute("visibility", "hidden");
+          return;
+        }
+        // SVG y grows downwards, Manim's grows upwards
+        group.setAttribute("transform", `translate(${line.x} ${-line.y})`);
+        group.setAttribute("opacity", line.opacity);
+        group.removeAttribute("visibility");
+      });
+    };
+
+    const tick = (now) => {
+      if (startedAt === null) startedAt = now;
+      const elapsed = (now - startedAt) / 1000;
+      draw(duration > 0 ? elapsed % duration : 0);
+      frameId = requestAnimationFrame(tick);
+    };
+
+    if (paused) {
+      draw(duration); // The final frame, like the preview still
+    } else {
+      frameId = requestAnimationFrame(tick);
+    }
+    return () => {
+      if (frameId !== null) cancelAnimationFrame(frameId);
+    };
+  }, [bundle, paused]);
+
+  if (!bundle) return null;
+
+  return (
+    <div
+      ref={containerRef}
+      className="timeline-player"
+      onClick={() => setPaused((value) => !value)}
+      title={paused ? "Play" : "Pause"}
+      // Built by the backend from the plan, every text and color is escaped
+      dangerouslySetInnerHTML={{ __html: bundle.svg }}
+    />
+  );
+}
+
+export default TimelinePlayer;
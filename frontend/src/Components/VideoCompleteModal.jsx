@@ -1,8 +1,10 @@
 import { motion, AnimatePresence } from "framer-motion";
+import TimelinePlayer from "./TimelinePlayer";
 
 function VideoCompleteModal({
   show,
   completedVideoUrl,
+  timelineBundle,
   onClose,
   onDownload,
   onUploadNew,
@@ -26,10 +28,12 @@ function VideoCompleteModal({
             onClick={(e) => e.stopPropagation()}
           >
             <div className="upload-another-header">
-              <span className="upload-another-title">Video Complete!</span>
+              <span className="upload-another-title">
+                {completedVideoUrl ? "Video Complete!" : "Animation Ready!"}
+              </span>
             </div>
             <div className="upload-another-body">
-              {completedVideoUrl && (
+              {completedVideoUrl ? (
                 <div className="video-preview-container">
                   <video
                     src={completedVideoUrl}
@@ -39,6 +43,13 @@ function VideoCompleteModal({
                     className="video-preview"
                   />
                 </div>
+              ) : (
+                timelineBundle && (
+                  // Played in the browser, the MP4 only renders on download
+                  <div className="video-preview-container">
+                    <TimelinePlayer bundle={timelineBundle} />
+                  </div>
+                )
               )}
               <div className="upload-another-buttons">
                 <button type="button" className="btn-cancel" onClick={onClose}>
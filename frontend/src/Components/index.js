@@ -14,3 +14,4 @@ export { default as ColorModal } from "./ColorModal";
 export { default as PreviewModal } from "./PreviewModal";
 export { default as VideoCompleteModal } from "./VideoCompleteModal";
 export { default as SubmitSection } from "./SubmitSection";
+export { default as TimelinePlayer } from "./TimelinePlayer";
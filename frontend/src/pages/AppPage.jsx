@@ -18,6 +18,7 @@ import {
   buildTimingConfig,
   buildLineGroupsForApi,
   calculateLineGroupMap,
+  lookupCachedAnimation,
 } from "../utils/functions";
 
 // Components
@@ -58,6 +59,7 @@ function AppPage() {
   });
   const [orientation, setOrientation] = useState("landscape");
   const [quality, setQuality] = useState("standard");
+  const [watchLive, setWatchLive] = useState(false);
   const [animationTiming, setAnimationTiming] = useState({
     ...DEFAULT_TIMING_STR,
   });
@@ -71,6 +73,8 @@ function AppPage() {
   const [isLoading, setIsLoading] = useState(false);
   const [loadingProgress, setLoadingProgress] = useState(0);
   const [loadingStatus, setLoadingStatus] = useState("starting");
+  const [previewUrl, setPreviewUrl] = useState(null);
+  const [liveUrl, setLiveUrl] = useState(null);
 
   // Modal state
   const [showSplitModal, setShowSplitModal] = useState(false);
@@ -82,6 +86,7 @@ function AppPage() {
   // Video state
   const [completedVideoUrl, setCompletedVideoUrl] = useState(null);
   const [completedVideoFilename, setCompletedVideoFilename] = useState("");
+  const [timelineBundle, setTimelineBundle] = useState(null);
 
   // API state
   const [apiStatus, setApiStatus] = useState("awake");
@@ -239,30 +244,50 @@ function AppPage() {
     setShowUploadAnotherModal(false);
     setCompletedVideoUrl(null);
     setCompletedVideoFilename("");
+    setTimelineBundle(null);
     setQuality("standard");
+    setWatchLive(false);
     window._videoDownloadUrl = null;
   };
 
   // Video handlers
-  const handleDownloadVideo = () => {
-    const downloadUrl = window._videoDownloadUrl;
-    if (downloadUrl) {
-      const a = document.createElement("a");
-      a.href = downloadUrl;
-      a.download = completedVideoFilename;
-      document.body.appendChild(a);
-      a.click();
-      document.body.removeChild(a);
+  const handleDownloadVideo = async () => {
+    let downloadUrl = window._videoDownloadUrl;
+    let filename = completedVideoFilename;
+    if (!downloadUrl) {
+      // The MP4 only renders once someone wants to download it
+      const video = await renderVideo();
+      if (!video) return;
+      ({ downloadUrl, filename } = video);
     }
+    const a = document.createElement("a");
+    a.href = downloadUrl;
+    a.download = filename;
+    document.body.appendChild(a);
+    a.click();
+    document.body.removeChild(a);
   };
 
   const handleCloseVideoModal = () => {
     setShowUploadAnotherModal(false);
     setCompletedVideoUrl(null);
     setCompletedVideoFilename("");
+    setTimelineBundle(null);
     window._videoDownloadUrl = null;
   };
 
+  const buildConfig = () => ({
+    scriptPath: fileName,
+    startLine,
+    endLine,
+    includeComments,
+    orientation,
+    quality,
+    lineGroups: buildLineGroupsForApi(lineGroups),
+    syntaxColors,
+    animationTiming: buildTimingConfig(animationTiming),
+  });
+
   // Form submit handler
   const handleSubmit = async (e) => {
     e.preventDefault();
@@ -277,18 +302,44 @@ function AppPage() {
       return;
     }
 
-    const timingConfig = buildTimingConfig(animationTiming);
+    // Lines, colors and timeline only, the browser plays them. Comes back
+    // in milliseconds, nothing renders on the server
+    const formData = new FormData();
+    formData.append("file", file);
+    formData.append(
+      "config",
+      JSON.stringify({ ...buildConfig(), outputFormat: "timeline" }),
+    );
+
+    try {
+      const response = await fetch(`${API_URL}/api/animate`, {
+        method: "POST",
+        body: formData,
+      });
+      const result = await response.json();
+
+      if (!response.ok) {
+        throw new Error(result.detail || "Failed to generate animation");
+      }
+
+      setCompletedVideoUrl(null);
+      setCompletedVideoFilename("");
+      window._videoDownloadUrl = null;
+      setTimelineBundle(result);
+      setShowUploadAnotherModal(true);
+    } catch (error) {
+      console.error("Error:", error);
+      alert(`Error: ${error.message}`);
+    }
+  };
 
+  // Renders the MP4 of the current settings, returns its download url and
+  // filename (null if it failed)
+  const renderVideo = async () => {
     const config = {
-      scriptPath: fileName,
-      startLine,
-      endLine,
-      includeComments,
-      orientation,
-      quality,
-      lineGroups: buildLineGroupsForApi(lineGroups),
-      syntaxColors,
-      animationTiming: timingConfig,
+      ...buildConfig(),
+      preview: true, // Get the final frame back right away, video renders after
+      live: watchLive, // Start playing while it encodes, opt-in
     };
 
     const formData = new FormData();
@@ -296,22 +347,35 @@ function AppPage() {
     formData.append("config", JSON.stringify(config));
 
     try {
+      setShowUploadAnotherModal(false);
       setIsLoading(true);
       setLoadingProgress(0);
       setLoadingStatus("starting");
 
-      const response = await fetch(`${API_URL}/api/animate`, {
-        method: "POST",
-        body: formData,
-      });
+      // Same file and settings rendered before? Then skip the upload
+      let result = await lookupCachedAnimation(file, config);
+      if (!result) {
+        const response = await fetch(`${API_URL}/api/animate`, {
+          method: "POST",
+          body: formData,
+        });
 
-      const result = await response.json();
+        result = await response.json();
 
-      if (!response.ok) {
-        throw new Error(result.detail || "Failed to generate animation");
+        if (!response.ok) {
+          throw new Error(result.detail || "Failed to generate animation");
+        }
+      }
+
+      if (result.previewId) {
+        setPreviewUrl(`${API_URL}/api/stream/${result.previewId}`);
+      }
+      if (result.liveUrl) {
+        setLiveUrl(`${API_URL}${result.liveUrl}`);
       }
 
       const taskId = result.taskId;
+      let finalResult = result;
       const progressInterval = setInterval(async () => {
         try {
           const progressResponse = await fetch(
@@ -334,7 +398,7 @@ function AppPage() {
         }
       }, 500);
 
-      await new Promise((resolve) => {
+      await new Promise((resolve, reject) => {
         const checkComplete = setInterval(async () => {
           try {
             const progressResponse = await fetch(
@@ -349,7 +413,20 @@ function AppPage() {
                 clearInterval(checkComplete);
                 clearInterval(progressInterval);
                 setLoadingProgress(100);
+                // Preview responses only know the videoId once rendering is done
+                if (progressData.videoId) finalResult = progressData;
                 resolve();
+              } else if (
+                progressData.status === "error" ||
+                progressData.status === "timeout"
+              ) {
+                clearInterval(checkComplete);
+                clearInterval(progressInterval);
+                reject(
+                  new Error(
+                    progressData.detail || "Failed to generate animation",
+                  ),
+                );
               }
             }
           } catch (err) {
@@ -360,20 +437,27 @@ function AppPage() {
 
       await new Promise((resolve) => setTimeout(resolve, 500));
 
-      const streamUrl = `${API_URL}/api/stream/${result.videoId}`;
-      const downloadUrl = `${API_URL}/api/download/${result.videoId}`;
+      const streamUrl = `${API_URL}/api/stream/${finalResult.videoId}`;
+      const downloadUrl = `${API_URL}/api/download/${finalResult.videoId}`;
       setCompletedVideoUrl(streamUrl);
-      setCompletedVideoFilename(result.filename);
+      setCompletedVideoFilename(finalResult.filename);
       window._videoDownloadUrl = downloadUrl;
 
       setIsLoading(false);
       setLoadingProgress(0);
+      setPreviewUrl(null);
+      setLiveUrl(null);
       setShowUploadAnotherModal(true);
+      return { downloadUrl, filename: finalResult.filename };
     } catch (error) {
       console.error("Error:", error);
       alert(`Error: ${error.message}`);
       setIsLoading(false);
       setLoadingProgress(0);
+      setPreviewUrl(null);
+      setLiveUrl(null);
+      setShowUploadAnotherModal(true); // Back to the player, can try again
+      return null;
     }
   };
 
@@ -461,6 +545,8 @@ function AppPage() {
                   <QualityPreset
                     quality={quality}
                     onQualityChange={setQuality}
+                    watchLive={watchLive}
+                    onWatchLiveChange={setWatchLive}
                   />
 
                   <TimingSettings
@@ -504,6 +590,8 @@ function AppPage() {
           isLoading={isLoading}
           loadingProgress={loadingProgress}
           loadingStatus={loadingStatus}
+          previewUrl={previewUrl}
+          liveUrl={liveUrl}
         />
 
         <SplitModal
@@ -536,6 +624,7 @@ function AppPage() {
         <VideoCompleteModal
           show={showUploadAnotherModal}
           completedVideoUrl={completedVideoUrl}
+          timelineBundle={timelineBundle}
           onClose={handleCloseVideoModal}
           onDownload={handleDownloadVideo}
           onUploadNew={resetForNewFile}
@@ -134,3 +134,106 @@ export const calculateLineGroupMap = (lineGroups, startLine, endLine) => {
 
   return map;
 };
+
+// SHA-256 of the file as hex, null where WebCrypto isn't available (plain http)
+export const hashFile = async (file) => {
+  if (!window.crypto?.subtle) return null;
+  const digest = await window.crypto.subtle.digest(
+    "SHA-256",
+    await file.arrayBuffer(),
+  );
+  return Array.from(new Uint8Array(digest))
+    .map((byte) => byte.toString(16).padStart(2, "0"))
+    .join("");
+};
+
+// Ask for a cached video by file hash before uploading the file itself.
+// Returns the same result as /api/animate on a hit, null on a miss
+export const lookupCachedAnimation = async (file, config) => {
+  try {
+    const contentHash = await hashFile(file);
+    if (!contentHash) return null;
+
+    const formData = new FormData();
+    formData.append("contentHash", contentHash);
+    formData.append("filename", file.name);
+    formData.append("config", JSON.stringify(config));
+    const response = await fetch(`${API_URL}/api/animate/lookup`, {
+      method: "POST",
+      body: formData,
+    });
+    if (!response.ok) return null;
+
+    const result = await response.json();
+    return result.cached ? result : null;
+  } catch (err) {
+    console.error("Cache lookup error:", err);
+    return null; // Just upload as usual
+  }
+};
+
+// Manim's default rate function (smooth), so the player eases like the video
+const smooth = (t) => {
+  const sigmoid = (x) => 1 / (1 + Math.exp(-x));
+  const error = sigmoid(-5);
+  const value = (sigmoid(10 * (t - 0.5)) - error) / (1 - 2 * error);
+  return Math.min(Math.max(value, 0), 1);
+};
+
+// Length of a timeline bundle's animation in seconds
+export const timelineDuration = (timeline) =>
+  timeline.reduce((total, event) => total + (event.duration || 0), 0);
+
+// Where every line of a timeline bundle is `time` seconds in: a Map of line
+// index -> { x, y, opacity }, lines not on screen are left out. x is the
+// offset from the line's final spot, y is in Manim units (up is positive)
+export const timelineStateAt = (bundle, time) => {
+  // Lines wait off screen to the left before sliding in
+  const parkOffset = bundle.frame.width + 2;
+  const lines = new Map();
+  let start = 0;
+
+  for (const event of bundle.timeline) {
+    const duration = event.duration || 0;
+    if (time < start) break;
+    const alpha =
+      duration > 0 ? smooth(Math.min((time - start) / duration, 1)) : 1;
+    const done = time >= start + duration;
+
+    if (event.type === "slide_in") {
+      event.lines.forEach((idx, i) => {
+        lines.set(idx, {
+          x: -parkOffset * (1 - alpha),
+          y: event.y[i],
+          opacity: 1,
+        });
+      });
+    } else if (event.type === "scroll") {
+      event.lines.forEach((idx) => {
+        const line = lines.get(idx);
+        if (!line) return;
+        if (done) lines.delete(idx);
+        else lines.set(idx, { ...line, y: line.y + event.distance * alpha });
+      });
+    } else if (event.type === "fade_out") {
+      event.lines.forEach((idx) => {
+        const line = lines.get(idx);
+        if (!line) return;
+        if (done) lines.delete(idx);
+        else lines.set(idx, { ...line, opacity: 1 - alpha });
+      });
+    } else if (event.type === "move") {
+      event.lines.forEach((idx, i) => {
+        const line = lines.get(idx);
+        if (!line) return;
+        lines.set(idx, { ...line, y: line.y + (event.y[i] - line.y) * alpha });
+      });
+    } else if (event.type === "fade_in") {
+      event.lines.forEach((idx, i) => {
+        lines.set(idx, { x: 0, y: event.y[i], opacity: alpha });
+      });
+    }
+    start += duration;
+  }
+  return lines;
+};
@@ -0,0 +1,31 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# CodeAnimator.py and RenderPlan.py live at the repo root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--update-goldens",
+        action="store_true",
+        help="Write the rendered frame hashes as the new goldens instead of comparing",
+    )
+    parser.addoption(
+        "--golden-baseline",
+        metavar="CHECKOUT",
+        help="With --update-goldens, render the goldens with the CodeAnimator.py "
+        "in this checkout (the pre-speedup renderer) instead of the current one",
+    )
+
+
+@pytest.fixture
+def update_goldens(request):
+    return request.config.getoption("--update-goldens")
+
+
+@pytest.fixture
+def golden_baseline(request):
+    return request.config.getoption("--golden-baseline")
@@ -0,0 +1,336 @@
+"""Golden-frame tests for CodeAnimation.
+
+Every case renders at a low resolution through the real scene (Text,
+layout_lines, the timeline loop) into an in-memory file writer, then compares
+the total frame count and perceptual hashes of sampled frames plus the final
+frame against tests/goldens/. Speed work on construct should leave all of
+them passing; a real visual change means regenerating them:
+
+    python -m pytest tests --update-goldens
+
+The goldens come from the renderer before the speed work, so they say what
+the video looked like, not what the current code happens to draw. Point
+--golden-baseline at a checkout of it, the commit before the first
+[user-026] one:
+
+    first=$(git log --reverse --format=%H --grep=user-026 | head -1)
+    git worktree add ../codeanimator-baseline "$first~"
+    python -m pytest tests --update-goldens --golden-baseline ../codeanimator-baseline
+
+Diff mode has no baseline counterpart, example_diff is always rendered by the
+current code. Both renderers draw with the DejaVu Sans Mono in tests/fonts/
+instead of the platform font, so the same goldens hold on macOS and Linux. A
+missing golden skips locally and fails when CI is set. Needs Manim.
+"""
+
+import importlib.util
+import json
+import os
+from bisect import bisect_right
+from functools import cache
+from itertools import accumulate
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+pytest.importorskip("manim")
+
+from manim import register_font, tempconfig  # noqa: E402
+from manim.renderer.cairo_renderer import CairoRenderer  # noqa: E402
+from manim.scene.scene_file_writer import SceneFileWriter  # noqa: E402
+from PIL import Image  # noqa: E402
+
+import CodeAnimator  # noqa: E402
+from RenderPlan import (  # noqa: E402
+    FRAME_SIZES,
+    SourceIndex,
+    build_render_plan,
+    parse_line_groups,
+)
+
+TESTS_DIR = Path(__file__).resolve().parent
+SCRIPTS_DIR = TESTS_DIR.parent / "TestingScripts"
+GOLDENS_DIR = TESTS_DIR / "goldens"
+# Bundled (see its LICENSE next to it), a platform font would need goldens
+# per platform
+GOLDEN_FONT = "DejaVu Sans Mono"
+GOLDEN_FONT_FILE = TESTS_DIR / "fonts" / "DejaVuSansMono.ttf"
+
+PIXELS = {"landscape": (384, 216), "portrait": (216, 384)}
+FRAME_RATE = 15
+SAMPLES = 12  # Evenly spaced frames per case, plus the final frame
+HASH_SIZE = 16  # dHash grid, 256 bits
+MAX_HASH_DISTANCE = 12  # Bits, leaves room for antialiasing noise
+MAX_COLOR_DIFF = 8  # Per channel of the 4x4 color thumbnail, out of 255
+
+# Short holds keep the frame counts (and the test) small
+TIMING = {
+    "initialDelay": 0.2,
+    "lineSlideIn": 0.2,
+    "pauseBetweenGroups": 0.1,
+    "finalPause": 0.3,
+}
+
+SYNTHETIC_SOURCES = {
+    # More lines than fit on screen, so it scrolls in chunks
+    "long_file.py": "".join(
+        f"value_{i} = {i} * {i}  # square of {i}\n"
+        if i % 5
+        else f"# Section {i // 5}\n"
+        for i in range(1, 121)
+    ),
+    # Wider than the frame, everything gets scaled down
+    "wide_lines.py": (
+        "def wide():\n"
+        + "".join(
+            f"    total_{i} = "
+            + " + ".join(f"argument_{j}" for j in range(12))
+            + "\n"
+            for i in range(4)
+        )
+        + "\treturn total_0  # tab indented\n"
+    ),
+    # example.py after an edit, for the diff case
+    "example_after.py": (SCRIPTS_DIR / "example.py")
+    .read_text()
+    .replace("    b = 7\n", "    b = 8\n    # d is new\n    d = b * 2\n")
+    .replace('    print("Check it out now!")\n', ""),
+}
+
+CASES = {
+    "example_groups": {
+        "script": "example.py",
+        "lines": (1, 12),
+        "groups": ["1 2 3 4 5", "7 8", "ALL_REMAINING"],
+    },
+    "example_portrait": {
+        "script": "example.py",
+        "lines": (1, 12),
+        "groups": ["ALL_REMAINING"],
+        "orientation": "portrait",
+    },
+    "cpp_split": {
+        "script": "notFibonacci.cpp",
+        "lines": (1, 26),
+        "groups": ["1 2 3", "SPLIT 12", "ALL_REMAINING"],
+    },
+    "cpp_chunked": {
+        "script": "arrayInfo.cpp",
+        "lines": (1, 73),
+        "groups": ["ALL_REMAINING"],
+        "chunked": True,
+    },
+    "gdscript_fixups": {
+        "script": "testcamera.gd",
+        "lines": (1, 40),
+        "groups": ["1 2 3 4", "ALL_REMAINING"],
+        "chunked": True,
+    },
+    "synthetic_chunked_no_comments": {
+        "script": "long_file.py",
+        "lines": (1, 120),
+        "groups": ["1 2 3 4", "SPLIT 50", "ALL_REMAINING"],
+        "include_comments": False,
+        "chunked": True,
+    },
+    "synthetic_wide_lines": {
+        "script": "wide_lines.py",
+        "lines": (1, 6),
+        "groups": ["ALL_REMAINING"],
+    },
+    "example_diff": {
+        "script": "example.py",
+        "lines": (1, 12),
+        "groups": ["ALL_REMAINING"],
+        "diff_script": "example_after.py",
+    },
+}
+
+
+class FrameRecorder(SceneFileWriter):
+    """Keeps every frame in memory instead of encoding a movie."""
+
+    def __init__(self, renderer, scene_name, **kwargs):
+        self.frames = []  # (frame, times it's shown)
+        super().__init__(renderer, scene_name, **kwargs)
+
+    def begin_animation(self, allow_write=False, file_path=None):
+        pass
+
+    def end_animation(self, allow_write=False):
+        pass
+
+    def write_frame(self, frame_or_renderer, num_frames=1):
+        self.frames.append((np.array(frame_or_renderer), num_frames))
+
+    def combine_to_movie(self):
+        pass
+
+
+def script_path(name, tmp_path):
+    if name in SYNTHETIC_SOURCES:
+        path = tmp_path / name
+        path.write_text(SYNTHETIC_SOURCES[name])
+        return path
+    return SCRIPTS_DIR / name
+
+
+def case_config(case, tmp_path):
+    start_line, end_line = case["lines"]
+    anim_config = {
+        "script_path": str(script_path(case["script"], tmp_path)),
+        "start_line": start_line,
+        "end_line": end_line,
+        "include_comments": case.get("include_comments", True),
+        "syntax_colors": {},
+        "orientation": case.get("orientation", "landscape"),
+        "animation_timing": TIMING,
+        "line_groups": parse_line_groups(case["groups"]),
+    }
+    if case.get("diff_script"):
+        anim_config["diff_script_path"] = str(
+            script_path(case["diff_script"], tmp_path)
+        )
+    return anim_config
+
+
+@cache
+def load_baseline(checkout):
+    path = Path(checkout) / "CodeAnimator.py"
+    spec = importlib.util.spec_from_file_location("baseline_CodeAnimator", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def baseline_scene_class(animator, anim_config, groups):
+    # The baseline reads its config from stdin or /tmp/anim_config.txt, hand
+    # it over directly instead, line groups in their unparsed form
+    class BaselineAnimation(animator.CodeAnimation):
+        def _load_config(self):
+            return dict(anim_config, line_groups=self._parse_line_groups(groups))
+
+    BaselineAnimation.__name__ = "CodeAnimation"
+    return BaselineAnimation
+
+
+def render_case(anim_config, tmp_path, monkeypatch, baseline=None, groups=None):
+    # Loaded before tempconfig, the baseline sets the frame size on import
+    animator = load_baseline(baseline) if baseline else CodeAnimator
+    monkeypatch.setattr(animator, "MONOSPACE_FONT", GOLDEN_FONT)
+    orientation = anim_config["orientation"]
+    frame_width, frame_height = FRAME_SIZES[orientation]
+    pixel_width, pixel_height = PIXELS[orientation]
+    with register_font(GOLDEN_FONT_FILE), tempconfig(
+        {
+            "frame_width": frame_width,
+            "frame_height": frame_height,
+            "pixel_width": pixel_width,
+            "pixel_height": pixel_height,
+            "frame_rate": FRAME_RATE,
+            "media_dir": str(tmp_path / "media"),
+            "text_dir": str(tmp_path / "texts"),
+            "disable_caching": True,
+            "write_to_movie": True,
+            "save_last_frame": False,
+            "preview": False,
+        }
+    ):
+        renderer = CairoRenderer(file_writer_class=FrameRecorder)
+        if baseline:
+            scene_class = baseline_scene_class(animator, anim_config, groups)
+            scene = scene_class(renderer=renderer)
+        else:
+            scene = animator.CodeAnimation(
+                anim_config=anim_config, keep_text_dir=True, renderer=renderer
+            )
+        scene.render()
+    return scene.renderer.file_writer.frames
+
+
+def frame_signature(frame):
+    # dHash of the brightness (layout, glyph shapes) plus a 4x4 color
+    # thumbnail (syntax colors, which dHash barely sees)
+    image = Image.fromarray(frame[..., :3])
+    gray = image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS)
+    pixels = np.asarray(gray, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    dhash = f"{int(''.join('1' if bit else '0' for bit in bits), 2):064x}"
+    colors = np.asarray(image.resize((4, 4), Image.BOX), dtype=np.int16)
+    return {"dhash": dhash, "colors": colors.flatten().tolist()}
+
+
+def sample_signatures(frames):
+    ends = list(accumulate(count for _, count in frames))
+    total = ends[-1] if ends else 0
+    indexes = sorted(
+        {int(i) for i in np.linspace(0, total - 1, SAMPLES)} | {total - 1}
+    )
+    return total, {
+        str(index): frame_signature(frames[bisect_right(ends, index)][0])
+        for index in indexes
+    }
+
+
+def compare(golden, total, signatures):
+    problems = []
+    if golden["frames"] != total:
+        problems.append(f"{total} frames, golden has {golden['frames']}")
+        return problems  # Timing changed, sampled frames won't line up
+    for index, expected in golden["samples"].items():
+        actual = signatures[index]
+        distance = bin(int(expected["dhash"], 16) ^ int(actual["dhash"], 16)).count(
+            "1"
+        )
+        color_diff = max(
+            abs(a - b) for a, b in zip(expected["colors"], actual["colors"])
+        )
+        if distance > MAX_HASH_DISTANCE or color_diff > MAX_COLOR_DIFF:
+            problems.append(
+                f"frame {index}: dHash distance {distance}, color diff {color_diff}"
+            )
+    return problems
+
+
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_golden_frames(name, tmp_path, monkeypatch, update_goldens, golden_baseline):
+    case = CASES[name]
+    anim_config = case_config(case, tmp_path)
+    with SourceIndex(anim_config["script_path"]) as source:
+        source_lines = source.read_lines(*case["lines"])
+    plan = build_render_plan(anim_config, source_lines, first_line=case["lines"][0])
+    # Make sure the case still covers the path it's named after
+    assert plan["layout"]["enable_chunking"] == case.get("chunked", False)
+
+    baseline = None
+    if update_goldens and not case.get("diff_script"):
+        baseline = golden_baseline
+    frames = render_case(anim_config, tmp_path, monkeypatch, baseline, case["groups"])
+    assert frames, "Nothing was rendered"
+    total, signatures = sample_signatures(frames)
+
+    golden_path = GOLDENS_DIR / f"{name}.json"
+    if update_goldens:
+        golden_path.parent.mkdir(parents=True, exist_ok=True)
+        golden = {
+            "font": GOLDEN_FONT,
+            "pixels": PIXELS[anim_config["orientation"]],
+            "frame_rate": FRAME_RATE,
+            "renderer": "baseline" if baseline else "current",
+            "frames": total,
+            "samples": signatures,
+        }
+        golden_path.write_text(json.dumps(golden, indent=1) + "\n")
+        return
+    if not golden_path.exists():
+        message = f"No {name} golden, run with --update-goldens"
+        if os.environ.get("CI"):
+            pytest.fail(message)  # A skip would pass a CI run that checked nothing
+        pytest.skip(message)
+
+    problems = compare(json.loads(golden_path.read_text()), total, signatures)
+    if problems:
+        # Leave the final frame behind for a look at what changed
+        Image.fromarray(frames[-1][0][..., :3]).save(tmp_path / f"{name}_final.png")
+        pytest.fail(f"{name} differs from its golden: " + "; ".join(problems))